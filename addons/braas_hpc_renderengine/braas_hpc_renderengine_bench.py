@@ -0,0 +1,425 @@
+#####################################################################################################################
+# Copyright(C) 2011-2025 IT4Innovations National Supercomputing Center, VSB - Technical University of Ostrava
+#
+# This program is free software : you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+#####################################################################################################################
+
+#####################################################################################################################
+# Headless benchmark of the viewport pipeline against braas_hpc_renderengine_server.
+#
+# A UI thread moves the camera along a scripted path at the display rate (as ViewportEngine.draw does),
+# a render thread keeps the pipeline full (as ViewportEngine._do_sync_render does). Reports motion-to-photon
+# latency (camera change -> first frame rendered with that camera), frames/s and bytes/frame as JSON.
+#
+# Standalone, drives SocketTransport (from the addons directory):
+#   python -m braas_hpc_renderengine.braas_hpc_renderengine_bench --resolution 1920x1080 --pixsize 8 16 32 --rtt 0 0.04
+#
+# In Blender, drives BRaaSHPCContext and the texture upload of ViewportEngine.draw:
+#   blender -b --addons braas_hpc_renderengine --python-expr "from braas_hpc_renderengine import braas_hpc_renderengine_bench as b; b.main()" -- --engine
+#
+# UI-thread time of the texture upload alone (create_texture against TextureStaging), needs a GPU context, without -b:
+#   blender --addons braas_hpc_renderengine --python-expr "from braas_hpc_renderengine import braas_hpc_renderengine_bench as b; b.main()" -- --staging --band-rows 64
+#####################################################################################################################
+
+import argparse
+import itertools
+import json
+import math
+import sys
+import threading
+import time
+
+from collections import deque
+
+import numpy as np
+
+from . import braas_hpc_renderengine_transport
+from . import braas_hpc_renderengine_server
+
+CAMERA_PATHS = ('orbit', 'pan', 'zoom', 'still')
+
+#####################################################################################################################
+
+def look_at(eye, target):
+    """ Returns camera-to-world matrix (row-major, as mathutils.Matrix) looking from eye at target """
+    eye = np.asarray(eye, dtype=np.float64)
+    axis_z = eye - np.asarray(target, dtype=np.float64)
+    axis_z /= np.linalg.norm(axis_z)
+    axis_x = np.cross((0.0, 0.0, 1.0), axis_z)
+    axis_x /= np.linalg.norm(axis_x)
+    axis_y = np.cross(axis_z, axis_x)
+
+    matrix = np.identity(4, dtype=np.float32)
+    matrix[0:3, 0] = axis_x
+    matrix[0:3, 1] = axis_y
+    matrix[0:3, 2] = axis_z
+    matrix[0:3, 3] = eye
+    return matrix
+
+def camera_transform(path, t):
+    """ Returns the camera transform of the scripted path at time t in seconds """
+    if path == 'orbit':
+        angle = 0.5 * t
+        return look_at((5.0 * math.cos(angle), 5.0 * math.sin(angle), 2.0), (0.0, 0.0, 0.0))
+
+    if path == 'pan':
+        offset = math.sin(0.5 * t)
+        return look_at((5.0, offset, 2.0), (0.0, offset, 0.0))
+
+    if path == 'zoom':
+        distance = 5.0 + 2.0 * math.sin(0.5 * t)
+        return look_at((distance, 0.0, 2.0), (0.0, 0.0, 0.0))
+
+    if path == 'still':
+        return look_at((5.0, 0.0, 2.0), (0.0, 0.0, 0.0))
+
+    raise ValueError("Unknown camera path", path)
+
+def percentiles(values):
+    if len(values) == 0:
+        return {"p50": None, "p95": None, "p99": None, "mean": None, "count": 0}
+
+    p50, p95, p99 = np.percentile(values, (50, 95, 99))
+    return {"p50": float(p50), "p95": float(p95), "p99": float(p99), "mean": float(np.mean(values)), "count": len(values)}
+
+#####################################################################################################################
+
+class TransportSession:
+    """ Drives SocketTransport directly, mirrors the pipelining of BRaaSHPCContext """
+
+    def __init__(self, pipeline_depth):
+        self.transport = braas_hpc_renderengine_transport.SocketTransport()
+        self.pipeline_depth = pipeline_depth
+        self.camera_version = 0
+        self.camera_lock = threading.Lock()
+        self.frames_in_flight = deque()
+
+    def connect(self, host, port, width, height, pixsize, codec, use_delta):
+        self.transport.set_pixsize(pixsize)
+        self.transport.set_codec(codec, use_delta)
+        self.transport.client_init(host, port, width, height)
+        if self.transport.com_error():
+            raise Exception("TCP error")
+
+    def set_camera(self, transform):
+        transform = np.ascontiguousarray(transform, dtype=np.float32)
+        with self.camera_lock:
+            self.transport.set_camera(transform.ctypes.data, 0.8, 0.1, 100.0, 72.0, 72.0, 0, 1.0, 0.0, 0.0, 0, 0.0, 0.0, 0)
+            self.camera_version += 1
+
+    def fill_pipeline(self):
+        while len(self.frames_in_flight) < self.pipeline_depth:
+            with self.camera_lock:
+                self.transport.send_cam_data()
+                camera_version = self.camera_version
+
+            self.transport.send_braas_hpc_renderengine_data_render(b"", 0)
+            self.frames_in_flight.append(camera_version)
+
+    def recv_frame(self):
+        """ Returns the camera version the received frame was rendered with """
+        camera_version = self.frames_in_flight.popleft()
+        self.transport.recv_pixels_data()
+        if self.transport.com_error():
+            raise Exception("TCP error")
+
+        return camera_version
+
+    def draw(self):
+        # no GPU outside of Blender, the frame is "displayed" when it is received
+        self.transport.get_pixels_array()
+
+    def get_bytes_received(self):
+        return self.transport.get_bytes_received()
+
+    def get_codec_stats(self):
+        return self.transport.get_codec_stats()
+
+    def close(self):
+        while self.frames_in_flight:
+            self.recv_frame()
+
+        self.transport.client_close_connection()
+
+class ContextSession:
+    """ Drives BRaaSHPCContext inside Blender, with the Python Socket transport """
+
+    def __init__(self, pipeline_depth):
+        self.pipeline_depth = pipeline_depth
+        self.context = None
+        self.camera_lock = threading.Lock()
+
+    def connect(self, host, port, width, height, pixsize, codec, use_delta):
+        import bpy
+        from . import braas_hpc_renderengine_pref
+        from . import braas_hpc_renderengine_render
+
+        preferences = braas_hpc_renderengine_pref.preferences()
+        preferences.braas_hpc_renderengine_transport = braas_hpc_renderengine_transport.TRANSPORT_SOCKET
+        preferences.braas_hpc_renderengine_pixsize = str(pixsize)
+        preferences.braas_hpc_renderengine_codec = codec
+        preferences.braas_hpc_renderengine_use_delta = use_delta
+
+        self.background = bpy.app.background
+        self.render = braas_hpc_renderengine_render
+        self.context = braas_hpc_renderengine_render.BRaaSHPCContext()
+        self.context.init(bpy.context, host, port, width, height, 1, self.pipeline_depth)
+        self.context.client_init()
+
+    def set_camera(self, transform):
+        camera_data = self.render.CameraData()
+        camera_data.transform = tuple(tuple(row) for row in transform)
+        camera_data.focal_length = 0.8
+        camera_data.clip_plane = (0.1, 100.0)
+        camera_data.sensor_size = (72.0, 72.0)
+        camera_data.sensor_fit = 0
+        camera_data.view_camera_zoom = 1.0
+        camera_data.view_camera_offset = (0.0, 0.0)
+        camera_data.use_view_camera = 0
+        camera_data.shift_x = 0.0
+        camera_data.shift_y = 0.0
+        camera_data.view_perspective = 0
+
+        with self.camera_lock:
+            self.context.set_camera(camera_data)
+
+    def fill_pipeline(self):
+        with self.camera_lock:
+            self.context.fill_pipeline()
+
+    def recv_frame(self):
+        seq, camera_version, key, projection, send_time = self.context.frames_in_flight[0]
+        self.context.recv_frame()
+        return camera_version
+
+    def draw(self):
+        # texture upload of ViewportEngine.draw, needs a GPU context
+        if not self.background:
+            self.context.get_texture()
+
+    def get_bytes_received(self):
+        return self.context.transport.get_bytes_received()
+
+    def get_codec_stats(self):
+        return self.context.get_codec_stats()
+
+    def close(self):
+        self.context.client_close_connection()
+
+#####################################################################################################################
+
+def run_case(width, height, pixsize, rtt=0.0, bandwidth=0.0, render_time=0.005, pipeline_depth=1,
+             path='orbit', duration=3.0, display_hz=60.0, engine=False, codec='RAW', use_delta=False):
+    """ Runs one benchmark case against a new stand-in server, returns the results as dict """
+
+    settings = braas_hpc_renderengine_server.FakeRenderSettings(render_time, rtt, bandwidth)
+    server = braas_hpc_renderengine_server.FakeRenderServer("localhost", 0, settings).start()
+
+    session = ContextSession(pipeline_depth) if engine else TransportSession(pipeline_depth)
+
+    # camera_version -> time of the camera change
+    camera_changes = {}
+    # (time, camera_version) of every received frame
+    frames = []
+    draw_times = []
+    errors = []
+    stop = threading.Event()
+
+    try:
+        session.connect("localhost", server.port, width, height, pixsize, codec, use_delta)
+
+        time_begin = time.perf_counter()
+        session.set_camera(camera_transform(path, 0.0))
+        camera_changes[1] = time_begin
+
+        def render_thread():
+            try:
+                while not stop.is_set():
+                    session.fill_pipeline()
+                    camera_version = session.recv_frame()
+                    frames.append((time.perf_counter(), camera_version))
+            except Exception as e:
+                errors.append(str(e))
+
+        thread = threading.Thread(target=render_thread)
+        thread.start()
+
+        # UI thread
+        transform = None
+        camera_version = 1
+        period = 1.0 / display_hz
+        while time.perf_counter() - time_begin < duration and thread.is_alive():
+            now = time.perf_counter()
+            next_transform = camera_transform(path, now - time_begin)
+
+            if transform is None or not np.array_equal(transform, next_transform):
+                transform = next_transform
+                session.set_camera(transform)
+                camera_version += 1
+                camera_changes[camera_version] = time.perf_counter()
+
+            time_draw = time.perf_counter()
+            session.draw()
+            draw_times.append(time.perf_counter() - time_draw)
+
+            time.sleep(max(0.0, period - (time.perf_counter() - now)))
+
+        stop.set()
+        thread.join()
+        time_end = time.perf_counter()
+
+        bytes_received = session.get_bytes_received()
+        codec_stats = session.get_codec_stats()
+        session.close()
+
+    finally:
+        server.stop()
+
+    # motion-to-photon: a camera change is displayed by the first frame rendered with it or a later camera
+    latencies = []
+    versions = sorted(camera_changes)
+    next_version = 0
+    for time_frame, frame_version in frames:
+        while next_version < len(versions) and versions[next_version] <= frame_version:
+            latencies.append(time_frame - camera_changes[versions[next_version]])
+            next_version += 1
+
+    elapsed = time_end - time_begin
+    frames_count = len(frames)
+
+    return {
+        "config": {
+            "width": width,
+            "height": height,
+            "pixsize": pixsize,
+            "rtt": rtt,
+            "bandwidth": bandwidth,
+            "render_time": render_time,
+            "pipeline_depth": pipeline_depth,
+            "path": path,
+            "duration": duration,
+            "display_hz": display_hz,
+            "engine": engine,
+            "codec": codec,
+            "delta": use_delta,
+        },
+        "codec": codec_stats,
+        "frames": frames_count,
+        "frames_per_second": frames_count / elapsed if elapsed > 0 else 0.0,
+        "latency_ms": {key: (value * 1000.0 if key != "count" and value is not None else value)
+                       for key, value in percentiles(latencies).items()},
+        "draw_ms": {key: (value * 1000.0 if key != "count" and value is not None else value)
+                    for key, value in percentiles(draw_times).items()},
+        "bytes_per_frame": bytes_received / frames_count if frames_count and bytes_received is not None else None,
+        "megabits_per_second": bytes_received * 8.0 / elapsed / 1e6 if elapsed > 0 and bytes_received is not None else None,
+        "errors": errors,
+    }
+
+def run_staging(width, height, pixsize, frames=100, band_rows=0):
+    """
+    UI-thread time of the texture upload per view_draw: create_texture (conversion to float32) against TextureStaging,
+    and TextureStaging.update_rows for frames received in bands of band_rows. Needs Blender with a GPU context
+    """
+    from . import braas_hpc_renderengine_render
+
+    dtype = braas_hpc_renderengine_transport.pixels_dtype(pixsize)
+    pixels = (np.random.default_rng(0).random((height, width, braas_hpc_renderengine_transport.CHANNELS)) * 255).astype(dtype)
+
+    def measure(upload):
+        times = []
+        for seq in range(frames):
+            time_begin = time.perf_counter()
+            upload(seq)
+            times.append(time.perf_counter() - time_begin)
+
+        return {key: (value * 1000.0 if key != "count" and value is not None else value)
+                for key, value in percentiles(times).items()}
+
+    staging = braas_hpc_renderengine_render.TextureStaging()
+    results = {
+        "create_texture_ms": measure(lambda seq: braas_hpc_renderengine_render.create_texture(pixels)),
+        "staging_ms": measure(lambda seq: staging.create_texture(pixels)),
+    }
+
+    if band_rows > 0:
+        def upload_bands(seq):
+            # one view_draw per received band, from the top
+            for y in range(height - band_rows, -band_rows, -band_rows):
+                staging.update_rows(seq, pixels, max(0, y), allocate=True)
+
+        results["staging_bands_ms"] = measure(upload_bands)
+
+    staging.free()
+
+    return {
+        "config": {
+            "width": width,
+            "height": height,
+            "pixsize": pixsize,
+            "frames": frames,
+            "band_rows": band_rows,
+        },
+        **results,
+    }
+
+#####################################################################################################################
+
+def parse_resolution(value):
+    width, height = value.lower().split("x")
+    return int(width), int(height)
+
+def main(argv=None):
+    if argv is None:
+        # arguments after "--" when running inside Blender
+        argv = sys.argv[sys.argv.index("--") + 1:] if "--" in sys.argv else sys.argv[1:]
+
+    parser = argparse.ArgumentParser(description="BRaaS-HPC viewport latency/throughput benchmark")
+    parser.add_argument("--resolution", type=parse_resolution, nargs="+", default=[(1280, 720)])
+    parser.add_argument("--pixsize", type=int, nargs="+", choices=(8, 16, 32), default=[8])
+    parser.add_argument("--rtt", type=float, nargs="+", default=[0.0], help="simulated round trip time [s]")
+    parser.add_argument("--bandwidth", type=float, nargs="+", default=[0.0], help="simulated bandwidth [bytes/s], 0 = unlimited")
+    parser.add_argument("--render-time", type=float, default=0.005, help="server render time per frame [s]")
+    parser.add_argument("--depth", type=int, nargs="+", default=[1], help="pipeline depth")
+    parser.add_argument("--path", choices=CAMERA_PATHS, nargs="+", default=['orbit'])
+    parser.add_argument("--duration", type=float, default=3.0, help="duration of one case [s]")
+    parser.add_argument("--display-hz", type=float, default=60.0)
+    parser.add_argument("--codec", nargs="+", default=['RAW'], help="requested codecs, see braas_hpc_renderengine_codec")
+    parser.add_argument("--delta", action="store_true", help="delta frames for the lossless codecs")
+    parser.add_argument("--engine", action="store_true", help="drive BRaaSHPCContext, requires Blender")
+    parser.add_argument("--staging", action="store_true", help="time the texture upload only, requires Blender with a GPU context")
+    parser.add_argument("--band-rows", type=int, default=0, help="rows of one band for --staging, 0 = whole frames")
+    parser.add_argument("--output", help="JSON file, default is stdout")
+    args = parser.parse_args(argv)
+
+    results = []
+    if args.staging:
+        for (width, height), pixsize in itertools.product(args.resolution, args.pixsize):
+            results.append(run_staging(width, height, pixsize, band_rows=args.band_rows))
+    else:
+        for (width, height), pixsize, rtt, bandwidth, depth, path, codec in itertools.product(
+                args.resolution, args.pixsize, args.rtt, args.bandwidth, args.depth, args.path, args.codec):
+            results.append(run_case(width, height, pixsize, rtt, bandwidth, args.render_time, depth,
+                                    path, args.duration, args.display_hz, args.engine, codec, args.delta))
+
+    report = json.dumps({"results": results}, indent=2)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(report)
+    else:
+        print(report)
+
+if __name__ == "__main__":
+    main()
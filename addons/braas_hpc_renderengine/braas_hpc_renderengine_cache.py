@@ -0,0 +1,107 @@
+#####################################################################################################################
+# Copyright(C) 2011-2025 IT4Innovations National Supercomputing Center, VSB - Technical University of Ostrava
+#
+# This program is free software : you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+#####################################################################################################################
+
+#####################################################################################################################
+# Client side cache of received frames for timeline scrubbing.
+#
+# Frames are keyed by (timestep, camera, width, height, pixsize, command script digest), see
+# BRaaSHPCContext.get_frame_key. The viewport caches converged frames only. Only the frame with the most samples
+# is kept per key, the least recently used frames are dropped when the memory budget is exceeded. This module
+# does not import bpy.
+#####################################################################################################################
+
+import threading
+
+from collections import OrderedDict
+
+#####################################################################################################################
+
+class FrameCache:
+    """ LRU cache of (pixels, samples) with a memory budget in bytes, 0 disables the cache """
+
+    def __init__(self, budget=0):
+        self.budget = budget
+        self.frames = OrderedDict()
+        self.nbytes = 0
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.frames)
+
+    def set_budget(self, budget):
+        with self.lock:
+            self.budget = budget
+            self._evict()
+
+    def clear(self):
+        with self.lock:
+            self.frames.clear()
+            self.nbytes = 0
+
+    def _evict(self):
+        while self.frames and self.nbytes > self.budget:
+            key, (pixels, samples) = self.frames.popitem(last=False)
+            self.nbytes -= pixels.nbytes
+
+    def get(self, key):
+        """ Returns (pixels, samples) or None """
+        with self.lock:
+            frame = self.frames.get(key)
+            if frame is None:
+                self.misses += 1
+                return None
+
+            self.frames.move_to_end(key)
+            self.hits += 1
+            return frame
+
+    def get_samples(self, key):
+        """ Returns the number of samples of the cached frame, 0 if there is none. Does not count as use """
+        with self.lock:
+            frame = self.frames.get(key)
+            return frame[1] if frame is not None else 0
+
+    def put(self, key, pixels, samples):
+        """ Stores the frame unless the cached one has more samples. The pixels must not be modified afterwards """
+        if pixels is None or pixels.nbytes > self.budget:
+            return
+
+        with self.lock:
+            frame = self.frames.get(key)
+            if frame is not None:
+                if frame[1] > samples:
+                    self.frames.move_to_end(key)
+                    return
+
+                self.nbytes -= frame[0].nbytes
+
+            self.frames[key] = (pixels, samples)
+            self.frames.move_to_end(key)
+            self.nbytes += pixels.nbytes
+            self._evict()
+
+    def get_stats(self):
+        return {
+            "frames": len(self.frames),
+            "mbytes": self.nbytes / (1024.0 * 1024.0),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
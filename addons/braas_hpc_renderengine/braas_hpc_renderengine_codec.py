@@ -0,0 +1,259 @@
+#####################################################################################################################
+# Copyright(C) 2011-2025 IT4Innovations National Supercomputing Center, VSB - Technical University of Ostrava
+#
+# This program is free software : you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+#####################################################################################################################
+
+#####################################################################################################################
+# CPU codecs for the pixel stream of SocketTransport.
+#
+# Lossless codecs (ZLIB, LZ4, ZSTD) work for all pixel sizes and can encode the difference to the previous
+# frame (delta). Lossy codecs (JPEG, WEBP) are for 8-bit frames only. LZ4, ZSTD, JPEG and WEBP need
+# optional modules (lz4, zstandard, Pillow), is_available() tells if they can be used.
+#
+# This module does not import bpy, it is shared with braas_hpc_renderengine_server.
+#####################################################################################################################
+
+import io
+import time
+import zlib
+
+import numpy as np
+
+try:
+    import lz4.frame as lz4_frame
+except ImportError:
+    lz4_frame = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+CODEC_RAW = 'RAW'
+
+# frame flags
+FRAME_DELTA = 1
+
+#####################################################################################################################
+
+def xor_frames(data, previous):
+    """ Byte-wise XOR of two encoded frames of the same size, the delta of unchanged pixels is zero """
+    a = np.frombuffer(data, dtype=np.uint8)
+    b = np.frombuffer(previous, dtype=np.uint8)
+    return np.bitwise_xor(a, b).tobytes()
+
+class RawCodec:
+    """ Uncompressed RGBA """
+
+    name = CODEC_RAW
+    lossless = True
+
+    def __init__(self, quality=90):
+        self.quality = quality
+
+    @staticmethod
+    def is_available():
+        return True
+
+    @classmethod
+    def supports(cls, pixsize):
+        return cls.lossless or pixsize == 8
+
+    def compress(self, data):
+        return data
+
+    def decompress(self, data, size):
+        return data
+
+    def encode(self, pixels):
+        """ Returns bytes with the (height, width, 4) pixels """
+        return self.compress(pixels.tobytes())
+
+    def decode(self, data, shape, dtype):
+        """ Returns (height, width, 4) array of dtype """
+        size = int(np.prod(shape)) * np.dtype(dtype).itemsize
+        return np.frombuffer(self.decompress(data, size), dtype=dtype).reshape(shape)
+
+class ZlibCodec(RawCodec):
+    name = 'ZLIB'
+
+    def compress(self, data):
+        return zlib.compress(data, 1)
+
+    def decompress(self, data, size):
+        return zlib.decompress(data)
+
+class Lz4Codec(RawCodec):
+    name = 'LZ4'
+
+    @staticmethod
+    def is_available():
+        return lz4_frame is not None
+
+    def compress(self, data):
+        return lz4_frame.compress(data)
+
+    def decompress(self, data, size):
+        return lz4_frame.decompress(data)
+
+class ZstdCodec(RawCodec):
+    name = 'ZSTD'
+
+    @staticmethod
+    def is_available():
+        return zstandard is not None
+
+    def compress(self, data):
+        return zstandard.ZstdCompressor(level=1).compress(data)
+
+    def decompress(self, data, size):
+        return zstandard.ZstdDecompressor().decompress(data, max_output_size=size)
+
+class JpegCodec(RawCodec):
+    """ Lossy RGB, the alpha channel is compressed losslessly """
+
+    name = 'JPEG'
+    lossless = False
+
+    @staticmethod
+    def is_available():
+        return Image is not None
+
+    def encode(self, pixels):
+        f = io.BytesIO()
+        Image.fromarray(np.ascontiguousarray(pixels[:, :, 0:3])).save(f, format='JPEG', quality=self.quality)
+        rgb = f.getvalue()
+        alpha = zlib.compress(np.ascontiguousarray(pixels[:, :, 3]).tobytes(), 1)
+        return len(rgb).to_bytes(4, 'little') + rgb + alpha
+
+    def decode(self, data, shape, dtype):
+        rgb_size = int.from_bytes(data[0:4], 'little')
+        pixels = np.empty(shape, dtype=np.uint8)
+        pixels[:, :, 0:3] = np.asarray(Image.open(io.BytesIO(data[4:4 + rgb_size])).convert('RGB'))
+        pixels[:, :, 3] = np.frombuffer(zlib.decompress(data[4 + rgb_size:]), dtype=np.uint8).reshape(shape[0:2])
+        return pixels
+
+class WebpCodec(RawCodec):
+    """ Lossy RGBA """
+
+    name = 'WEBP'
+    lossless = False
+
+    @staticmethod
+    def is_available():
+        return Image is not None
+
+    def encode(self, pixels):
+        f = io.BytesIO()
+        Image.fromarray(pixels, 'RGBA').save(f, format='WEBP', quality=self.quality)
+        return f.getvalue()
+
+    def decode(self, data, shape, dtype):
+        return np.asarray(Image.open(io.BytesIO(data)).convert('RGBA'))
+
+CODECS = {codec.name: codec for codec in (RawCodec, ZlibCodec, Lz4Codec, ZstdCodec, JpegCodec, WebpCodec)}
+
+#####################################################################################################################
+
+def available_codecs(pixsize):
+    """ Returns names of the codecs that can be used in this Python for the pixel size """
+    return [name for name, codec in CODECS.items() if codec.is_available() and codec.supports(pixsize)]
+
+def negotiate(requested, supported, pixsize):
+    """ Returns the first requested codec which is supported and available here, RAW if there is none """
+    for name in requested:
+        if name in supported and name in CODECS and CODECS[name].is_available() and CODECS[name].supports(pixsize):
+            return name
+
+    return CODEC_RAW
+
+def create_codec(name, quality=90):
+    return CODECS[name](quality)
+
+#####################################################################################################################
+
+class FrameEncoder:
+    """ Server side, encodes frames with the codec and optionally as delta to the previous frame """
+
+    def __init__(self, codec, use_delta=False):
+        self.codec = codec
+        self.use_delta = use_delta and codec.lossless
+        self.previous = None
+
+    def reset(self):
+        """ The next frame is a key frame, e.g. after resize """
+        self.previous = None
+
+    def encode(self, pixels):
+        """ Returns (flags, data) """
+        if not self.use_delta:
+            return 0, self.codec.encode(pixels)
+
+        raw = pixels.tobytes()
+        if self.previous is None or len(self.previous) != len(raw):
+            self.previous = raw
+            return 0, self.codec.compress(raw)
+
+        data = self.codec.compress(xor_frames(raw, self.previous))
+        self.previous = raw
+        return FRAME_DELTA, data
+
+class FrameDecoder:
+    """ Client side counterpart of FrameEncoder, collects compression ratio and decode time """
+
+    def __init__(self, codec, use_delta=False):
+        self.codec = codec
+        self.use_delta = use_delta and codec.lossless
+        self.previous = None
+
+        self.frames = 0
+        self.raw_bytes = 0
+        self.encoded_bytes = 0
+        self.decode_time = 0.0
+
+    def decode(self, flags, data, shape, dtype):
+        time_begin = time.perf_counter()
+
+        if self.use_delta:
+            raw = self.codec.decompress(data, int(np.prod(shape)) * np.dtype(dtype).itemsize)
+            if flags & FRAME_DELTA:
+                raw = xor_frames(raw, self.previous)
+
+            self.previous = raw
+            pixels = np.frombuffer(raw, dtype=dtype).reshape(shape)
+        else:
+            pixels = self.codec.decode(data, shape, dtype)
+
+        self.frames += 1
+        self.raw_bytes += pixels.nbytes
+        self.encoded_bytes += len(data)
+        self.decode_time += time.perf_counter() - time_begin
+
+        return pixels
+
+    def get_stats(self):
+        """ Returns dict with the codec name, compression ratio and average decode time in ms """
+        return {
+            "codec": self.codec.name,
+            "frames": self.frames,
+            "ratio": self.raw_bytes / self.encoded_bytes if self.encoded_bytes > 0 else 1.0,
+            "decode_ms": self.decode_time * 1000.0 / self.frames if self.frames > 0 else 0.0,
+        }
@@ -27,6 +27,20 @@ pixsize_items = [
     ("32", "32 (RGBA - FLOAT)", ""),
 ]
 
+transport_items = [
+    ("DLL", "Native (braas_hpc_renderengine_dll)", "Native client library, falls back to Python Socket when it is not available"),
+    ("SOCKET", "Python Socket", "Pure-Python client with its own protocol, for braas_hpc_renderengine_server and render servers implementing it"),
+]
+
+codec_items = [
+    ("RAW", "Raw", "Uncompressed RGBA"),
+    ("ZLIB", "Zlib", "Lossless, all pixel sizes"),
+    ("LZ4", "LZ4", "Lossless, all pixel sizes, needs the lz4 module"),
+    ("ZSTD", "Zstd", "Lossless, all pixel sizes, needs the zstandard module"),
+    ("JPEG", "JPEG", "Lossy, 8-bit only, needs Pillow"),
+    ("WEBP", "WebP", "Lossy, 8-bit only, needs Pillow"),
+]
+
 class BRaaSHPCRenderEnginePreferences(bpy.types.AddonPreferences):
     bl_idname = ADDON_NAME
 
@@ -53,6 +67,41 @@ class BRaaSHPCRenderEnginePreferences(bpy.types.AddonPreferences):
         default=False
     ) # type: ignore    
 
+    braas_hpc_renderengine_transport: bpy.props.EnumProperty(
+        name="Transport",
+        items=transport_items,
+        default="DLL"
+    ) # type: ignore
+
+    braas_hpc_renderengine_codec: bpy.props.EnumProperty(
+        name="Codec",
+        description="CPU codec of the pixel stream (Python Socket transport), negotiated with the server",
+        items=codec_items,
+        default="RAW"
+    ) # type: ignore
+
+    braas_hpc_renderengine_use_delta: bpy.props.BoolProperty(
+        name="Delta Frames",
+        description="Send lossless frames as difference to the previous frame",
+        default=False
+    ) # type: ignore
+
+    braas_hpc_renderengine_codec_quality: bpy.props.IntProperty(
+        name="Quality",
+        description="Quality of the lossy codecs",
+        min=1,
+        max=100,
+        default=90
+    ) # type: ignore
+
+    braas_hpc_renderengine_session_grace_period: bpy.props.FloatProperty(
+        name="Keep Connection",
+        description="Seconds a connection stays open after the viewport render stops, a new viewport render reuses it. 0 = close at once",
+        min=0.0,
+        max=3600.0,
+        default=60.0
+    ) # type: ignore
+
     def draw(self, context):
         layout = self.layout
 
@@ -61,6 +110,14 @@ class BRaaSHPCRenderEnginePreferences(bpy.types.AddonPreferences):
         col = box.column()
         col.prop(self, "braas_hpc_renderengine_use_gpujpeg", text="Use GPUJPEG")
         col.prop(self, "braas_hpc_renderengine_pixsize", text="Pixel Size")
+        col.prop(self, "braas_hpc_renderengine_transport", text="Transport")
+        col.prop(self, "braas_hpc_renderengine_session_grace_period", text="Keep Connection (s)")
+
+        col = box.column()
+        col.enabled = self.braas_hpc_renderengine_transport == "SOCKET"
+        col.prop(self, "braas_hpc_renderengine_codec", text="Codec")
+        col.prop(self, "braas_hpc_renderengine_use_delta", text="Delta Frames")
+        col.prop(self, "braas_hpc_renderengine_codec_quality", text="Quality")
         # col.prop(self, "braas_hpc_renderengine_server_name", text="Server")
         # col.prop(self, "braas_hpc_renderengine_port", text="Port")
 
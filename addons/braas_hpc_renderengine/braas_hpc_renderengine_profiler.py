@@ -0,0 +1,171 @@
+#####################################################################################################################
+# Copyright(C) 2011-2025 IT4Innovations National Supercomputing Center, VSB - Technical University of Ostrava
+#
+# This program is free software : you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+#####################################################################################################################
+
+#####################################################################################################################
+# Per-stage timers of the viewport pipeline.
+#
+# Usage:
+#   time_begin = time.perf_counter()
+#   transport.send_cam_data()
+#   profiler.add(STAGE_SEND_CAM_DATA, time_begin)
+#
+# Events are kept in a fixed size ring buffer, export_chrome_trace() writes them for chrome://tracing
+# or https://ui.perfetto.dev. This module does not import bpy.
+#####################################################################################################################
+
+import json
+import threading
+import time
+
+import numpy as np
+
+STAGE_SET_TIMESTEP = 0
+STAGE_SEND_CAM_DATA = 1
+STAGE_SEND_DATA_RENDER = 2
+STAGE_RECV_PIXELS_DATA = 3
+STAGE_TEXTURE_UPLOAD = 4
+STAGE_DRAW = 5
+
+STAGE_NAMES = (
+    "set_timestep",
+    "send_cam_data",
+    "send_braas_hpc_renderengine_data_render",
+    "recv_pixels_data",
+    "texture_upload",
+    "draw",
+)
+
+# histogram bins in seconds, 10 us .. 10 s
+HISTOGRAM_BINS = np.logspace(-5, 1, 25)
+
+EVENT_DTYPE = np.dtype([
+    ("stage", np.uint8),
+    ("thread", np.uint64),
+    ("begin", np.float64),
+    ("duration", np.float64),
+])
+
+#####################################################################################################################
+
+class FrameProfiler:
+    """ Ring buffer of (stage, thread, begin, duration) events, shared by the render and the UI thread """
+
+    def __init__(self, capacity=16384):
+        self.enabled = False
+        self.events = np.zeros(capacity, dtype=EVENT_DTYPE)
+        self.count = 0
+        self.lock = threading.Lock()
+        self.time_origin = time.perf_counter()
+
+    def clear(self):
+        with self.lock:
+            self.count = 0
+            self.time_origin = time.perf_counter()
+
+    def add(self, stage, time_begin, time_end=None):
+        """ Records stage which started at time_begin (time.perf_counter) and ends now or at time_end """
+        if not self.enabled:
+            return
+
+        if time_end is None:
+            time_end = time.perf_counter()
+
+        with self.lock:
+            self.events[self.count % len(self.events)] = (stage, threading.get_ident(), time_begin, time_end - time_begin)
+            self.count += 1
+
+    def get_events(self):
+        """ Returns copy of the recorded events, oldest first """
+        with self.lock:
+            capacity = len(self.events)
+            if self.count <= capacity:
+                return self.events[:self.count].copy()
+
+            start = self.count % capacity
+            return np.concatenate((self.events[start:], self.events[:start]))
+
+    def get_durations(self, stage, events=None):
+        if events is None:
+            events = self.get_events()
+
+        return events["duration"][events["stage"] == stage]
+
+    def summary(self):
+        """ Returns {stage name: {count, mean, p50, p95, p99, max}} in milliseconds """
+        events = self.get_events()
+
+        result = {}
+        for stage, name in enumerate(STAGE_NAMES):
+            durations = self.get_durations(stage, events) * 1000.0
+            if len(durations) == 0:
+                continue
+
+            p50, p95, p99 = np.percentile(durations, (50, 95, 99))
+            result[name] = {
+                "count": len(durations),
+                "mean": float(np.mean(durations)),
+                "p50": float(p50),
+                "p95": float(p95),
+                "p99": float(p99),
+                "max": float(np.max(durations)),
+            }
+
+        return result
+
+    def histograms(self):
+        """ Returns {stage name: counts} over HISTOGRAM_BINS """
+        events = self.get_events()
+
+        result = {}
+        for stage, name in enumerate(STAGE_NAMES):
+            counts, edges = np.histogram(self.get_durations(stage, events), bins=HISTOGRAM_BINS)
+            result[name] = counts.tolist()
+
+        return result
+
+    def export_chrome_trace(self, filepath):
+        """ Writes the events in the Chrome trace event format """
+        events = self.get_events()
+
+        threads = {}
+        trace_events = []
+        for event in events:
+            tid = threads.setdefault(int(event["thread"]), len(threads))
+            trace_events.append({
+                "name": STAGE_NAMES[event["stage"]],
+                "cat": "braas_hpc_renderengine",
+                "ph": "X",
+                "ts": (float(event["begin"]) - self.time_origin) * 1e6,
+                "dur": float(event["duration"]) * 1e6,
+                "pid": 0,
+                "tid": tid,
+            })
+
+        with open(filepath, "w") as f:
+            json.dump({"traceEvents": trace_events, "displayTimeUnit": "ms"}, f)
+
+    def export_json(self, filepath):
+        """ Writes the summary and the histograms """
+        report = {
+            "summary_ms": self.summary(),
+            "histogram_bins_s": HISTOGRAM_BINS.tolist(),
+            "histograms": self.histograms(),
+        }
+
+        with open(filepath, "w") as f:
+            json.dump(report, f, indent=2)
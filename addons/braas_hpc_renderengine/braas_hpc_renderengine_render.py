@@ -24,24 +24,33 @@ import bpy
 import time
 
 import textwrap
+import hashlib
+import copy
 import weakref
 import threading
 
+from collections import deque
+
 import numpy as np
 import math
 
 import gpu
+from gpu_extras.batch import batch_for_shader
 
 from dataclasses import dataclass
 
-from mathutils import Matrix
+from mathutils import Matrix, Quaternion, Vector
+from bpy_extras import view3d_utils
+from bpy_extras.io_utils import ExportHelper
 
 from . import braas_hpc_renderengine_pref
-
-try:
-    from . import braas_hpc_renderengine_dll
-except:
-    import braas_hpc_renderengine_dll
+from . import braas_hpc_renderengine_transport
+from . import braas_hpc_renderengine_codec
+from . import braas_hpc_renderengine_profiler
+from . import braas_hpc_renderengine_cache
+from . import braas_hpc_renderengine_session
+from .braas_hpc_renderengine_profiler import (STAGE_SET_TIMESTEP, STAGE_SEND_CAM_DATA, STAGE_SEND_DATA_RENDER,
+                                              STAGE_RECV_PIXELS_DATA, STAGE_TEXTURE_UPLOAD, STAGE_DRAW)
 
 #####################################################################################################################
 
@@ -65,6 +74,19 @@ class BRaaSHPCShowPopupErrorMessage(bpy.types.Operator):
         return wm.invoke_props_dialog(self)
     
 #####################################################################################################################    
+class BRaaSHPCServerEndpoint(bpy.types.PropertyGroup):
+    server_name: bpy.props.StringProperty(
+        name="Server",
+        default="localhost"
+    ) # type: ignore
+
+    port: bpy.props.IntProperty(
+        name="Port",
+        min=0,
+        max=65565,
+        default=7001
+    ) # type: ignore
+
 class BRaaSHPCServerSettings(bpy.types.PropertyGroup):
 
     braas_hpc_renderengine_port: bpy.props.IntProperty(
@@ -78,6 +100,21 @@ class BRaaSHPCServerSettings(bpy.types.PropertyGroup):
         name="Server",
         default="localhost"
     ) # type: ignore
+
+    use_multi_server: bpy.props.BoolProperty(
+        name="Multiple Servers",
+        description="Split the image into strips rendered by the server above and the additional servers. Uses the Socket transport protocol",
+        default=False
+    ) # type: ignore
+
+    servers: bpy.props.CollectionProperty(
+        type=BRaaSHPCServerEndpoint,
+        name="Additional Servers"
+    ) # type: ignore
+
+    servers_index: bpy.props.IntProperty(
+        default=0
+    ) # type: ignore
         
     width: bpy.props.IntProperty(
         name="Width",
@@ -103,6 +140,148 @@ class BRaaSHPCServerSettings(bpy.types.PropertyGroup):
         default=1
     ) # type: ignore
 
+    max_samples: bpy.props.IntProperty(
+        name="Max Samples",
+        description="Stop refining and wait for changes once the server reports this many samples. 0 = unlimited",
+        min=0,
+        default=256
+    ) # type: ignore
+
+    use_adaptive_resolution: bpy.props.BoolProperty(
+        name="Adaptive Resolution",
+        description="Render at a reduced resolution while the camera moves to meet the frame time budget",
+        default=False
+    ) # type: ignore
+
+    frame_time_budget: bpy.props.FloatProperty(
+        name="Frame Time Budget",
+        description="Target time between frames during camera navigation, in milliseconds",
+        min=1.0,
+        max=1000.0,
+        default=33.3
+    ) # type: ignore
+
+    min_resolution_scale: bpy.props.FloatProperty(
+        name="Min Resolution Scale",
+        min=0.125,
+        max=1.0,
+        default=0.25
+    ) # type: ignore
+
+    use_auto_format: bpy.props.BoolProperty(
+        name="Auto Stream Format",
+        description="While the camera moves, lower the pixel size and switch to a lossy codec when the measured link cannot transfer a frame within the frame time budget. The preferred format is used while the camera is still (Socket transport)",
+        default=False
+    ) # type: ignore
+
+    use_foveated: bpy.props.BoolProperty(
+        name="Foveated Rendering",
+        description="While the camera moves, render a region of interest at full resolution and the rest of the view at a reduced one (Socket transport)",
+        default=False
+    ) # type: ignore
+
+    foveated_center: bpy.props.EnumProperty(
+        name="Center",
+        items=[
+            ('MOUSE', "Mouse", "Region around the mouse while Track Mouse is on, the view center otherwise"),
+            ('CURSOR', "3D Cursor", "Region around the 3D cursor"),
+            ('VIEW', "View Center", "Region in the middle of the view"),
+        ],
+        default='MOUSE'
+    ) # type: ignore
+
+    foveated_size: bpy.props.FloatProperty(
+        name="Size",
+        description="Size of the region of interest relative to the shorter side of the view",
+        min=0.05,
+        max=1.0,
+        default=0.3
+    ) # type: ignore
+
+    foveated_periphery_scale: bpy.props.FloatProperty(
+        name="Periphery Scale",
+        description="Resolution scale of the rest of the view while the camera moves",
+        min=0.125,
+        max=1.0,
+        default=0.5
+    ) # type: ignore
+
+    use_reprojection: bpy.props.BoolProperty(
+        name="Reproject Last Frame",
+        description="While the camera moves, warp the last frame to the current view until a new frame arrives",
+        default=True
+    ) # type: ignore
+
+    use_camera_prediction: bpy.props.BoolProperty(
+        name="Predict Camera Motion",
+        description="While the camera moves, request the view extrapolated one round trip ahead. The real view is sent when the motion changes or stops",
+        default=False
+    ) # type: ignore
+
+    use_depth_composite: bpy.props.BoolProperty(
+        name="Depth Composite",
+        description="Receive the depth of the volume with the frames so that Blender overlays are hidden behind it (Socket transport, applied when the viewport render starts)",
+        default=False
+    ) # type: ignore
+
+    pipeline_depth: bpy.props.IntProperty(
+        name="Pipeline Depth",
+        description="Number of camera requests kept in flight. 1 = strict request/response per frame. "
+                    "The native module is lockstep and always uses 1",
+        min=1,
+        max=8,
+        default=1
+    ) # type: ignore
+
+    band_rows: bpy.props.IntProperty(
+        name="Progressive Bands",
+        description="Stream frames in bands of this many rows, shown as they arrive. 0 = whole frames (Socket transport, single server)",
+        min=0,
+        max=4096,
+        default=0
+    ) # type: ignore
+
+    use_profiling: bpy.props.BoolProperty(
+        name="Profiling",
+        description="Record per-stage timings of the viewport pipeline",
+        default=False
+    ) # type: ignore
+
+    final_samples: bpy.props.IntProperty(
+        name="Final Samples",
+        description="Number of samples of the final render",
+        min=1,
+        default=64
+    ) # type: ignore
+
+    use_pass_samples: bpy.props.BoolProperty(
+        name="Samples Pass",
+        description="Add the samples per pixel as a render pass of the final render, depth and normal follow the view layer passes",
+        default=False
+    ) # type: ignore
+
+    use_final_prefetch: bpy.props.BoolProperty(
+        name="Prefetch Next Frame",
+        description="During animation render, request the next frame while the previous one is written. Used with Persistent Data and when the camera is not animated",
+        default=True
+    ) # type: ignore
+
+    frame_cache_size: bpy.props.IntProperty(
+        name="Frame Cache",
+        description="Memory for converged frames, reused when the timeline returns to a visited timestep. 0 = disabled",
+        min=0,
+        max=65536,
+        default=128
+    ) # type: ignore
+
+    prefetch_timesteps: bpy.props.IntProperty(
+        name="Prefetch Timesteps",
+        description="Number of timesteps around the current one rendered into the frame cache while the viewport is idle",
+        min=0,
+        max=100,
+        default=2
+    ) # type: ignore
+
     # mat_volume: bpy.props.PointerProperty(
     #     type=bpy.types.Material
     # ) # type: ignore
@@ -112,6 +291,12 @@ class BRaaSHPCServerSettings(bpy.types.PropertyGroup):
         name="Command Script"
     ) # type: ignore    
 
+    use_script_diff: bpy.props.BoolProperty(
+        name="Send Script Diffs",
+        description="Send only the changed part of large command scripts, if the server supports it",
+        default=False
+    ) # type: ignore
+
 class BRaaSHPCRenderSettings(bpy.types.PropertyGroup):
     server_settings: bpy.props.PointerProperty(
         type=BRaaSHPCServerSettings
@@ -125,6 +310,56 @@ class BRaaSHPCData:
         self.braas_hpc_renderengine_engine = None
         #self.is_rendered = False
 
+#####################################################################################################################
+class BRaaSHPCCommandScript:
+    """
+    Encoded command script. Every write to the text is notified with invalidate() (msgbus, depsgraph, Text editor,
+    operator), update() is called from the UI thread and materializes the text only after a write or when another
+    text is selected. The render thread compares the revision and reads the cached payload.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pointer = None
+        self.digest = None
+
+        # bumped by every notified write, the text is hashed again when it differs from hashed_revision
+        self.write_revision = 1
+        self.hashed_revision = 0
+
+        self.revision = 0
+        self.payload = b""
+
+    def invalidate(self):
+        """ The text was written (e.g. TextLine.body, Text.from_string, typing in the Text editor) """
+        self.write_revision += 1
+
+    def update(self, text):
+        """ Returns True when the script changed """
+        pointer = text.as_pointer() if text else None
+        if pointer == self.pointer and self.write_revision == self.hashed_revision:
+            return False
+
+        self.pointer = pointer
+        self.hashed_revision = self.write_revision
+
+        payload = text.as_string().encode('utf-8') if text else b""
+        digest = hashlib.blake2b(payload, digest_size=16).digest()
+        if digest == self.digest:
+            return False
+
+        with self.lock:
+            self.digest = digest
+            self.payload = payload
+            self.revision += 1
+
+        return True
+
+    def get(self):
+        """ Returns (revision, payload, digest) """
+        with self.lock:
+            return self.revision, self.payload, self.digest
+
 #####################################################################################################################
 # class BRaaSHPCDataRender:
 #     def __init__(self):
@@ -133,28 +368,124 @@ class BRaaSHPCData:
 #         self.domain = np.zeros((2), dtype=np.float32)
 #         self.baseDensity = np.zeros((1), dtype=np.float32)          
 
+# every BRaaSHPCContext, the native module has a single connection for all of them, see get_native_user
+CONTEXTS = weakref.WeakSet()
+
+NATIVE_CONNECTION_IN_USE = "The native module has a single connection, which another viewport or the final render uses. " \
+                           "Stop it first or use the Python Socket transport"
+
 class BRaaSHPCContext:
     channels = 4
     send_cam_data_result = -1
 
     def __init__(self):
+        CONTEXTS.add(self)
         self.server = None
         self.port = None
         #self.port_data = None
         self.width = None
         self.height = None
         self.step_samples = None
+        self.max_samples = 0
+        self.pipeline_depth = 1
+        self.timesteps = 1
+        self.frame = 0
+        self.pixsize = None
+        # (pixsize, codec, quality) of the frames requested from now on, see set_stream_format
+        self.stream_format = None
+        # [(server, port)], the image is split across the servers if there are more
+        self.endpoints = []
+        # auxiliary passes received with every frame, see braas_hpc_renderengine_transport.PASSES
+        self.passes = []
+        # rows per band of a frame shown while it arrives, 0 = whole frames
+        self.band_rows = 0
+        # called from the render thread for every band, see get_partial_frame
+        self.band_callback = None
+        # (key, ViewProjection) of the frame being received if it is shown, see recv_frame
+        self.receiving = None
         #self.filename = None
 
         self.client_started = False
 
+        transport = braas_hpc_renderengine_pref.preferences().braas_hpc_renderengine_transport
+        self.transport = braas_hpc_renderengine_transport.create_transport(transport)
+
+        # held by the render thread for every network round trip, see ViewportEngine.render_lock
+        self.render_lock = threading.Lock()
+
+        # GPUTexture with the last frame, for transports without their own OpenGL texture,
+        # created from the staging buffer only when the frame changed
+        self.texture = None
+        self.texture_seq = None
+        self.texture_staging = TextureStaging()
+
+        # pipelined rendering: every request is tagged with a sequence number and
+        # the camera version it was sent with, frames come back in request order
+        self.frame_seq = 0
+        self.frame_seq_received = 0
+        self.camera_version = 0
+        # (seq, camera version, frame key, ViewProjection, send time)
+        self.frames_in_flight = deque()
+        # time from a request to its frame, moving average in seconds
+        self.round_trip_time = 0.0
+
+        # frames for timeline scrubbing, see get_frame_key. Disabled until set_budget
+        self.frame_cache = braas_hpc_renderengine_cache.FrameCache()
+        self.camera_key = None
+        # last CameraData, loaded again into a shared connection, see share_transport
+        self.camera_data = None
+        # ViewProjection of the camera and of the shown frame, see get_reprojection
+        self.projection = None
+        self.display_projection = None
+        # timestep rendered into the frame cache instead of the current one, see ViewportEngine.prefetch_timesteps
+        self.prefetch_timestep = None
+        # (seq, key, samples, pixels) shown by get_texture, a received or a cached frame
+        self.display_frame = (0, None, 0, None)
+        # request sequence number of the shown frame, an older region of interest is not shown over it
+        self.display_request_seq = 0
+        # {name: values} of the auxiliary passes of the shown frame, cached frames have none
+        self.display_passes = {}
+        self.depth_texture = None
+        self.depth_texture_source = None
+
+        # render border, (x, y, width, height) within the current resolution, None renders the whole frame
+        self.region = None
+        # (width, height, region, due time) requested by the UI thread, applied by the render thread, see request_resize
+        self.resize_pending = None
+        self.resize_lock = threading.Lock()
+        # (width, height, region) coalesced by the render thread, applied by the draw, see apply_native_resize
+        self.native_resize_pending = None
+        # foveated ((x, y, width, height), (width, height)), region of interest and the resolution it is
+        # requested at after every request, see send_roi_request. Replaced as a whole by the UI thread
+        self.roi = None
+        self.roi_in_flight = deque()
+        # (seq, (x, y, width, height), pixels, ViewProjection) of the last received region of interest
+        self.roi_frame = (0, None, None, None)
+        # the last received frame was a region of interest
+        self.received_roi = False
+        self.roi_texture = None
+        self.roi_texture_seq = None
+        self.roi_texture_staging = TextureStaging()
+
+        # per-stage timings, recorded only when enabled
+        self.profiler = braas_hpc_renderengine_profiler.FrameProfiler()
+
         #self.is_rendered = False
         #self.data = None
         # self.data_right = None
 
-        self.braas_hpc_renderengine_data_previous = ""
+        # command script, see BRaaSHPCCommandScript. The render thread sends it only when the revision changed
+        self.command_script = BRaaSHPCCommandScript()
+        self.command_script_revision = 0
+        self.command_script_digest = None
+        self.braas_hpc_renderengine_data_previous = b""
+        self.use_script_diff = False
+        # id of the last script sent over the control channel, see is_command_pending
+        self.command_id = None
+        # last error the server reported over the control channel
+        self.server_error = None
 
-    def init(self, context, server, port, width, height, step_samples):
+    def init(self, context, server, port, width, height, step_samples, pipeline_depth=1, max_samples=0, timesteps=1, endpoints=None, passes=None, band_rows=0):
 
         self.server = server
         self.port = port
@@ -162,142 +493,447 @@ class BRaaSHPCContext:
         self.width = width
         self.height = height
         self.step_samples = step_samples
+        self.pipeline_depth = max(1, pipeline_depth)
+        self.max_samples = max_samples
+        self.timesteps = timesteps
+        self.endpoints = endpoints if endpoints is not None else [(server, port)]
+        self.passes = list(passes) if passes is not None else []
+        self.band_rows = band_rows
         #self.filename = filename
 
         #self.data = np.empty((height, width, self.channels), dtype=np.uint8)
         # self.data_right = np.empty((height, width, self.channels), dtype=np.uint8)
 
         print(self.server.encode(), self.port, self.width,
-              self.height, self.step_samples)
+              self.height, self.step_samples, self.pipeline_depth)
+
+    def get_session_key(self):
+        """ Connections with the same key are interchangeable, see braas_hpc_renderengine_session """
+        prefs = braas_hpc_renderengine_pref.preferences()
+        return (tuple(self.endpoints), prefs.braas_hpc_renderengine_transport, prefs.braas_hpc_renderengine_pixsize,
+                prefs.braas_hpc_renderengine_use_gpujpeg, prefs.braas_hpc_renderengine_codec,
+                prefs.braas_hpc_renderengine_use_delta, prefs.braas_hpc_renderengine_codec_quality, tuple(self.passes),
+                self.band_rows)
+
+    def client_attach(self):
+        """ Takes over a parked connection to the same servers, returns False if there is none """
+        session = braas_hpc_renderengine_session.SESSION_POOL.acquire(self.get_session_key())
+        if session is None:
+            return False
+
+        if session.transport.com_error() == 1:
+            session.close()
+            return False
+
+        self.transport = session.transport
+        self.pixsize = int(braas_hpc_renderengine_pref.preferences().braas_hpc_renderengine_pixsize)
+        # a parked connection is switched back to the preferred format, see client_close_connection
+        self.stream_format = self.get_preferred_format()
+        self.transport.set_band_rows(self.band_rows, self.notify_band)
+
+        # only what differs from the state of the server is sent again
+        if session.width != self.width or session.height != self.height:
+            self.transport.resize(self.width, self.height)
+
+        self.g_width = self.width
+        self.g_height = self.height
+        self.client_started = True
+
+        self.command_script_revision = 0
+        self.braas_hpc_renderengine_data_previous = session.command_script
+        return True
+
+    def is_native(self):
+        """ True if the connection is the single one of the native module """
+        transport = self.transport
+        if isinstance(transport, braas_hpc_renderengine_transport.ViewTransport):
+            return transport.shared.is_native()
+
+        return isinstance(transport, braas_hpc_renderengine_transport.DllTransport)
+
+    def share_transport(self):
+        """ Wraps the connection into a ViewTransport so that other viewports can use it, returns the SharedTransport """
+        with self.render_lock:
+            if isinstance(self.transport, braas_hpc_renderengine_transport.ViewTransport):
+                return self.transport.shared
+
+            self.drain()
+
+            shared = braas_hpc_renderengine_transport.SharedTransport(self.transport, connected=True)
+            view = braas_hpc_renderengine_transport.ViewTransport(shared, self.width, self.height)
+            shared.owner = view
+            self.transport = view
+
+            # the view loads its state again when it takes the connection back
+            if self.camera_data is not None:
+                self.set_camera(self.camera_data, self.projection)
+            view.set_frame(self.frame)
+
+            return shared
+
+    def get_native_user(self):
+        """ Returns another context connected through the native module, None if its connection is free """
+        if not isinstance(self.transport, braas_hpc_renderengine_transport.DllTransport):
+            return None
+
+        for other in list(CONTEXTS):
+            if other is not self and other.client_started and other.is_native():
+                return other
+
+        return None
+
+    def client_join(self):
+        """
+        The native module has a single connection, a second viewport shares the one of a running viewport.
+        Raises an exception if the connection is used and cannot be shared, a new connection would replace it
+        """
+        other = self.get_native_user()
+        if other is None:
+            return False
+
+        engine = next((engine for engine in VIEWPORT_SCHEDULER.engines if engine.braas_hpc_renderengine_context is other), None)
+
+        # the views copy the frames of the connection, see ViewTransport
+        if engine is None or not self.transport.can_copy_pixels:
+            raise Exception(NATIVE_CONNECTION_IN_USE)
+
+        shared = other.share_transport()
+        # its frames are copied from now on, see ViewTransport
+        engine.restart_render_event.set()
+
+        self.transport = braas_hpc_renderengine_transport.ViewTransport(shared)
+        self.transport.client_init(self.server.encode(), self.port, self.width, self.height)
+        self.pixsize = other.pixsize
+        self.stream_format = other.stream_format
+
+        self.g_width = self.width
+        self.g_height = self.height
+        self.client_started = True
+
+        # the server may have the script of the other viewport
+        self.command_script_revision = 0
+        self.braas_hpc_renderengine_data_previous = b""
+        return True
 
     def client_init(self):
+        if self.client_attach() or self.client_join():
+            return
+
+        if len(self.endpoints) > 1 and not isinstance(self.transport, braas_hpc_renderengine_transport.MultiTransport):
+            self.transport = braas_hpc_renderengine_transport.MultiTransport(self.endpoints)
+
         use_gpujpeg = 1 if braas_hpc_renderengine_pref.preferences().braas_hpc_renderengine_use_gpujpeg else 0
-        braas_hpc_renderengine_dll.enable_gpujpeg(use_gpujpeg)
+        self.transport.enable_gpujpeg(use_gpujpeg)
         pixsize = int(braas_hpc_renderengine_pref.preferences().braas_hpc_renderengine_pixsize)
-        braas_hpc_renderengine_dll.set_pixsize(pixsize) # e.g. 16 for half-float RGBA
-
-        braas_hpc_renderengine_dll.client_init(self.server.encode(), self.port, #_cam, self.port_data,
+        self.transport.set_pixsize(pixsize) # e.g. 16 for half-float RGBA
+        self.pixsize = pixsize
+        self.transport.set_codec(braas_hpc_renderengine_pref.preferences().braas_hpc_renderengine_codec,
+                                 braas_hpc_renderengine_pref.preferences().braas_hpc_renderengine_use_delta,
+                                 braas_hpc_renderengine_pref.preferences().braas_hpc_renderengine_codec_quality)
+        self.transport.set_passes(self.passes)
+        self.transport.set_band_rows(self.band_rows, self.notify_band)
+        self.stream_format = self.get_preferred_format()
+
+        self.transport.client_init(self.server.encode(), self.port, #_cam, self.port_data,
                                       self.width, self.height) #, self.step_samples, self.filename.encode()
 
         self.g_width = self.width
         self.g_height = self.height
         self.client_started = True
 
+        # a new connection needs the full script
+        self.command_script_revision = 0
+        self.braas_hpc_renderengine_data_previous = b""
+
         #check_gl_error()
 
+    def client_abort_connection(self):
+        """ Closes the connection without waiting for the frames in flight, it cannot be parked with them """
+        self.frames_in_flight.clear()
+        self.roi_in_flight.clear()
+        self.transport.client_close_connection()
+        self.client_started = False
+
     def client_close_connection(self):
-        braas_hpc_renderengine_dll.reset()
-        braas_hpc_renderengine_dll.client_close_connection()
+        if self.frames_in_flight:
+            try:
+                self.drain()
+            except:
+                self.frames_in_flight.clear()
+                self.roi_in_flight.clear()
+
+        grace_period = braas_hpc_renderengine_pref.preferences().braas_hpc_renderengine_session_grace_period
+        if grace_period > 0 and self.transport.com_error() == 0 and not self.frames_in_flight:
+            if self.region is not None:
+                # the next viewport may not use the render border
+                self.transport.resize(self.width, self.height)
+                self.region = None
+
+            # the session key has the preferred format
+            self.set_stream_format(self.get_preferred_format())
+
+            # kept warm for the next client_init, see braas_hpc_renderengine_session
+            session = braas_hpc_renderengine_session.Session(self.transport, self.width, self.height, self.braas_hpc_renderengine_data_previous)
+            braas_hpc_renderengine_session.SESSION_POOL.release(self.get_session_key(), session, grace_period)
+        else:
+            self.transport.reset()
+            self.transport.client_close_connection()
+
         self.client_started = False
 
     def render(self, restart=False, tile=None):
-        # cam
-        if bpy.context.scene.braas_hpc_renderengine.server_settings.timesteps > 1:
-            braas_hpc_renderengine_dll.set_timestep(bpy.context.scene.frame_current % bpy.context.scene.braas_hpc_renderengine.server_settings.timesteps)
+        """ Lockstep round trip: one request, one frame """
+        self.send_request()
+        self.recv_frame()
+
+        return 1
 
-        braas_hpc_renderengine_dll.send_cam_data()
+    def get_pipeline_depth(self):
+        """ pipeline_depth, 1 for a transport which cannot match frames to requests """
+        return self.pipeline_depth if self.transport.supports_pipelining else 1
 
-        if braas_hpc_renderengine_dll.com_error() == 1:
-            raise Exception("TCP error")
+    def fill_pipeline(self):
+        """ Sends camera requests until pipeline_depth requests are in flight, the regions of interest do not count """
+        pipeline_depth = self.get_pipeline_depth()
+        while len(self.frames_in_flight) - len(self.roi_in_flight) < pipeline_depth:
+            self.send_request()
 
-        # volume       
-        #braas_hpc_renderengine_data = BRaaSHPCDataRender()
-        #braas_hpc_renderengine_data_size = int(129 * 4 * 4)
+    def drain(self):
+        """ Receives all frames in flight, e.g. before the buffers are resized """
+        while self.frames_in_flight:
+            self.recv_frame()
+
+    def recv_frame(self):
+        """
+        Receives the oldest frame in flight. Returns False when the frame is stale,
+        i.e. a request with a newer camera is still in flight and will replace it.
+        """
+        if not self.frames_in_flight:
+            return False
 
-        braas_hpc_renderengine_data = ""
+        seq, camera_version, key, projection, send_time = self.frames_in_flight.popleft()
 
-        # material = bpy.context.scene.braas_hpc_renderengine.server_settings.mat_volume
-        command_script = bpy.context.scene.braas_hpc_renderengine.server_settings.command_script
+        # bands of frames which will be shown are drawn while they arrive
+        if key is not None and self.prefetch_timestep is None:
+            self.receiving = (key, projection)
 
-        if command_script:
-            # try:
-            #     from braas_hpc_xmlmaterial import braas_hpc_xmlmaterial_convert
+        # image
+        time_begin = time.perf_counter()
+        try:
+            self.transport.recv_pixels_data()
+        finally:
+            self.receiving = None
+        time_end = time.perf_counter()
+        self.profiler.add(STAGE_RECV_PIXELS_DATA, time_begin, time_end)
 
-            #     #material = bpy.data.materials["Material.001"]
-            #     #active_node = material.node_tree.nodes.active
-            #     #braas_hpc_renderengine_data = braas_hpc_xmlmaterial_convert.export_node(material, active_node)
-            #     braas_hpc_renderengine_data = braas_hpc_xmlmaterial_convert.export_shader(material, material.node_tree)                
-            # except:
-            #     pass
+        if self.transport.com_error() == 1:
+            raise Exception("TCP error")
 
-            braas_hpc_renderengine_data = command_script.as_string()
+        round_trip_time = time_end - send_time
+        self.round_trip_time = round_trip_time if self.round_trip_time == 0.0 else 0.8 * self.round_trip_time + 0.2 * round_trip_time
 
-            # node_color_ramp = None
-            # node_float_curve = None
+        self.frame_seq_received = seq
+        self.received_roi = key is None
 
-            # ############### Color Ramp ##############
-            # if 'Color Ramp' in mat.node_tree.nodes:
-            #     node_color_ramp = mat.node_tree.nodes['Color Ramp']
+        if key is None:
+            # region of interest, see send_roi_request
+            self.roi_frame = (seq, self.roi_in_flight.popleft(), self.transport.get_pixels(), projection)
+        else:
+            self.display_request_seq = seq
+            if self.transport.provides_gl_texture:
+                # the native module has already written the frame to its texture, a stale frame is drawn as well
+                self.display_projection = projection
+            elif self.update_display_frame(key):
+                self.display_projection = projection
+                self.display_passes = self.get_passes()
+
+        if self.frames_in_flight and self.frames_in_flight[-1][1] != camera_version:
+            return False
+
+        return True
+
+    def get_timestep(self):
+        """ Timestep of the current frame """
+        return self.frame % self.timesteps if self.timesteps > 1 else 0
+
+    def get_frame_key(self, timestep=None, command_script_digest=None):
+        """ Frame cache key of the current state, or of the timestep """
+        if timestep is None:
+            timestep = self.get_timestep()
+
+        if command_script_digest is None:
+            command_script_digest = self.command_script.digest
+
+        return (timestep, self.camera_key, self.width, self.height, self.region, self.pixsize, command_script_digest)
+
+    def update_display_frame(self, key):
+        """ Caches the received frame if it converged and shows it, unless a better frame of the current state is shown. Returns True if shown """
+        pixels = self.transport.get_pixels()
+        samples = self.transport.get_current_samples()
+        # frames of a moving camera are never shown again, they are neither copied nor do they evict the converged ones
+        if pixels is not None and self.is_converged(samples) and self.frame_cache.budget > 0:
+            # the receive buffer is overwritten by the next but one frame
+            self.frame_cache.put(key, pixels.copy() if self.transport.double_buffered else pixels, samples)
+
+        seq, display_key, display_samples, display_pixels = self.display_frame
+        if display_key == self.get_frame_key() and (key != display_key or display_samples > samples):
+            return False
+
+        self.display_frame = (seq + 1, key, samples, pixels)
+        return True
+
+    def show_cached_frame(self):
+        """ Shows the cached frame of the current state, returns its number of samples or None """
+        if self.transport.provides_gl_texture:
+            return None
+
+        key = self.get_frame_key()
+        frame = self.frame_cache.get(key)
+        if frame is None:
+            return None
+
+        pixels, samples = frame
+        self.display_frame = (self.display_frame[0] + 1, key, samples, pixels)
+        self.display_request_seq = self.frame_seq
+        self.display_projection = self.projection
+        self.display_passes = {}
+        return samples
+
+    def is_converged(self, current_samples):
+        """ True when progressive refinement reached max_samples (0 = never converges) """
+        return self.max_samples > 0 and current_samples >= self.max_samples
+
+    def send_request(self):
+        send_time = time.perf_counter()
 
-            # if 'Float Curve' in mat.node_tree.nodes:
-            #     node_float_curve = mat.node_tree.nodes['Float Curve']
-            #     curve_map = node_float_curve.mapping.curves[0]
-            
-            # for v in range(braas_hpc_renderengine_data.colorMapCount):
-            #     color_rgba = (1.0,0.0,0.0,1.0)
-            #     density = 1.0
-
-            #     if node_color_ramp:
-            #         color_rgba = node_color_ramp.color_ramp.evaluate(float(v) / float(braas_hpc_renderengine_data.colorMapCount))
-            #         density = color_rgba[3]
-                
-            #     if node_float_curve:
-            #         density = node_float_curve.mapping.evaluate(curve_map, float(v) / float(braas_hpc_renderengine_data.colorMapCount))
-
-            #     braas_hpc_renderengine_data.colorMap[0 + v * 4] = color_rgba[0]
-            #     braas_hpc_renderengine_data.colorMap[1 + v * 4] = color_rgba[1]
-            #     braas_hpc_renderengine_data.colorMap[2 + v * 4] = color_rgba[2]
-            #     braas_hpc_renderengine_data.colorMap[3 + v * 4] = density
-
-            # ############### Min/Max ##############
-            # domain = [float(0.0), float(1.0)]
-
-            # if 'Map Range' in mat.node_tree.nodes:
-            #     domain[0] = mat.node_tree.nodes["Map Range"].inputs[1].default_value
-            #     domain[1] = mat.node_tree.nodes["Map Range"].inputs[2].default_value
-            # else:            
-            #     if 'DomainX' in mat.node_tree.nodes:
-            #         domain[0] = mat.node_tree.nodes['DomainX'].outputs[0].default_value
-            #     if 'DomainY' in mat.node_tree.nodes:
-            #         domain[1] = mat.node_tree.nodes['DomainY'].outputs[0].default_value                
-            
-            # braas_hpc_renderengine_data.domain[0] = domain[0]
-            # braas_hpc_renderengine_data.domain[1] = domain[1]
+        # cam
+        timestep = self.prefetch_timestep if self.prefetch_timestep is not None else self.get_timestep()
+        if self.timesteps > 1:
+            time_begin = time.perf_counter()
+            self.transport.set_timestep(timestep)
+            self.profiler.add(STAGE_SET_TIMESTEP, time_begin)
 
-            # baseDensity = float(1.0)
-            # if 'Base Density' in mat.node_tree.nodes:
-            #     baseDensity = mat.node_tree.nodes['Base Density'].outputs[0].default_value
-            # elif 'Math' in mat.node_tree.nodes:
-            #     baseDensity = mat.node_tree.nodes["Math"].inputs[1].default_value
+        time_begin = time.perf_counter()
+        self.transport.send_cam_data()
+        self.profiler.add(STAGE_SEND_CAM_DATA, time_begin)
 
-            # braas_hpc_renderengine_data.baseDensity[0] = baseDensity
+        if self.transport.com_error() == 1:
+            raise Exception("TCP error")
 
-            # # if bpy.context.scene.braas_hpc_renderengine.server_settings.save_to_file == True:
-            # #     braas_hpc_renderengine_data[3 + 128 * 4] = 1
-            # # else:
-            # #     braas_hpc_renderengine_data[3 + 128 * 4] = 0
-        
-        #braas_hpc_renderengine_dll.send_braas_hpc_renderengine_data_render(braas_hpc_renderengine_data.colorMap.ctypes.data, braas_hpc_renderengine_data.colorMapCount, braas_hpc_renderengine_data.domain.ctypes.data, braas_hpc_renderengine_data.baseDensity.ctypes.data)
-        if self.braas_hpc_renderengine_data_previous == braas_hpc_renderengine_data:
-            bdata="".encode('utf-8')
+        bdata = b""
+
+        errors = self.transport.pop_server_errors()
+        if errors or (self.command_id is not None and not self.transport.supports_control):
+            # the script of the server is unknown, it is sent again in full
+            if errors:
+                self.server_error = errors[-1]
+            self.command_id = None
+            self.command_script_revision = 0
+            self.braas_hpc_renderengine_data_previous = b""
+        elif self.server_error is not None and self.command_id is not None and not self.is_command_pending():
+            # the script was applied since
+            self.server_error = None
+
+        revision, braas_hpc_renderengine_data, digest = self.command_script.get()
+        if revision != self.command_script_revision:
+            self.command_script_revision = revision
+            self.command_script_digest = digest
+
+            if self.braas_hpc_renderengine_data_previous != braas_hpc_renderengine_data:
+                if self.transport.supports_control:
+                    self.send_command_script(braas_hpc_renderengine_data)
+                elif not self.send_command_script_diff(braas_hpc_renderengine_data):
+                    bdata = braas_hpc_renderengine_data
+                self.braas_hpc_renderengine_data_previous = braas_hpc_renderengine_data
+
+        time_begin = time.perf_counter()
+        self.transport.send_braas_hpc_renderengine_data_render(bdata, len(bdata))
+        self.profiler.add(STAGE_SEND_DATA_RENDER, time_begin)
+
+        self.frame_seq += 1
+        # the server may render the previous script until it acknowledged the new one
+        key = self.get_frame_key(timestep, self.command_script_digest if not self.is_command_pending() else COMMAND_PENDING)
+        self.frames_in_flight.append((self.frame_seq, self.camera_version, key, self.projection, send_time))
+        seq = self.frame_seq
+
+        roi = self.roi
+        if roi is not None and self.prefetch_timestep is None:
+            self.send_roi_request(*roi)
+
+        return seq
+
+    def send_roi_request(self, rect, resolution):
+        """ Requests the region of interest at its resolution, the view keeps its resolution, render border and samples """
+        self.transport.send_roi_request(*resolution, *rect)
+
+        self.frame_seq += 1
+        self.frames_in_flight.append((self.frame_seq, self.camera_version, None, self.projection, time.perf_counter()))
+        self.roi_in_flight.append(rect)
+
+    def get_command_script_diff(self, braas_hpc_renderengine_data):
+        """ Returns (prefix, suffix, middle) of the change to the previous script if it is much smaller, None otherwise """
+        previous = self.braas_hpc_renderengine_data_previous
+        if not self.use_script_diff or len(previous) < SCRIPT_DIFF_MIN_SIZE:
+            return None
+
+        prefix, suffix, middle = braas_hpc_renderengine_transport.script_diff(previous, braas_hpc_renderengine_data)
+        if len(middle) > len(braas_hpc_renderengine_data) // 2:
+            return None
+
+        return prefix, suffix, middle
+
+    def send_command_script_diff(self, braas_hpc_renderengine_data):
+        """ Sends the change to the previous script if it is much smaller, returns False when the full script has to be sent """
+        if not self.transport.supports_script_diff:
+            return False
+
+        diff = self.get_command_script_diff(braas_hpc_renderengine_data)
+        if diff is None:
+            return False
+
+        self.transport.send_braas_hpc_renderengine_data_diff(*diff)
+        return True
+
+    def send_command_script(self, braas_hpc_renderengine_data):
+        """ Queues the script on the control channel, the frame requests do not wait for it, see is_command_pending """
+        diff = self.get_command_script_diff(braas_hpc_renderengine_data)
+        if diff is not None:
+            self.command_id = self.transport.send_command_diff(*diff)
         else:
-            bdata=braas_hpc_renderengine_data.encode('utf-8')
-            self.braas_hpc_renderengine_data_previous = braas_hpc_renderengine_data
-            
-        braas_hpc_renderengine_dll.send_braas_hpc_renderengine_data_render(bdata, len(bdata))
+            self.command_id = self.transport.send_command(braas_hpc_renderengine_data)
 
-        # image
-        braas_hpc_renderengine_dll.recv_pixels_data()
+    def is_command_pending(self):
+        """ True until the server acknowledged the last script sent over the control channel """
+        return self.command_id is not None and not self.transport.is_command_acknowledged(self.command_id)
 
-        if braas_hpc_renderengine_dll.com_error() == 1:
-            raise Exception("TCP error")        
+    def get_server_info(self):
+        """ Returns a status line of the server state pushed over the control channel, empty without it """
+        info = []
+        status = self.transport.get_server_status()
+        if status is not None:
+            server_info = f"Server: {status.get('memory', 0) / (1024 * 1024):.0f} MB"
+            timesteps = status.get("timesteps")
+            if timesteps:
+                server_info += f", {len(timesteps)} timesteps"
+            info.append(server_info)
 
-        return 1
+        if self.is_command_pending():
+            info.append("Applying Script")
+
+        if self.server_error is not None:
+            info.append(f"Server Error: {self.server_error}")
+
+        return " | ".join(info)
+
+    def set_camera(self, camera_data, projection=None):
+        self.camera_data = camera_data
+        self.projection = projection
+        self.camera_version += 1
+        self.camera_key = hash(repr(camera_data))
 
-    def set_camera(self, camera_data):
         transformL = np.array(camera_data.transform, dtype=np.float32)
 
-        braas_hpc_renderengine_dll.set_camera(transformL.ctypes.data,
+        self.transport.set_camera(transformL.ctypes.data,
                                      camera_data.focal_length,
                                      camera_data.clip_plane[0],
                                      camera_data.clip_plane[1],
@@ -313,34 +949,508 @@ class BRaaSHPCContext:
                                      camera_data.view_perspective)
         
     def set_frame(self, frame):
-        braas_hpc_renderengine_dll.set_frame(frame)        
+        self.frame = frame
+        self.transport.set_frame(frame)        
         
 
     # def get_image(self):
     #     braas_hpc_renderengine_dll.get_pixels(ctypes.c_void_p(self.data.ctypes.data))
     #     return self.data
     
+    def get_range(self, world_bounds_spatial_lower, world_bounds_spatial_upper, scalars_range):
+        """ Called from the UI thread, the reply shares the connection with the frames in flight """
+        with self.render_lock:
+            self.drain()
+            self.transport.get_braas_hpc_renderengine_range(world_bounds_spatial_lower, world_bounds_spatial_upper, scalars_range)
+
     def draw_texture(self):
-        braas_hpc_renderengine_dll.draw_texture()
+        self.transport.draw_texture()
+
+    def notify_band(self):
+        if self.receiving is not None and self.band_callback is not None:
+            self.band_callback()
+
+    def get_partial_frame(self):
+        """ Returns (seq, pixels, y, ViewProjection) of the frame being received in bands, see SocketTransport.get_partial_pixels """
+        receiving = self.receiving
+        partial = self.transport.get_partial_pixels()
+        if receiving is None or partial is None:
+            return None
+
+        return partial + (receiving[1],)
+
+    def get_texture(self):
+        """ Returns GPUTexture with the last received frame, None if the transport binds its own OpenGL texture """
+        if self.transport.provides_gl_texture:
+            return None
+
+        seq, key, samples, pixels = self.display_frame
+
+        # the received bands over the shown frame, only the new rows are copied
+        partial = self.get_partial_frame()
+        if partial is not None:
+            partial_seq, partial_pixels, y, projection = partial
+            texture = self.texture_staging.update_rows(partial_seq, partial_pixels, y, pixels is None)
+            if texture is not None:
+                self.texture = texture
+                # the complete frame is uploaded again
+                self.texture_seq = None
+                self.display_projection = projection
+                return texture
+
+        if pixels is None:
+            return None
+
+        if self.texture is None or self.texture_seq != seq:
+            self.texture = self.texture_staging.create_texture(pixels)
+            self.texture_seq = seq
+
+        return self.texture
+
+    def get_roi_texture(self):
+        """
+        Returns (GPUTexture, (x, y, width, height), ViewProjection) of the region of interest
+        if it is newer than the shown frame, or None
+        """
+        seq, rect, pixels, projection = self.roi_frame
+        if pixels is None or seq < self.display_request_seq:
+            return None
+
+        if self.roi_texture is None or self.roi_texture_seq != seq:
+            self.roi_texture = self.roi_texture_staging.create_texture(pixels)
+            self.roi_texture_seq = seq
+
+        return self.roi_texture, rect, projection
+
+    def get_depth_texture(self):
+        """ Returns GPUTexture with the depth of the shown frame or None """
+        depth = self.display_passes.get(braas_hpc_renderengine_transport.PASS_DEPTH)
+        if depth is None:
+            return None
+
+        if self.depth_texture is None or self.depth_texture_source is not depth:
+            self.depth_texture = create_depth_texture(depth)
+            self.depth_texture_source = depth
+
+        return self.depth_texture
+
+    def get_pixels(self):
+        """ Returns (height, width, 4) array with the last received frame, bottom row first """
+        return self.transport.get_pixels()
+
+    def get_passes(self):
+        """ Returns {name: (height, width, channels) array} of the requested passes of the last received frame """
+        passes = {}
+        for name in self.passes:
+            values = self.transport.get_pass(name)
+            if values is not None:
+                passes[name] = values
+
+        return passes
 
     def get_current_samples(self):
-        return braas_hpc_renderengine_dll.get_current_samples()
+        return self.transport.get_current_samples()
     
     def get_fps(self):
-        return braas_hpc_renderengine_dll.get_remote_fps(), braas_hpc_renderengine_dll.get_local_fps()    
+        return self.transport.get_remote_fps(), self.transport.get_local_fps()    
     
     def get_texture_id(self):
-        return braas_hpc_renderengine_dll.get_texture_id()
+        return self.transport.get_texture_id()
+
+    def get_codec_stats(self):
+        return self.transport.get_codec_stats()
+
+    def get_preferred_format(self):
+        """ Returns (pixsize, codec, quality) chosen in the preferences """
+        prefs = braas_hpc_renderengine_pref.preferences()
+        return int(prefs.braas_hpc_renderengine_pixsize), prefs.braas_hpc_renderengine_codec, prefs.braas_hpc_renderengine_codec_quality
+
+    def get_stream_formats(self):
+        """ Formats the connection can switch between, see StreamFormatController. Empty if it cannot switch """
+        if not self.transport.supports_formats:
+            return []
+
+        return get_stream_formats(*self.get_preferred_format())
+
+    def set_stream_format(self, stream_format):
+        """
+        Switches the format of the frames requested from now on, called from the render thread.
+        Frames in flight keep the old one, their keys have the old pixel size
+        """
+        if stream_format is None or stream_format == self.stream_format or not self.transport.supports_formats:
+            return
+
+        self.transport.set_format(*stream_format)
+        self.stream_format = stream_format
+        self.pixsize = stream_format[0]
+
+    def get_link_stats(self):
+        """ Returns (bytes, seconds, pixels) of the last received frame or None """
+        stats = self.transport.get_link_stats()
+        if stats is None:
+            return None
+
+        width, height = (self.region[2], self.region[3]) if self.region is not None else (self.width, self.height)
+        return stats + (width * height,)
+
+    def resize(self, width, height, region=None):
+        # frames in flight still have the old resolution
+        self.drain()
 
-    def resize(self, width, height):
         self.width = width
         self.height = height
-        braas_hpc_renderengine_dll.resize(width, height)
+        self.transport.resize(width, height)
+
+        # the server forgets the region with every resize
+        self.region = region
+        if region is not None:
+            self.transport.set_region(*region)
+
+    def request_resize(self, width, height, region=None, delay=0.0):
+        """
+        Called from the UI thread instead of resize, which waits for the frames in flight. A newer request
+        replaces the pending one and its delay starts again, see apply_resize
+        """
+        with self.resize_lock:
+            self.resize_pending = (width, height, region, time.perf_counter() + delay)
+
+    def get_resize_wait(self, now):
+        """ Seconds until the pending resize is due, 0 if there is none """
+        resize_pending = self.resize_pending
+        if resize_pending is None:
+            return 0.0
+
+        return max(0.0, resize_pending[3] - now)
+
+    def apply_resize(self):
+        """
+        Resizes to the pending request, called by the render thread with render_lock held. The native module
+        reallocates its OpenGL texture, its resize is left to the draw, see apply_native_resize
+        """
+        with self.resize_lock:
+            resize_pending = self.resize_pending
+            self.resize_pending = None
+
+        if resize_pending is None:
+            return
+
+        width, height, region, due = resize_pending
+        if width != self.width or height != self.height or region != self.region:
+            if self.transport.provides_gl_texture:
+                self.drain()
+                self.native_resize_pending = (width, height, region)
+            else:
+                self.resize(width, height, region)
+
+    def apply_native_resize(self):
+        """ Resizes the native module to the request coalesced by apply_resize, called by the draw with render_lock held """
+        native_resize_pending = self.native_resize_pending
+        if native_resize_pending is None:
+            return False
+
+        self.resize(*native_resize_pending)
+        self.native_resize_pending = None
+        return True
         #braas_hpc_renderengine_dll.set_resolution(width, height)        
 
+def pixels_to_float(pixels):
+    """ Returns float32 RGBA, 8-bit pixels are normalized to 0..1 """
+    if pixels.dtype == np.uint8:
+        return pixels.astype(np.float32) * (1.0 / 255.0)
+
+    return pixels.astype(np.float32)
+
+def get_homography(source, target):
+    """ Returns 3x3 array mapping the four source points to the four target points, None if degenerate """
+    a = []
+    b = []
+    for (x, y), (u, v) in zip(source, target):
+        a.append((x, y, 1.0, 0.0, 0.0, 0.0, -u * x, -u * y))
+        a.append((0.0, 0.0, 0.0, x, y, 1.0, -v * x, -v * y))
+        b.extend((u, v))
+
+    try:
+        h = np.linalg.solve(np.array(a), np.array(b))
+    except np.linalg.LinAlgError:
+        return None
+
+    return np.append(h, 1.0).reshape(3, 3)
+
+def get_reprojection(source, target, rect, region_size):
+    """
+    Returns 4x4 Matrix warping a frame rendered with the source ViewProjection and drawn at rect (x, y, width, height)
+    in region pixels to the target view, through the plane of the source view. None if the views are the same or
+    the plane is not in front of both views. A rotation around the camera is exact for every depth.
+    """
+    if source is None or target is None or source.matrix == target.matrix:
+        return None
+
+    region_width, region_height = region_size
+    source_inverse = source.matrix.inverted_safe()
+
+    x, y, width, height = rect
+    corners = ((x, y), (x + width, y), (x + width, y + height), (x, y + height))
+
+    points = []
+    for corner_x, corner_y in corners:
+        ndc_x = 2.0 * corner_x / region_width - 1.0
+        ndc_y = 2.0 * corner_y / region_height - 1.0
+
+        # ray of the source pixel between the clip planes
+        near = source_inverse @ Vector((ndc_x, ndc_y, -1.0, 1.0))
+        far = source_inverse @ Vector((ndc_x, ndc_y, 1.0, 1.0))
+        if abs(near.w) < 1e-12 or abs(far.w) < 1e-12:
+            return None
+
+        near = near.xyz / near.w
+        direction = far.xyz / far.w - near
+
+        denominator = direction.dot(source.normal)
+        if abs(denominator) < 1e-12:
+            return None
+
+        t = (source.point - near).dot(source.normal) / denominator
+        if t < 0.0 and source.is_perspective:
+            return None
+
+        clip = target.matrix @ (near + direction * t).to_4d()
+        if clip.w < 1e-6:
+            # behind the target view
+            return None
+
+        points.append(((clip.x / clip.w + 1.0) * 0.5 * region_width, (clip.y / clip.w + 1.0) * 0.5 * region_height))
+
+    h = get_homography(corners, points)
+    if h is None:
+        return None
+
+    # (x, y, 0, 1) -> (x', y', 0, w'), the perspective divide of the draw does the rest
+    return Matrix((
+        (h[0][0], h[0][1], 0.0, h[0][2]),
+        (h[1][0], h[1][1], 0.0, h[1][2]),
+        (0.0, 0.0, 1.0, 0.0),
+        (h[2][0], h[2][1], 0.0, h[2][2]),
+    ))
+
+def create_texture(pixels):
+    """ Returns GPUTexture with the (height, width, 4) pixels """
+    height, width = pixels.shape[0:2]
+    data = pixels_to_float(pixels)
+
+    buffer = gpu.types.Buffer('FLOAT', data.size, data.ravel())
+    texture_format = 'RGBA16F' if pixels.dtype == np.float16 else 'RGBA32F'
+
+    return gpu.types.GPUTexture((width, height), format=texture_format, data=buffer)
+
+def get_gpu_backend():
+    """ Returns 'OPENGL', 'VULKAN', 'METAL' ... of the GPU module """
+    if hasattr(gpu.platform, "backend_type_get"):
+        return gpu.platform.backend_type_get()
+
+    return 'OPENGL'
+
+class TextureStaging:
+    """
+    Reused gpu.types.Buffer the frames are copied into for the upload, one per resolution and pixel format.
+    8-bit frames are uploaded as RGBA8 without the conversion to float. The GPU module cannot update
+    a GPUTexture in place, the texture is created from the buffer once per received frame
+    """
+
+    # dtype of the frame: (buffer format, buffer dtype, texture format)
+    FORMATS = {
+        np.dtype(np.uint8): ('UBYTE', np.uint8, 'RGBA8'),
+        np.dtype(np.float16): ('FLOAT', np.float32, 'RGBA16F'),
+        np.dtype(np.float32): ('FLOAT', np.float32, 'RGBA32F'),
+    }
+
+    def __init__(self):
+        self.key = None
+        self.buffer = None
+        # numpy view of the buffer, None if the Buffer has no buffer protocol
+        self.array = None
+        # (seq, first row) of the partial frame in the buffer, see update_rows
+        self.rows = None
+
+    def _allocate(self, pixels):
+        height, width = pixels.shape[0:2]
+        buffer_format, dtype, texture_format = self.FORMATS[pixels.dtype]
+
+        key = (width, height, pixels.dtype)
+        if self.key != key:
+            self.key = key
+            self.buffer = gpu.types.Buffer(buffer_format, pixels.size)
+            try:
+                self.array = np.frombuffer(self.buffer, dtype=dtype)
+                # rows of a partial frame which did not arrive yet
+                self.array.fill(0)
+            except (TypeError, ValueError):
+                self.array = None
+
+        return self.array is not None and self.array.size == pixels.size
+
+    def _create(self):
+        width, height, pixels_dtype = self.key
+        return gpu.types.GPUTexture((width, height), format=self.FORMATS[pixels_dtype][2], data=self.buffer)
+
+    def create_texture(self, pixels):
+        self.rows = None
+        if not self._allocate(pixels):
+            return create_texture(pixels)
+
+        # float16 is widened by the copy
+        np.copyto(self.array, pixels.reshape(-1))
+        return self._create()
+
+    def update_rows(self, seq, pixels, y, allocate=False):
+        """
+        Copies the rows from y up of the frame seq which were not copied yet into the buffer, the other rows keep
+        the previous frame. Returns the GPUTexture, None if the buffer has another format and allocate is False
+        """
+        height, width = pixels.shape[0:2]
+        if self.key != (width, height, pixels.dtype) and not allocate:
+            return None
+
+        if not self._allocate(pixels):
+            return None
+
+        top = self.rows[1] if self.rows is not None and self.rows[0] == seq else height
+        if y < top:
+            rows = self.array.reshape(pixels.shape)
+            np.copyto(rows[y:top], pixels[y:top])
+
+        self.rows = (seq, y)
+        return self._create()
+
+    def free(self):
+        self.key = None
+        self.buffer = None
+        self.array = None
+        self.rows = None
+
+def create_depth_texture(depth):
+    """ Returns single channel GPUTexture with the (height, width, 1) depth pass """
+    height, width = depth.shape[0:2]
+    data = depth.astype(np.float32)
+
+    buffer = gpu.types.Buffer('FLOAT', data.size, data.ravel())
+    return gpu.types.GPUTexture((width, height), format='R32F', data=buffer)
+
+def get_endpoints(server_settings):
+    """ Returns [(server, port)] of the servers which render the image """
+    endpoints = [(server_settings.braas_hpc_renderengine_server_name, server_settings.braas_hpc_renderengine_port)]
+
+    if server_settings.use_multi_server:
+        endpoints += [(endpoint.server_name, endpoint.port) for endpoint in server_settings.servers]
+
+    return endpoints
+
 #####################################################################################################################
 MAX_ORTHO_DEPTH = 200.0
 
+# how often the idle render thread refreshes the server status, in seconds
+IDLE_POLL_INTERVAL = 0.5
+
+# the camera is considered still when it did not change for this time, in seconds
+CAMERA_STILL_TIME = 0.2
+
+# smaller command scripts are always sent in full, in bytes
+SCRIPT_DIFF_MIN_SIZE = 4096
+
+# command script digest in the keys of frames requested while the server may still render the previous script
+COMMAND_PENDING = "pending"
+
+# a viewport without focus sends at most one request per interval while the focused one renders, see ViewportScheduler
+BACKGROUND_FRAME_INTERVAL = 0.1
+
+# relative and absolute difference of the view values below which the view did not change, see ViewState
+VIEW_STATE_TOLERANCE = 1e-6
+
+# auto stream format: a format is kept at least STREAM_FORMAT_HOLD_TIME seconds. A cheaper one is used when a frame
+# takes more than the downgrade share of the frame time budget to transfer, the better one again when it would take
+# less than the upgrade share. Lossy formats do not go below STREAM_FORMAT_MIN_QUALITY
+STREAM_FORMAT_HOLD_TIME = 1.0
+STREAM_FORMAT_DOWNGRADE_SHARE = 0.5
+STREAM_FORMAT_UPGRADE_SHARE = 0.25
+STREAM_FORMAT_MIN_QUALITY = 50
+
+# camera prediction: samples closer in time replace each other, the prediction is at most this far ahead
+# and the real view is sent when the view did not change for this time, in seconds
+PREDICTION_MIN_INTERVAL = 0.002
+PREDICTION_MAX_TIME = 0.25
+PREDICTION_STOP_TIME = 0.05
+
+# a resize of the viewport region is sent when the region did not change for this time, in seconds
+RESIZE_DEBOUNCE_TIME = 0.1
+
+# how often the final render copies the progressive frame to the render result, in seconds
+RESULT_UPDATE_INTERVAL = 1.0
+
+# view_camera_zoom for which the camera frame fills the whole image,
+# zoom = 4.0 / (2.0 ** 0.5 + view_camera_zoom / 50.0) ** 2 == 1.0, see CameraData.init_from_context
+FULL_FRAME_VIEW_CAMERA_ZOOM = 50.0 * (2.0 - 2.0 ** 0.5)
+
+# render pass name: auxiliary pass of the server, see FinalEngine.write_result
+RENDER_PASSES = {
+    "Depth": braas_hpc_renderengine_transport.PASS_DEPTH,
+    "Normal": braas_hpc_renderengine_transport.PASS_NORMAL,
+    "Samples": braas_hpc_renderengine_transport.PASS_SAMPLES,
+}
+
+# Blender's depth of pixels where nothing was hit
+RENDER_PASS_DEPTH_BACKGROUND = 1.0e10
+
+# unit quad, scaled to the render border in draw
+QUAD_COORDS = ((0, 0), (1, 0), (1, 1), (0, 1))
+
+# Custom shader that doesn't transform colors
+RAW_VERTEX_SHADER = '''
+uniform mat4 ModelViewProjectionMatrix;
+in vec2 pos;
+in vec2 texCoord;
+out vec2 texCoord_interp;
+
+void main() {
+    gl_Position = ModelViewProjectionMatrix * vec4(pos, 0.0, 1.0);
+    texCoord_interp = texCoord;
+}
+'''
+
+RAW_FRAGMENT_SHADER = '''
+uniform sampler2D image;
+in vec2 texCoord_interp;
+out vec4 fragColor;
+
+void main() {
+    fragColor = texture(image, texCoord_interp);
+}
+'''
+
+# Writes the depth pass into the depth buffer of the viewport, the colors are masked out.
+# depth_projection is (window_matrix[2][2], window_matrix[2][3]) of the view, the pass holds the distance
+# from the camera plane, z_ndc = (P23 - P22 * d) / d in perspective and P23 - P22 * d in orthographic views
+DEPTH_FRAGMENT_SHADER = '''
+uniform sampler2D depth;
+uniform vec2 depth_projection;
+uniform int is_perspective;
+uniform float background;
+in vec2 texCoord_interp;
+out vec4 fragColor;
+
+void main() {
+    float d = texture(depth, texCoord_interp).r;
+    if (d >= background || d <= 0.0) {
+        gl_FragDepth = 1.0;
+    } else {
+        float z = depth_projection.y - depth_projection.x * d;
+        if (is_perspective != 0) {
+            z /= d;
+        }
+        gl_FragDepth = clamp(z * 0.5 + 0.5, 0.0, 1.0);
+    }
+    fragColor = vec4(0.0);
+}
+'''
+
 @dataclass(init=False, eq=True)
 class CameraData:
     """ Comparable dataclass which holds all camera settings """
@@ -442,7 +1552,7 @@ class CameraData:
 
             # data.ortho_size = tuple(data.ortho_size[i] * size[i] for i in (0, 1))
             # data.clip_plane = (camera.clip_start, min(camera.clip_end, MAX_ORTHO_DEPTH + camera.clip_start))
-            zoom = camera.data.ortho_scale
+            zoom = camera.ortho_scale
             data.focal_length = 2.0*zoom/ratio
 
             data.view_perspective = 1
@@ -590,6 +1700,87 @@ class CameraData:
 #####################################################################################################################
 
 
+class ViewProjection:
+    """ World to clip matrix of a view and the plane a frame of the view is reprojected through, see get_reprojection """
+
+    def __init__(self, context: bpy.types.Context):
+        region_data = context.region_data
+
+        self.matrix = region_data.perspective_matrix.copy()
+        self.window_matrix = region_data.window_matrix.copy()
+        self.is_perspective = region_data.is_perspective
+
+        view_inverse = region_data.view_matrix.inverted()
+        eye = view_inverse.translation
+        self.normal = (view_inverse.to_3x3() @ Vector((0.0, 0.0, -1.0))).normalized()
+
+        # the plane through the view pivot, view_distance ahead in camera view
+        distance = (region_data.view_location - eye).dot(self.normal)
+        if region_data.view_perspective == 'CAMERA' or distance <= 0.0:
+            distance = region_data.view_distance
+
+        self.distance = distance
+        self.point = eye + self.normal * distance
+
+    def moved(self, view_inverse):
+        """ Returns the projection of the same view with the camera to world matrix view_inverse, see CameraPredictor """
+        projection = copy.copy(self)
+        projection.matrix = self.window_matrix @ view_inverse.inverted_safe()
+        projection.normal = (view_inverse.to_3x3() @ Vector((0.0, 0.0, -1.0))).normalized()
+        projection.point = view_inverse.translation + projection.normal * self.distance
+        return projection
+
+#####################################################################################################################
+
+
+class ViewState:
+    """
+    Raw values of the view which ViewportSettings is built from, read without any matrix math.
+    draw() builds ViewportSettings only when the view state changed. Values closer than VIEW_STATE_TOLERANCE
+    are equal, so float jitter of the view matrix does not send the camera again
+    """
+
+    __slots__ = ("values", "key", "hash")
+
+    PERSPECTIVES = {'PERSP': 0.0, 'ORTHO': 1.0, 'CAMERA': 2.0}
+
+    def __init__(self, context: bpy.types.Context):
+        region_data = context.region_data
+        space_data = context.space_data
+        render = context.scene.render
+        view_matrix = region_data.view_matrix
+        window_matrix = region_data.window_matrix
+
+        # the window matrix holds the lens, clipping, ortho scale, camera zoom, offset and shift
+        self.values = np.array((
+            *view_matrix[0], *view_matrix[1], *view_matrix[2], *view_matrix[3],
+            *window_matrix[0], *window_matrix[1], *window_matrix[2], *window_matrix[3],
+            context.region.width, context.region.height,
+            self.PERSPECTIVES.get(region_data.view_perspective, -1.0),
+            render.resolution_x, render.resolution_y,
+            render.use_border, render.border_min_x, render.border_min_y, render.border_max_x, render.border_max_y,
+            space_data.use_render_border, space_data.render_border_min_x, space_data.render_border_min_y,
+            space_data.render_border_max_x, space_data.render_border_max_y,
+        ), dtype=np.float64)
+
+        self.key = self.values.tobytes()
+        self.hash = hash(self.key)
+
+    def __eq__(self, other):
+        if not isinstance(other, ViewState):
+            return NotImplemented
+
+        if self.hash == other.hash and self.key == other.key:
+            return True
+
+        return np.allclose(self.values, other.values, rtol=VIEW_STATE_TOLERANCE, atol=VIEW_STATE_TOLERANCE)
+
+    # equal states may differ within the tolerance, see hash
+    __hash__ = None
+
+#####################################################################################################################
+
+
 @dataclass(init=False, eq=True)
 class ViewportSettings:
     """
@@ -618,30 +1809,338 @@ class ViewportSettings:
         self.camera_data = CameraData.init_from_context(context)
         self.screen_width, self.screen_height = context.region.width, context.region.height
 
+        # not compared, it follows the camera data
+        self.projection = ViewProjection(context)
+
         scene = context.scene
 
         # getting render border
         x1, y1 = 0, 0
         x2, y2 = self.screen_width, self.screen_height
 
-        # getting render resolution and render border
-        self.width, self.height = x2 - x1, y2 - y1
-        self.border = (x1, y1), (self.width, self.height)
+        if context.region_data.view_perspective == 'CAMERA':
+            if scene.render.use_border:
+                # the border is relative to the camera frame in the region
+                camera_obj = context.space_data.camera
+                screen_points = [view3d_utils.location_3d_to_region_2d(context.region, context.region_data, camera_obj.matrix_world @ p)
+                                 for p in camera_obj.data.view_frame(scene=scene)]
 
-#####################################################################################################################
+                if None not in screen_points:
+                    x, y = min(p[0] for p in screen_points), min(p[1] for p in screen_points)
+                    dx, dy = max(p[0] for p in screen_points) - x, max(p[1] for p in screen_points) - y
 
+                    x1, x2 = int(x + scene.render.border_min_x * dx), int(x + scene.render.border_max_x * dx)
+                    y1, y2 = int(y + scene.render.border_min_y * dy), int(y + scene.render.border_max_y * dy)
 
-class Engine:
-    """ This is the basic Engine class """
+        elif context.space_data.use_render_border:
+            x1, x2 = int(context.space_data.render_border_min_x * self.screen_width), int(context.space_data.render_border_max_x * self.screen_width)
+            y1, y2 = int(context.space_data.render_border_min_y * self.screen_height), int(context.space_data.render_border_max_y * self.screen_height)
 
-    def __init__(self, braas_hpc_renderengine_engine):
-        self.braas_hpc_renderengine_engine = weakref.proxy(braas_hpc_renderengine_engine)
-        self.braas_hpc_renderengine_context = BRaaSHPCContext()
+        # adjusting to the region, at least one pixel
+        x1 = max(0, min(x1, self.screen_width - 1))
+        y1 = max(0, min(y1, self.screen_height - 1))
+        x2 = max(x1 + 1, min(x2, self.screen_width))
+        y2 = max(y1 + 1, min(y2, self.screen_height))
+
+        # the render resolution is the region, the server renders only the border if the transport supports regions
+        self.width, self.height = self.screen_width, self.screen_height
+        self.border = (x1, y1), (x2 - x1, y2 - y1)
+
+    def get_border_rect(self):
+        """ Returns (x, y, width, height) of the render border """
+        (x, y), (width, height) = self.border
+        return x, y, width, height
+
+    def has_border(self):
+        return self.border != ((0, 0), (self.width, self.height))
+
+#####################################################################################################################
+
+
+class ResolutionScaleController:
+    """
+    Chooses the render resolution scale during camera navigation so the frame time meets the budget.
+    Frame time is assumed to be proportional to the number of pixels, the scale is quantized to limit resizes.
+    """
+
+    SCALE_STEP = 0.125
+
+    def __init__(self, frame_time_budget=0.0333, min_scale=0.25):
+        self.frame_time_budget = frame_time_budget
+        self.min_scale = min_scale
+        self.scale = 1.0
+
+    def update(self, frame_time):
+        """ Updates the scale from the measured frame time in seconds, returns True if it changed """
+        if frame_time <= 0.0:
+            return False
+
+        target = self.scale * math.sqrt(self.frame_time_budget / frame_time)
+        target = round(target / self.SCALE_STEP) * self.SCALE_STEP
+        target = min(max(target, self.min_scale), 1.0)
+
+        # hysteresis, the frame time has to be off by more than one step
+        if abs(target - self.scale) < self.SCALE_STEP:
+            return False
+
+        self.scale = target
+        return True
+
+def get_stream_formats(pixsize, codec, quality):
+    """
+    Returns [(pixsize, codec, quality)] from the preferred format to the cheapest one: smaller pixel sizes
+    with a lossless codec, then 8-bit with a lossy codec at the preferred and at the minimum quality
+    """
+    codecs = braas_hpc_renderengine_codec.CODECS
+    formats = [(pixsize, codec, quality)]
+
+    lossless = codec if codecs[codec].lossless else braas_hpc_renderengine_codec.CODEC_RAW
+    for smaller in (16, 8):
+        if smaller < pixsize:
+            formats.append((smaller, lossless, quality))
+
+    lossy = [name for name in braas_hpc_renderengine_codec.available_codecs(8) if not codecs[name].lossless]
+    if lossy:
+        lossy = codec if not codecs[codec].lossless else lossy[0]
+        for lossy_quality in (quality, min(quality, STREAM_FORMAT_MIN_QUALITY)):
+            if (8, lossy, lossy_quality) not in formats:
+                formats.append((8, lossy, lossy_quality))
+
+    return formats
+
+class StreamFormatController:
+    """
+    Chooses the format of the frames during camera navigation from the measured link throughput,
+    so a frame is transferred within a share of the frame time budget. Level 0 is the preferred format,
+    higher levels are cheaper, see get_stream_formats. The level changes by one at a time.
+    """
+
+    def __init__(self, frame_time_budget=0.0333):
+        self.frame_time_budget = frame_time_budget
+        self.formats = []
+        self.level = 0
+        # bytes per pixel measured for the levels
+        self.bytes_per_pixel = {}
+        # bytes per second, moving average
+        self.throughput = 0.0
+        self.change_time = None
+
+    @property
+    def format(self):
+        return self.formats[self.level] if self.formats else None
+
+    def set_formats(self, formats):
+        if formats != self.formats:
+            self.formats = formats
+            self.level = 0
+            self.bytes_per_pixel = {}
+
+    def reset(self):
+        """ The camera is still, the preferred format is the quality floor """
+        self.level = 0
+
+    def update(self, now, frame_bytes, transfer_time, pixels):
+        """ Updates the level from the last frame, returns True if it changed """
+        if not self.formats or transfer_time <= 0.0 or pixels <= 0:
+            return False
+
+        throughput = frame_bytes / transfer_time
+        self.throughput = throughput if self.throughput == 0.0 else 0.8 * self.throughput + 0.2 * throughput
+        self.bytes_per_pixel[self.level] = frame_bytes / pixels
+
+        # hysteresis, the new format needs some frames to be measured
+        if self.change_time is not None and now - self.change_time < STREAM_FORMAT_HOLD_TIME:
+            return False
+
+        level = self.level
+        if frame_bytes / self.throughput > self.frame_time_budget * STREAM_FORMAT_DOWNGRADE_SHARE:
+            level = min(level + 1, len(self.formats) - 1)
+        elif level > 0:
+            # raw size until the better format was measured
+            pixsize = self.formats[level - 1][0]
+            bytes_per_pixel = self.bytes_per_pixel.get(level - 1, braas_hpc_renderengine_transport.CHANNELS * pixsize // 8)
+            if pixels * bytes_per_pixel / self.throughput < self.frame_time_budget * STREAM_FORMAT_UPGRADE_SHARE:
+                level -= 1
+
+        if level == self.level:
+            return False
+
+        self.level = level
+        self.change_time = now
+        return True
+
+class CameraPredictor:
+    """
+    Extrapolates the view from its last two samples to the time a frame requested now is shown.
+    The rotation, the distance to the view pivot and the pivot are extrapolated separately,
+    so orbits, pans and zooms at a steady speed are predicted exactly.
+    """
+
+    def __init__(self):
+        # (time, camera to world Matrix, view pivot Vector)
+        self.samples = deque(maxlen=2)
+        # the server has a predicted view, the real one is sent when the view stops changing
+        self.is_predicted = False
+
+    def reset(self):
+        self.samples.clear()
+        self.is_predicted = False
+
+    def add(self, now, transform, pivot):
+        """ Adds a sample of the view. A sample which the prediction missed by more than no prediction restarts the history """
+        if self.samples and now - self.samples[-1][0] < PREDICTION_MIN_INTERVAL:
+            self.samples.pop()
+
+        if len(self.samples) == 2:
+            predicted = self.extrapolate(now)
+            if predicted is not None and get_pose_error(predicted, transform, pivot) > get_pose_error(self.samples[-1][1], transform, pivot):
+                self.samples.clear()
+
+        self.samples.append((now, transform.copy(), pivot.copy()))
+
+    def extrapolate(self, time_ahead):
+        """ Returns the camera to world Matrix at the time, None if the view does not move steadily """
+        if len(self.samples) < 2:
+            return None
+
+        (time0, transform0, pivot0), (time1, transform1, pivot1) = self.samples
+        interval = time1 - time0
+        if interval <= 0.0 or interval > CAMERA_STILL_TIME:
+            return None
+
+        factor = (time_ahead - time1) / interval
+
+        rotation0 = transform0.to_3x3()
+        rotation1 = transform1.to_3x3()
+        axis, angle = (rotation1 @ rotation0.transposed()).to_quaternion().to_axis_angle()
+        rotation = Quaternion(axis, angle * factor).to_matrix()
+
+        # the camera around the pivot, the distance changes by the same ratio per interval
+        offset0 = transform0.translation - pivot0
+        offset1 = transform1.translation - pivot1
+        scale = 1.0
+        if offset0.length > 1e-6 and offset1.length > 1e-6:
+            scale = (offset1.length / offset0.length) ** factor
+
+        pivot = pivot1 + (pivot1 - pivot0) * factor
+
+        result = (rotation @ rotation1).to_4x4()
+        result.translation = pivot + (rotation @ offset1) * scale
+        return result
+
+    def predict(self, now, time_ahead, camera_data, projection):
+        """ Returns (CameraData, ViewProjection) of the view extrapolated by time_ahead, or the given ones """
+        if camera_data.use_view_camera or camera_data.view_perspective != 0:
+            # the camera object is not navigated, an orthographic zoom is not in the transform
+            return camera_data, projection
+
+        transform = self.extrapolate(now + min(time_ahead, PREDICTION_MAX_TIME))
+        if transform is None:
+            self.is_predicted = False
+            return camera_data, projection
+
+        predicted = copy.copy(camera_data)
+        predicted.transform = tuple(transform)
+        predicted.quat = tuple(transform.to_quaternion())
+        predicted.pos = tuple(transform.to_translation())
+
+        self.is_predicted = True
+        return predicted, projection.moved(transform) if projection is not None else None
+
+    def is_stopped(self, now):
+        """ True when the view did not change for longer than the interval of its samples """
+        if not self.samples:
+            return True
+
+        interval = self.samples[-1][0] - self.samples[0][0] if len(self.samples) == 2 else 0.0
+        return now - self.samples[-1][0] > max(2.0 * interval, PREDICTION_STOP_TIME)
+
+def get_pose_error(transform, target, pivot):
+    """ Distance of two camera to world matrices, the translation relative to the distance from the pivot plus the angle """
+    distance = max((target.translation - pivot).length, 1e-3)
+    angle = transform.to_quaternion().rotation_difference(target.to_quaternion()).angle
+    return (transform.translation - target.translation).length / distance + angle
+
+#####################################################################################################################
+
+
+class Engine:
+    """ This is the basic Engine class """
+
+    def __init__(self, braas_hpc_renderengine_engine):
+        self.braas_hpc_renderengine_engine = weakref.proxy(braas_hpc_renderengine_engine)
+        self.braas_hpc_renderengine_context = BRaaSHPCContext()
         bpy.context.scene.braas_hpc_renderengine_data.braas_hpc_renderengine_context = self.braas_hpc_renderengine_context
         bpy.context.scene.braas_hpc_renderengine_data.braas_hpc_renderengine_engine = self.braas_hpc_renderengine_engine
 
 #####################################################################################################################
 
+class MouseTracker:
+    """ Last mouse position in window coordinates, updated by BRaaSHPCTrackMouseOperator while running """
+
+    def __init__(self):
+        self.running = False
+        self.position = None
+
+    def get_region_position(self, region):
+        """ Returns the position within the region or None when the mouse is elsewhere """
+        if self.position is None:
+            return None
+
+        x, y = self.position[0] - region.x, self.position[1] - region.y
+        if 0 <= x < region.width and 0 <= y < region.height:
+            return x, y
+
+        return None
+
+MOUSE_TRACKER = MouseTracker()
+
+class ViewportScheduler:
+    """
+    Rendered viewports. The focused one, whose camera moved last, is published in braas_hpc_renderengine_data
+    and renders at full rate, the others at most once per BACKGROUND_FRAME_INTERVAL until it converges.
+    """
+
+    def __init__(self):
+        self.engines = []
+        self.focused = None
+
+    def add(self, engine):
+        self.engines.append(engine)
+        self.focus(engine)
+
+    def remove(self, engine):
+        if engine in self.engines:
+            self.engines.remove(engine)
+
+        if self.focused is engine:
+            self.focused = None
+            if self.engines:
+                self.focus(self.engines[-1])
+
+    def focus(self, engine):
+        if self.focused is engine:
+            return
+
+        self.focused = engine
+
+        braas_hpc_renderengine_data = bpy.types.Scene.braas_hpc_renderengine_data
+        braas_hpc_renderengine_data.braas_hpc_renderengine_context = engine.braas_hpc_renderengine_context
+        braas_hpc_renderengine_data.braas_hpc_renderengine_engine = engine.braas_hpc_renderengine_engine
+
+    def get_wait_time(self, engine):
+        """ Returns the time the engine waits before its next request """
+        focused = self.focused
+        if focused is None or focused is engine or focused.is_finished or focused.is_converged:
+            return 0.0
+
+        return BACKGROUND_FRAME_INTERVAL
+
+# shared by all viewport engines
+VIEWPORT_SCHEDULER = ViewportScheduler()
+
+#####################################################################################################################
+
 
 class ViewportEngine(Engine):
     """ Viewport render engine """
@@ -651,10 +2150,14 @@ class ViewportEngine(Engine):
 
         #self.gl_texture = None #GLTexture = None
         self.viewport_settings: ViewportSettings = None
+        # ViewState of viewport_settings, an unchanged view reuses them
+        self.view_state: ViewState = None
 
         self.sync_render_thread: threading.Thread = None
+        # SpaceTextEditor draw handler, see notify_text_editor
+        self.text_draw_handler = None
         self.restart_render_event = threading.Event()
-        self.render_lock = threading.Lock()
+        self.render_lock = self.braas_hpc_renderengine_context.render_lock
         self.render_event = threading.Event()
         #self.resolve_lock = threading.Lock()
 
@@ -662,7 +2165,56 @@ class ViewportEngine(Engine):
         self.is_synced = False
         self.is_rendered = False
         # self.is_denoised = False
-        self.is_resized = False
+        self.is_converged = False
+
+        # ((width, height), region) last requested from the render thread, see BRaaSHPCContext.request_resize
+        self.resize_target = None
+
+        # frames requested before this sequence number do not count towards convergence
+        self.restart_seq = 0
+        self.frame_current = None
+
+        # shaders and quads of the draw pass, built on the first draw, see free_draw_resources
+        self.image_shader = None
+        self.image_batch = None
+        self.raw_shader = None
+        self.raw_batch = None
+        self.depth_shader = None
+        self.depth_batch = None
+
+        # UI thread time of draw(), moving average in seconds
+        self.draw_time = 0.0
+        self.draw_count = 0
+
+        # neighbouring timesteps rendered into the frame cache while idle
+        self.prefetch_radius = 0
+
+        # adaptive resolution during camera navigation
+        self.use_adaptive_resolution = False
+        self.resolution_controller = ResolutionScaleController()
+        self.use_auto_format = False
+        self.format_controller = StreamFormatController()
+        self.camera_change_time = 0.0
+        self.time_frame = None
+
+        # status line of the last frame and what was shown with the server status, see notify_frame_status
+        self.frame_info = None
+        self.frame_status = None
+
+        # the last frame is warped to the current view until a new frame arrives, see get_reprojection
+        self.use_reprojection = True
+        # the depth pass of the frame is written to the depth buffer, see draw_depth_2d
+        self.use_depth_composite = False
+
+        # the camera is sent extrapolated by the round trip time while it moves, see CameraPredictor
+        self.use_camera_prediction = False
+        self.camera_predictor = CameraPredictor()
+
+        # foveated rendering during camera navigation, see get_roi
+        self.use_foveated = False
+        self.foveated_center = 'MOUSE'
+        self.foveated_size = 0.3
+        self.foveated_periphery_scale = 0.5
 
         # self.render_iterations = 0
         # self.render_time = 0
@@ -674,6 +2226,12 @@ class ViewportEngine(Engine):
         print("start_render")
         self.is_finished = False
 
+        # writes through Python (TextLine.body) are published by msgbus, typing redraws the Text editor.
+        # Text.from_string and Text.write are notified with the update_command_script operator
+        for key in (bpy.types.Text, (bpy.types.TextLine, "body")):
+            bpy.msgbus.subscribe_rna(key=key, owner=self, args=(), notify=self.notify_command_script)
+        self.text_draw_handler = bpy.types.SpaceTextEditor.draw_handler_add(self.notify_text_editor, (), 'WINDOW', 'POST_PIXEL')
+
         #print('Start _do_sync_render')
         self.restart_render_event.clear()
         self.render_event.clear()
@@ -684,31 +2242,41 @@ class ViewportEngine(Engine):
     def stop_render(self):
         print("stop_render")
         self.is_finished = True
+        VIEWPORT_SCHEDULER.remove(self)
+        bpy.msgbus.clear_by_owner(self)
+        if self.text_draw_handler is not None:
+            bpy.types.SpaceTextEditor.draw_handler_remove(self.text_draw_handler, 'WINDOW')
+            self.text_draw_handler = None
+
+        if self.sync_render_thread is None:
+            # sync did not start rendering
+            return
 
         self.restart_render_event.set()
         self.sync_render_thread.join()        
 
         self.braas_hpc_renderengine_context.client_close_connection()
+        self.free_draw_resources()
 
         #self.braas_hpc_renderengine_context = None
         #self.image_filter = None
         #pass
 
+    def notify_status(self, info, status):
+        """ Display export progress status """
+        wrap_info = textwrap.fill(info, 120)
+        self.braas_hpc_renderengine_engine.update_stats(status, wrap_info)
+        # log(status, wrap_info)
+
+        # requesting blender to call draw()
+        self.braas_hpc_renderengine_engine.tag_redraw()
+
     def _do_sync_render(self):
         """
         Thread function for self.sync_render_thread. It always run during viewport render.
         If it doesn't render it waits for self.restart_render_event
         """
 
-        def notify_status(info, status):
-            """ Display export progress status """
-            wrap_info = textwrap.fill(info, 120)
-            self.braas_hpc_renderengine_engine.update_stats(status, wrap_info)
-            # log(status, wrap_info)
-
-            # requesting blender to call draw()
-            self.braas_hpc_renderengine_engine.tag_redraw()
-
         class FinishRender(Exception):
             pass
 
@@ -717,13 +2285,13 @@ class ViewportEngine(Engine):
 
         try:
             # SYNCING OBJECTS AND INSTANCES
-            notify_status("Starting...", "Sync")
+            self.notify_status("Starting...", "Sync")
             time_begin = time.perf_counter()
 
             self.is_synced = True
 
             # RENDERING
-            notify_status("Starting...", "Render")
+            self.notify_status("Starting...", "Render")
 
             # Infinite cycle, which starts when scene has to be re-rendered.
             # It waits for restart_render_event be enabled.
@@ -738,6 +2306,28 @@ class ViewportEngine(Engine):
                 if self.is_finished:
                     raise FinishRender
 
+                # the region is still being resized, nothing is rendered at a size which is about to change
+                resize_wait = self.braas_hpc_renderengine_context.get_resize_wait(time.perf_counter())
+                if resize_wait > 0.0:
+                    # stop_render and the next draw interrupt the wait, the restart is handled after the resize
+                    self.restart_render_event.clear()
+                    self.restart_render_event.wait(resize_wait)
+                    self.restart_render_event.set()
+                    continue
+
+                if self.braas_hpc_renderengine_context.resize_pending is not None:
+                    with self.render_lock:
+                        self.braas_hpc_renderengine_context.apply_resize()
+
+                if self.braas_hpc_renderengine_context.native_resize_pending is not None:
+                    # nothing is requested until the next draw has resized the texture of the native module
+                    self.restart_render_event.clear()
+                    if self.braas_hpc_renderengine_context.native_resize_pending is not None:
+                        self.braas_hpc_renderengine_engine.tag_redraw()
+                        self.restart_render_event.wait()
+                    self.restart_render_event.set()
+                    continue
+
                 # preparations to start rendering
                 #iteration = 0
                 # time_begin = time.perf_counter()
@@ -763,6 +2353,16 @@ class ViewportEngine(Engine):
                     # with self.render_lock:
                 if self.restart_render_event.is_set():
                     self.restart_render_event.clear()
+                    self.is_converged = False
+                    self.restart_seq = self.braas_hpc_renderengine_context.frame_seq
+
+                    # a visited timestep is shown at once, it is rendered only if it did not converge
+                    cached_samples = self.braas_hpc_renderengine_context.show_cached_frame()
+                    if cached_samples is not None:
+                        self.is_rendered = True
+                        self.is_converged = self.braas_hpc_renderengine_context.is_converged(cached_samples)
+                        self.render_event.set()
+                        self.notify_status(f"Samples: {cached_samples} | Cached", "Render")
                     #         break
 
                     #self.braas_hpc_renderengine_context.render(restart=(iteration == 0))
@@ -771,28 +2371,90 @@ class ViewportEngine(Engine):
                     #     self.is_resized = False                    
 
                     
+                # the focused viewport has priority
+                wait_time = VIEWPORT_SCHEDULER.get_wait_time(self)
+                if wait_time > 0.0 and not self.is_converged:
+                    self.restart_render_event.wait(wait_time)
+                    if self.is_finished:
+                        raise FinishRender
+
                 with self.render_lock:
                     #start_render_time = time.perf_counter()
-                    self.braas_hpc_renderengine_context.render()
+                    # keep pipeline_depth requests in flight while refining, show the newest frame only
+                    if not self.is_converged:
+                        self.braas_hpc_renderengine_context.fill_pipeline()
+                    is_newest = self.braas_hpc_renderengine_context.recv_frame()
+                    frames_in_flight = len(self.braas_hpc_renderengine_context.frames_in_flight)
                     #end_render_time = time.perf_counter() - start_render_time
                     #render_fps = 1.0 / end_render_time
-                
-                self.is_rendered = True
-                self.is_resized = False
 
-                current_samples = self.braas_hpc_renderengine_context.get_current_samples()
+                # stale frames (a request with the current camera is already in flight) are not shown,
+                # except by the native module, whose texture already holds them
+                if is_newest:
+                    self.is_rendered = True
+
+                    # the frame time is measured between frames of the whole view
+                    if not self.braas_hpc_renderengine_context.received_roi:
+                        time_frame = time.perf_counter()
+                        if self.use_adaptive_resolution and self.time_frame is not None and self.is_navigating(time_frame):
+                            self.resolution_controller.update(time_frame - self.time_frame)
+                        self.time_frame = time_frame
+
+                        self.update_stream_format(time_frame)
+
+                    current_samples = self.braas_hpc_renderengine_context.get_current_samples()
+
+                    # a reduced resolution frame is never final, the next draw() refines it
+                    # a predicted view is replaced by the real one, draw() needs the frames to notice the stop
+                    if self.braas_hpc_renderengine_context.frame_seq_received > self.restart_seq \
+                            and self.braas_hpc_renderengine_context.is_converged(current_samples) \
+                            and self.is_full_resolution() \
+                            and self.format_controller.level == 0 \
+                            and not self.camera_predictor.is_predicted \
+                            and not self.braas_hpc_renderengine_context.is_command_pending():
+                        self.is_converged = True
+
+                    self.render_event.set()
 
-                self.render_event.set()
+                    time_render = time.perf_counter() - time_begin
+                    rfps, lfps = self.braas_hpc_renderengine_context.get_fps() #current_samples / time_render
+                    info_str = f"Time: {time_render:.1f} sec"\
+                            f" | Samples: {current_samples}" \
+                            f" | FPS (r): {rfps:.1f}" \
+                            f" | FPS: {lfps:.1f}" \
+                            f" | Draw: {self.draw_time * 1000.0:.2f} ms"
+                    #f" | FPS (p): {render_fps:.1f}"
 
-                time_render = time.perf_counter() - time_begin
-                rfps, lfps = self.braas_hpc_renderengine_context.get_fps() #current_samples / time_render
-                info_str = f"Time: {time_render:.1f} sec"\
-                        f" | Samples: {current_samples}" \
-                        f" | FPS (r): {rfps:.1f}" \
-                        f" | FPS: {lfps:.1f}"
-                #f" | FPS (p): {render_fps:.1f}"
+                    codec_stats = self.braas_hpc_renderengine_context.get_codec_stats()
+                    if codec_stats is not None and codec_stats["codec"] != 'RAW':
+                        info_str += f" | {codec_stats['codec']}: {codec_stats['ratio']:.1f}x, {codec_stats['decode_ms']:.1f} ms"
 
-                notify_status(info_str, "Render")
+                    if self.format_controller.level > 0:
+                        pixsize, codec, quality = self.format_controller.format
+                        info_str += f" | Format: {pixsize}-bit {codec}"
+
+                    if not self.is_full_resolution():
+                        info_str += f" | Scale: {self.braas_hpc_renderengine_context.width / self.viewport_settings.width:.0%}"
+
+                    if self.is_converged:
+                        info_str += " | Converged"
+
+                    self.frame_info = info_str
+                    self.notify_frame_status()
+
+                if self.is_converged and frames_in_flight == 0:
+                    self.prefetch_timesteps()
+
+                    # idle: nothing is sent until camera, resolution, frame, scene or script changes
+                    while not self.restart_render_event.wait(IDLE_POLL_INTERVAL):
+                        if self.is_finished:
+                            break
+
+                        # the control connection keeps reporting while no frames are requested
+                        self.notify_frame_status()
+
+                    # the idle time is not a frame time
+                    self.time_frame = None
 
         except FinishRender:
             #print("Finish by user")
@@ -835,6 +2497,13 @@ class ViewportEngine(Engine):
         scene.braas_hpc_renderengine.server_settings.width = width
         scene.braas_hpc_renderengine.server_settings.height = height
 
+        if self.braas_hpc_renderengine_context.is_native() and get_gpu_backend() != 'OPENGL' \
+                and not self.braas_hpc_renderengine_context.transport.can_copy_pixels:
+            # the texture of the native module cannot be drawn and its frames cannot be copied, nothing is rendered
+            self.notify_status(f"The native module cannot copy frames for the {get_gpu_backend()} backend, "
+                               "update braas_hpc_renderengine_dll or use OpenGL", "ERROR")
+            return
+
         #pref = braas_hpc_renderengine_pref.preferences()
 
         # client_init(const char *server, int port_cam, int port_data, int w, int h, int step_samples)
@@ -843,11 +2512,38 @@ class ViewportEngine(Engine):
                                   #scene.braas_hpc_renderengine.server_settings.braas_hpc_renderengine_port_data,
                                   scene.braas_hpc_renderengine.server_settings.width,
                                   scene.braas_hpc_renderengine.server_settings.height,
-                                  scene.braas_hpc_renderengine.server_settings.step_samples
+                                  scene.braas_hpc_renderengine.server_settings.step_samples,
+                                  scene.braas_hpc_renderengine.server_settings.pipeline_depth,
+                                  scene.braas_hpc_renderengine.server_settings.max_samples,
+                                  scene.braas_hpc_renderengine.server_settings.timesteps,
+                                  get_endpoints(scene.braas_hpc_renderengine.server_settings),
+                                  self.get_passes(scene.braas_hpc_renderengine.server_settings),
+                                  scene.braas_hpc_renderengine.server_settings.band_rows
                                   ) #scene.braas_hpc_renderengine.server_settings.filename
+        self.braas_hpc_renderengine_context.band_callback = self.notify_band
         # if not self.braas_hpc_renderengine_context.gl_interop:
         #self.gl_texture = GLTexture(width, height)
-        self.braas_hpc_renderengine_context.client_init()     
+        try:
+            self.braas_hpc_renderengine_context.client_init()
+        except Exception as e:
+            # e.g. the connection of the native module is used by another viewport
+            self.notify_status(str(e), "ERROR")
+            return
+
+        if self.braas_hpc_renderengine_context.is_native() and get_gpu_backend() != 'OPENGL':
+            # the texture of the native module cannot be drawn, its frames are uploaded by the GPU module
+            self.braas_hpc_renderengine_context.transport.set_double_buffering(True)
+        self.format_controller.set_formats(self.braas_hpc_renderengine_context.get_stream_formats())
+        VIEWPORT_SCHEDULER.add(self)
+        self.update_adaptive_resolution(scene.braas_hpc_renderengine.server_settings)
+        self.update_foveated(scene.braas_hpc_renderengine.server_settings)
+        self.use_reprojection = scene.braas_hpc_renderengine.server_settings.use_reprojection
+        self.use_depth_composite = scene.braas_hpc_renderengine.server_settings.use_depth_composite
+        self.update_camera_prediction(scene.braas_hpc_renderengine.server_settings)
+        self.update_frame_cache(scene.braas_hpc_renderengine.server_settings)
+        self.braas_hpc_renderengine_context.profiler.enabled = scene.braas_hpc_renderengine.server_settings.use_profiling
+        self.braas_hpc_renderengine_context.use_script_diff = scene.braas_hpc_renderengine.server_settings.use_script_diff
+        self.braas_hpc_renderengine_context.command_script.update(scene.braas_hpc_renderengine.server_settings.command_script)
         #################################
 
         # reset scene
@@ -862,66 +2558,350 @@ class ViewportEngine(Engine):
 
         self.start_render()
 
-    def draw_texture_2d_raw(self, texture, position, width, height):
-        import gpu
-        from gpu_extras.batch import batch_for_shader
-
-        # Custom shader that doesn't transform colors
-        vertex_shader = '''
-        uniform mat4 ModelViewProjectionMatrix;
-        in vec2 pos;
-        in vec2 texCoord;
-        out vec2 texCoord_interp;
-        
-        void main() {
-            gl_Position = ModelViewProjectionMatrix * vec4(pos, 0.0, 1.0);
-            texCoord_interp = texCoord;
-        }
-        '''
-        
-        fragment_shader = '''
-        uniform sampler2D image;
-        in vec2 texCoord_interp;
-        out vec4 fragColor;
-        
-        void main() {
-            fragColor = texture(image, texCoord_interp);
-        }
-        '''
-        
-        coords = ((0, 0), (1, 0), (1, 1), (0, 1))
-        shader = gpu.types.GPUShader(vertex_shader, fragment_shader)
-        batch = batch_for_shader(
-            shader, 'TRI_FAN',
-            {"pos": coords, "texCoord": coords},
-        )
+    def sync_update(self, context, depsgraph):
+        """ Called on scene changes after the first sync, wakes up the idle render thread """
+        server_settings = depsgraph.scene.braas_hpc_renderengine.server_settings
+        self.braas_hpc_renderengine_context.pipeline_depth = max(1, server_settings.pipeline_depth)
+        self.braas_hpc_renderengine_context.max_samples = server_settings.max_samples
+        self.braas_hpc_renderengine_context.timesteps = server_settings.timesteps
+        self.update_adaptive_resolution(server_settings)
+        self.update_foveated(server_settings)
+        self.update_frame_cache(server_settings)
+        self.use_reprojection = server_settings.use_reprojection
+        # the passes of the connection do not change, see get_passes
+        self.use_depth_composite = server_settings.use_depth_composite
+        self.update_camera_prediction(server_settings)
+        self.braas_hpc_renderengine_context.profiler.enabled = server_settings.use_profiling
+        self.braas_hpc_renderengine_context.use_script_diff = server_settings.use_script_diff
+        if any(isinstance(update.id, bpy.types.Text) for update in depsgraph.updates):
+            self.braas_hpc_renderengine_context.command_script.invalidate()
+        self.braas_hpc_renderengine_context.command_script.update(server_settings.command_script)
+
+        self.restart_render_event.set()
+
+    @staticmethod
+    def get_passes(server_settings):
+        """ Auxiliary passes requested by the viewport, negotiated once per connection """
+        if server_settings.use_depth_composite:
+            return [braas_hpc_renderengine_transport.PASS_DEPTH]
+
+        return []
+
+    def get_prefetch_timesteps(self):
+        """ Timesteps around the current one which are not converged in the frame cache, nearest first """
+        braas_hpc_renderengine_context = self.braas_hpc_renderengine_context
+        timesteps = braas_hpc_renderengine_context.timesteps
+        if timesteps < 2 or braas_hpc_renderengine_context.max_samples == 0 or braas_hpc_renderengine_context.frame_cache.budget == 0:
+            return []
+
+        # the native module keeps its frames in an OpenGL texture, they cannot be cached
+        if braas_hpc_renderengine_context.transport.provides_gl_texture:
+            return []
+
+        current = braas_hpc_renderengine_context.get_timestep()
+        result = []
+        for distance in range(1, min(self.prefetch_radius, timesteps // 2) + 1):
+            for timestep in ((current + distance) % timesteps, (current - distance) % timesteps):
+                if timestep in result:
+                    continue
+
+                samples = braas_hpc_renderengine_context.frame_cache.get_samples(braas_hpc_renderengine_context.get_frame_key(timestep))
+                if not braas_hpc_renderengine_context.is_converged(samples):
+                    result.append(timestep)
+
+        return result
+
+    def prefetch_timesteps(self):
+        """ Renders the neighbouring timesteps into the frame cache, stops as soon as the viewport restarts """
+        braas_hpc_renderengine_context = self.braas_hpc_renderengine_context
+
+        try:
+            for timestep in self.get_prefetch_timesteps():
+                braas_hpc_renderengine_context.prefetch_timestep = timestep
+                current_samples = 0
+
+                while not braas_hpc_renderengine_context.is_converged(current_samples):
+                    if self.is_finished or self.restart_render_event.is_set():
+                        return
+
+                    # prefetching yields to the focused viewport
+                    if VIEWPORT_SCHEDULER.get_wait_time(self) > 0.0:
+                        return
+
+                    with self.render_lock:
+                        braas_hpc_renderengine_context.fill_pipeline()
+                        braas_hpc_renderengine_context.recv_frame()
+
+                    current_samples = braas_hpc_renderengine_context.get_current_samples()
+
+                with self.render_lock:
+                    braas_hpc_renderengine_context.drain()
+
+        finally:
+            braas_hpc_renderengine_context.prefetch_timestep = None
+
+            # frames of the prefetched timesteps are not shown
+            with self.render_lock:
+                braas_hpc_renderengine_context.drain()
+
+    def notify_command_script(self):
+        """ bpy.msgbus callback, a text block was written. Wakes up the render thread when the command script changed """
+        if self.is_finished:
+            return
+
+        self.braas_hpc_renderengine_context.command_script.invalidate()
+        command_script = bpy.context.scene.braas_hpc_renderengine.server_settings.command_script
+        if self.braas_hpc_renderengine_context.command_script.update(command_script):
+            self.restart_render_event.set()
+
+    def notify_text_editor(self):
+        """ SpaceTextEditor draw handler, the Text editor redraws after every edit of its text """
+        text = bpy.context.space_data.text
+        if text is not None and text == bpy.context.scene.braas_hpc_renderengine.server_settings.command_script:
+            self.notify_command_script()
+
+    def update_frame_cache(self, server_settings):
+        self.braas_hpc_renderengine_context.frame_cache.set_budget(server_settings.frame_cache_size * 1024 * 1024)
+        self.prefetch_radius = server_settings.prefetch_timesteps
+
+    def update_adaptive_resolution(self, server_settings):
+        self.use_adaptive_resolution = server_settings.use_adaptive_resolution
+        self.resolution_controller.frame_time_budget = server_settings.frame_time_budget * 0.001
+        self.resolution_controller.min_scale = server_settings.min_resolution_scale
+
+        # the render thread switches back to the preferred format when it is turned off
+        self.use_auto_format = server_settings.use_auto_format
+        self.format_controller.frame_time_budget = server_settings.frame_time_budget * 0.001
+
+    def notify_band(self):
+        """ Called from the render thread for every received band, draw() shows the partial frame """
+        self.is_rendered = True
+        self.braas_hpc_renderengine_engine.tag_redraw()
+
+    def notify_frame_status(self):
+        """ Shows the frame status with the status of the control connection, only when it changed """
+        if self.frame_info is None:
+            return
+
+        status = self.frame_info
+        server_info = self.braas_hpc_renderengine_context.get_server_info()
+        if server_info:
+            status += f" | {server_info}"
+
+        if status != self.frame_status:
+            self.frame_status = status
+            self.notify_status(status, "Render")
+
+    def update_stream_format(self, now):
+        """ Called from the render thread after a frame of the whole view, see StreamFormatController """
+        if not self.format_controller.formats:
+            return
+
+        if self.use_auto_format and self.is_navigating(now):
+            link_stats = self.braas_hpc_renderengine_context.get_link_stats()
+            if link_stats is not None:
+                self.format_controller.update(now, *link_stats)
+        else:
+            self.format_controller.reset()
+
+        with self.render_lock:
+            self.braas_hpc_renderengine_context.set_stream_format(self.format_controller.format)
+
+    def update_foveated(self, server_settings):
+        self.use_foveated = server_settings.use_foveated
+        self.foveated_center = server_settings.foveated_center
+        self.foveated_size = server_settings.foveated_size
+        self.foveated_periphery_scale = server_settings.foveated_periphery_scale
+
+    def update_camera_prediction(self, server_settings):
+        self.use_camera_prediction = server_settings.use_camera_prediction
+        if not self.use_camera_prediction:
+            self.camera_predictor.reset()
+
+    def is_navigating(self, now):
+        return now - self.camera_change_time < CAMERA_STILL_TIME
+
+    def is_full_resolution(self):
+        if self.viewport_settings is None:
+            return True
+
+        return self.braas_hpc_renderengine_context.width == self.viewport_settings.width \
+            and self.braas_hpc_renderengine_context.height == self.viewport_settings.height
+
+    def get_render_resolution(self, viewport_settings, now):
+        """ Full region size, or reduced by the resolution controller or for foveated rendering while the camera moves """
+        scale = 1.0
+        if self.is_navigating(now):
+            if self.use_adaptive_resolution:
+                scale = self.resolution_controller.scale
+
+            if self.use_foveated and self.braas_hpc_renderengine_context.transport.supports_regions:
+                scale = min(scale, self.foveated_periphery_scale)
+
+        return max(1, int(viewport_settings.width * scale)), max(1, int(viewport_settings.height * scale))
+
+    def get_render_region(self, viewport_settings, resolution):
+        """ Render border within the render resolution, None for the whole frame """
+        if not viewport_settings.has_border() or not self.braas_hpc_renderengine_context.transport.supports_regions:
+            return None
+
+        x, y, width, height = viewport_settings.get_border_rect()
+        scale_x = resolution[0] / viewport_settings.width
+        scale_y = resolution[1] / viewport_settings.height
+
+        x1, y1 = int(x * scale_x), int(y * scale_y)
+        x2 = max(x1 + 1, min(resolution[0], math.ceil((x + width) * scale_x)))
+        y2 = max(y1 + 1, min(resolution[1], math.ceil((y + height) * scale_y)))
+
+        return x1, y1, x2 - x1, y2 - y1
+
+    def get_roi_center(self, context):
+        """ Center of the region of interest in region pixels """
+        if self.foveated_center == 'MOUSE':
+            position = MOUSE_TRACKER.get_region_position(context.region)
+            if position is not None:
+                return position
+
+        elif self.foveated_center == 'CURSOR':
+            position = view3d_utils.location_3d_to_region_2d(context.region, context.region_data, context.scene.cursor.location)
+            if position is not None:
+                return position.x, position.y
+
+        return context.region.width * 0.5, context.region.height * 0.5
+
+    def get_roi(self, context, viewport_settings, resolution):
+        """
+        Returns (rect, resolution) of the region of interest rendered at the full resolution
+        while the periphery has a reduced one, or None
+        """
+        if not self.use_foveated:
+            return None
+
+        full_resolution = (viewport_settings.width, viewport_settings.height)
+        if resolution == full_resolution or not self.braas_hpc_renderengine_context.transport.supports_regions:
+            return None
+
+        center_x, center_y = self.get_roi_center(context)
+        size = max(16, int(self.foveated_size * min(full_resolution)))
+
+        # within the render border
+        x, y, width, height = viewport_settings.get_border_rect()
+        x1 = max(x, int(center_x - size * 0.5))
+        y1 = max(y, int(center_y - size * 0.5))
+        x2 = min(x + width, int(center_x + size * 0.5))
+        y2 = min(y + height, int(center_y + size * 0.5))
+
+        if x2 <= x1 or y2 <= y1:
+            return None
+
+        return (x1, y1, x2 - x1, y2 - y1), full_resolution
+
+    def bind_texture(self, shader, texture=None):
+        time_begin = time.perf_counter()
+        if texture is None:
+            texture = self.braas_hpc_renderengine_context.get_texture()
+
+        if texture is None:
+            # the native module binds its OpenGL texture to unit 0
+            self.braas_hpc_renderengine_context.draw_texture()
+            self.braas_hpc_renderengine_context.profiler.add(STAGE_TEXTURE_UPLOAD, time_begin)
+            shader.uniform_int("image", 0)
+        else:
+            self.braas_hpc_renderengine_context.profiler.add(STAGE_TEXTURE_UPLOAD, time_begin)
+            shader.uniform_sampler("image", texture)
+
+    def free_draw_resources(self):
+        """ Drops the cached shaders and batches, they are built again by the next draw """
+        self.image_shader = None
+        self.image_batch = None
+        self.raw_shader = None
+        self.raw_batch = None
+        self.depth_shader = None
+        self.depth_batch = None
+        self.braas_hpc_renderengine_context.texture = None
+        self.braas_hpc_renderengine_context.roi_texture = None
+        self.braas_hpc_renderengine_context.texture_staging.free()
+        self.braas_hpc_renderengine_context.roi_texture_staging.free()
+        self.braas_hpc_renderengine_context.depth_texture = None
+        self.braas_hpc_renderengine_context.depth_texture_source = None
+
+    def get_image_shader(self):
+        if self.image_shader is None:
+            self.image_shader = gpu.shader.from_builtin('IMAGE')
+            self.image_batch = batch_for_shader(
+                self.image_shader, 'TRI_FAN',
+                {"pos": QUAD_COORDS, "texCoord": QUAD_COORDS},
+            )
+
+        return self.image_shader, self.image_batch
+
+    def get_raw_shader(self):
+        if self.raw_shader is None:
+            self.raw_shader = gpu.types.GPUShader(RAW_VERTEX_SHADER, RAW_FRAGMENT_SHADER)
+            self.raw_batch = batch_for_shader(
+                self.raw_shader, 'TRI_FAN',
+                {"pos": QUAD_COORDS, "texCoord": QUAD_COORDS},
+            )
+
+        return self.raw_shader, self.raw_batch
+
+    def get_depth_shader(self):
+        if self.depth_shader is None:
+            self.depth_shader = gpu.types.GPUShader(RAW_VERTEX_SHADER, DEPTH_FRAGMENT_SHADER)
+            self.depth_batch = batch_for_shader(
+                self.depth_shader, 'TRI_FAN',
+                {"pos": QUAD_COORDS, "texCoord": QUAD_COORDS},
+            )
+
+        return self.depth_shader, self.depth_batch
+
+    def draw_depth_2d(self, context, texture, position, width, height, reprojection=None):
+        """ Writes the depth pass to the depth buffer so that the overlays drawn after are hidden behind the volume """
+        shader, batch = self.get_depth_shader()
+        window_matrix = context.region_data.window_matrix
+
+        gpu.state.color_mask_set(False, False, False, False)
+        gpu.state.depth_test_set('ALWAYS')
+        gpu.state.depth_mask_set(True)
 
         with gpu.matrix.push_pop():
+            if reprojection is not None:
+                gpu.matrix.multiply_matrix(reprojection)
+
             gpu.matrix.translate(position)
             gpu.matrix.scale((width, height))
 
             shader.bind()
-            self.braas_hpc_renderengine_context.draw_texture()
-            shader.uniform_int("image", 0)
-            batch.draw(shader) 
-        
-    def draw_texture_2d(self, texture, position, width, height):
-        import gpu
-        from gpu_extras.batch import batch_for_shader
+            shader.uniform_sampler("depth", texture)
+            shader.uniform_float("depth_projection", (window_matrix[2][2], window_matrix[2][3]))
+            shader.uniform_int("is_perspective", 1 if context.region_data.is_perspective else 0)
+            shader.uniform_float("background", braas_hpc_renderengine_transport.PASS_DEPTH_BACKGROUND)
+            batch.draw(shader)
 
-        coords = ((0, 0), (1, 0), (1, 1), (0, 1))
+        gpu.state.depth_mask_set(False)
+        gpu.state.depth_test_set('NONE')
+        gpu.state.color_mask_set(True, True, True, True)
 
-        shader = gpu.shader.from_builtin('IMAGE')
-        batch = batch_for_shader(
-            shader, 'TRI_FAN',
-            {"pos": coords, "texCoord": coords},
-        )
+    def draw_texture_2d_raw(self, texture, position, width, height):
+        shader, batch = self.get_raw_shader()
 
         with gpu.matrix.push_pop():
             gpu.matrix.translate(position)
             gpu.matrix.scale((width, height))
 
-            shader = gpu.shader.from_builtin('IMAGE')
+            shader.bind()
+            self.bind_texture(shader)
+            batch.draw(shader) 
+        
+    def draw_texture_2d(self, texture, position, width, height, reprojection=None):
+        shader, batch = self.get_image_shader()
+
+        with gpu.matrix.push_pop():
+            if reprojection is not None:
+                gpu.matrix.multiply_matrix(reprojection)
+
+            gpu.matrix.translate(position)
+            gpu.matrix.scale((width, height))
 
             # if isinstance(texture, int):
             #     # Call the legacy bgl to not break the existing API
@@ -932,12 +2912,23 @@ class ViewportEngine(Engine):
             # else:
             #     shader.uniform_sampler("image", texture)            
 
-            self.braas_hpc_renderengine_context.draw_texture()
-            shader.uniform_int("image", 0)
+            self.bind_texture(shader, texture if isinstance(texture, gpu.types.GPUTexture) else None)
 
             batch.draw(shader)        
 
     def draw(self, context):
+        time_begin = time.perf_counter()
+
+        self._draw(context)
+
+        time_end = time.perf_counter()
+        self.braas_hpc_renderengine_context.profiler.add(STAGE_DRAW, time_begin, time_end)
+
+        draw_time = time_end - time_begin
+        self.draw_time = draw_time if self.draw_count == 0 else 0.9 * self.draw_time + 0.1 * draw_time
+        self.draw_count += 1
+
+    def _draw(self, context):
         # log("Draw")
 
         if not self.is_synced or self.is_finished:
@@ -945,42 +2936,92 @@ class ViewportEngine(Engine):
 
         scene = context.scene
 
+        if self.braas_hpc_renderengine_context.native_resize_pending is not None:
+            # the native module reallocates its texture, which needs the OpenGL context of the draw
+            with self.render_lock:
+                if self.braas_hpc_renderengine_context.apply_native_resize():
+                    self.restart_render_event.set()
+
         #with self.render_lock:
-        viewport_settings = ViewportSettings(context)
+        view_state = ViewState(context)
 
-        if viewport_settings.width * viewport_settings.height == 0:
-            return
+        if self.viewport_settings is not None and view_state == self.view_state:
+            viewport_settings = self.viewport_settings
+        else:
+            viewport_settings = ViewportSettings(context)
 
-        # or viewport_settings.camera_dataR is None:
-        if viewport_settings.camera_data is None:
-            return
+            if viewport_settings.width * viewport_settings.height == 0:
+                return
+
+            # or viewport_settings.camera_dataR is None:
+            if viewport_settings.camera_data is None:
+                return
+
+            self.view_state = view_state
 
         self.braas_hpc_renderengine_context.set_frame(context.scene.frame_current)
+
+        if self.frame_current != context.scene.frame_current:
+            self.frame_current = context.scene.frame_current
+            self.restart_render_event.set()
         
-        if self.viewport_settings != viewport_settings:
+        now = time.perf_counter()
+        is_region_resized = False
+
+        if viewport_settings is not self.viewport_settings and self.viewport_settings != viewport_settings:
             # viewport_settings.export_camera(self.braas_hpc_renderengine_context.scene.camera)
             # , viewport_settings.camera_dataR)            
-            self.braas_hpc_renderengine_context.set_camera(viewport_settings.camera_data)
+            camera_data, projection = viewport_settings.camera_data, viewport_settings.projection
+
+            if self.use_camera_prediction and (self.viewport_settings is None or self.viewport_settings.camera_data != camera_data):
+                # the frame requested now is shown one round trip later
+                self.camera_predictor.add(now, Matrix(camera_data.transform), context.region_data.view_location)
+                camera_data, projection = self.camera_predictor.predict(
+                    now, self.braas_hpc_renderengine_context.round_trip_time, camera_data, projection)
+
+            self.braas_hpc_renderengine_context.set_camera(camera_data, projection)
+
+            if self.viewport_settings is not None:
+                if self.viewport_settings.camera_data != viewport_settings.camera_data:
+                    self.camera_change_time = now
+                    VIEWPORT_SCHEDULER.focus(self)
+
+                if self.viewport_settings.width != viewport_settings.width \
+                        or self.viewport_settings.height != viewport_settings.height:
+                    # an editor border is dragged, the old frame is scaled to the region meanwhile
+                    is_region_resized = True
+
             self.viewport_settings = viewport_settings
 
-            if self.braas_hpc_renderengine_context.width != viewport_settings.width \
-                    or self.braas_hpc_renderengine_context.height != viewport_settings.height:
+            self.restart_render_event.set()
 
-                resolution = (viewport_settings.width,
-                                viewport_settings.height)
-                
-                #self.stop_render()
-                with self.render_lock:
-                    self.braas_hpc_renderengine_context.resize(*resolution)
-                #self.is_rendered = False
+        elif self.camera_predictor.is_predicted and self.camera_predictor.is_stopped(now):
+            # the view stopped, the server renders the real one
+            self.camera_predictor.reset()
+            self.braas_hpc_renderengine_context.set_camera(viewport_settings.camera_data, viewport_settings.projection)
+            self.restart_render_event.set()
+
+        resolution = self.get_render_resolution(viewport_settings, now)
+        region = self.get_render_region(viewport_settings, resolution)
 
-                #self.restart_render_event.set()
-                #return
+        if self.resize_target != (resolution, region):
+            # the render thread resizes between its round trips, the UI thread never waits for the network.
+            # Sizes of a dragged region are coalesced until it stops changing
+            self.braas_hpc_renderengine_context.request_resize(*resolution, region, RESIZE_DEBOUNCE_TIME if is_region_resized else 0.0)
+            self.resize_target = (resolution, region)
 
-                # if self.gl_texture:
-                #     self.gl_texture = GLTexture(*resolution)
+            #self.stop_render()
+            #self.is_rendered = False
 
-                self.is_resized = True
+            #self.restart_render_event.set()
+            #return
+
+            # if self.gl_texture:
+            #     self.gl_texture = GLTexture(*resolution)
+
+            # a reduced resolution frame is stretched over the region
+            self.time_frame = None
+            self.restart_render_event.set()
 
             # if braas_hpc_renderengine_dll.get_renderengine_type() != 2:
             #else:
@@ -991,30 +3032,56 @@ class ViewportEngine(Engine):
         # if not self.is_rendered:
         #     return
 
-        self.restart_render_event.set()
-        
         #self.render_event.wait()
 
-        if self.is_resized or not self.is_rendered:
+        # replaced as a whole, the render thread reads it once per request
+        self.braas_hpc_renderengine_context.roi = self.get_roi(context, viewport_settings, resolution)
+
+        if not self.is_rendered:
             return              
 
         #context.scene.braas_hpc_renderengine_data.is_rendered = True       
 
         texture_id = self.braas_hpc_renderengine_context.get_texture_id()
-        
+
+        # the frame covers the render border only if the server rendered just the border
+        if self.braas_hpc_renderengine_context.region is not None:
+            x, y, width, height = self.viewport_settings.get_border_rect()
+        else:
+            x, y, width, height = 0, 0, self.viewport_settings.width, self.viewport_settings.height
+
+        # region of interest at full resolution over the periphery
+        roi_texture = self.braas_hpc_renderengine_context.get_roi_texture()
+
+        # frames of an older camera are warped to the current one
+        region_size = (viewport_settings.width, viewport_settings.height)
+        reprojection = None
+        if self.use_reprojection:
+            reprojection = get_reprojection(self.braas_hpc_renderengine_context.display_projection, viewport_settings.projection,
+                                            (x, y, width, height), region_size)
+
         # present
         if True:
             gpu.state.blend_set('ALPHA_PREMULT')
             self.braas_hpc_renderengine_engine.bind_display_space_shader(scene)
-            self.draw_texture_2d(texture_id, self.viewport_settings.border[0], self.viewport_settings.border[1][0], self.viewport_settings.border[1][1])        
+            self.draw_texture_2d(texture_id, (x, y), width, height, reprojection)
+            if roi_texture is not None:
+                texture, roi_rect, roi_projection = roi_texture
+                roi_reprojection = None
+                if self.use_reprojection:
+                    roi_reprojection = get_reprojection(roi_projection, viewport_settings.projection, roi_rect, region_size)
+                self.draw_texture_2d(texture, roi_rect[0:2], roi_rect[2], roi_rect[3], roi_reprojection)
             self.braas_hpc_renderengine_engine.unbind_display_space_shader()
             gpu.state.blend_set('NONE')
+
+            depth_texture = self.braas_hpc_renderengine_context.get_depth_texture() if self.use_depth_composite else None
+            if depth_texture is not None:
+                self.draw_depth_2d(context, depth_texture, (x, y), width, height, reprojection)
         else:
             # Draw the texture without color management
             gpu.state.blend_set('ALPHA_PREMULT')
             # Skip display space shader binding to avoid color management
-            self.draw_texture_2d_raw(texture_id, self.viewport_settings.border[0], 
-                                self.viewport_settings.border[1][0], self.viewport_settings.border[1][1])
+            self.draw_texture_2d_raw(texture_id, (x, y), width, height)
             gpu.state.blend_set('NONE')            
 
 
@@ -1025,6 +3092,236 @@ class ViewportEngine(Engine):
 #####################################################################################################################
 
 
+class FinalEngine(Engine):
+    """
+    Final render engine (F12 and animation). Renders progressively to final_samples and copies the frames
+    to the render result. During animation the connection stays open and the next frame is requested
+    while Blender writes the previous one.
+    """
+
+    def __init__(self, braas_hpc_renderengine_engine):
+        # the viewport context stays in braas_hpc_renderengine_data, the final render has its own connection
+        self.braas_hpc_renderengine_engine = weakref.proxy(braas_hpc_renderengine_engine)
+        self.braas_hpc_renderengine_context = BRaaSHPCContext()
+
+        # (width, height, camera_data, frame) of the requests in flight sent ahead by prefetch_next_frame
+        self.prefetch_key = None
+
+    @staticmethod
+    def get_resolution(scene):
+        scale = scene.render.resolution_percentage / 100.0
+        return max(1, int(scene.render.resolution_x * scale)), max(1, int(scene.render.resolution_y * scale))
+
+    @staticmethod
+    def get_camera_data(camera_obj, width, height):
+        ratio = max(width, height) / min(width, height)
+
+        data = CameraData.init_from_camera(camera_obj.data, camera_obj.matrix_world, ratio)
+        data.view_camera_zoom = FULL_FRAME_VIEW_CAMERA_ZOOM
+        data.view_camera_offset = (0.0, 0.0)
+        return data
+
+    @staticmethod
+    def get_passes(server_settings, view_layer):
+        """ Auxiliary passes for the render passes enabled in the view layer, see BRaaSHPCRenderEngine.update_render_passes """
+        passes = []
+        if view_layer.use_pass_z:
+            passes.append(braas_hpc_renderengine_transport.PASS_DEPTH)
+        if view_layer.use_pass_normal:
+            passes.append(braas_hpc_renderengine_transport.PASS_NORMAL)
+        if server_settings.use_pass_samples:
+            passes.append(braas_hpc_renderengine_transport.PASS_SAMPLES)
+
+        return passes
+
+    @staticmethod
+    def is_camera_animated(camera_obj):
+        """ True when the camera may differ in the next frame """
+        return camera_obj.animation_data is not None \
+            or camera_obj.data.animation_data is not None \
+            or camera_obj.parent is not None \
+            or len(camera_obj.constraints) > 0
+
+    def start(self, scene, width, height, passes=None):
+        server_settings = scene.braas_hpc_renderengine.server_settings
+
+        self.braas_hpc_renderengine_context.init(scene, server_settings.braas_hpc_renderengine_server_name,
+                                                 server_settings.braas_hpc_renderengine_port,
+                                                 width, height,
+                                                 server_settings.step_samples,
+                                                 server_settings.pipeline_depth,
+                                                 server_settings.final_samples,
+                                                 server_settings.timesteps,
+                                                 get_endpoints(server_settings),
+                                                 passes)
+        self.braas_hpc_renderengine_context.client_init()
+        # write_result reads the last frame while the next one is received, nothing else keeps the frames.
+        # The native module copies its frame only when write_result asks for it
+        if not self.braas_hpc_renderengine_context.is_native():
+            self.braas_hpc_renderengine_context.transport.set_double_buffering(True)
+
+        if self.braas_hpc_renderengine_context.transport.com_error() == 1:
+            self.braas_hpc_renderengine_context.client_started = False
+            raise Exception("TCP error")
+
+        self.prefetch_key = None
+
+    def stop(self, abort=False):
+        """ Closes the connection, with abort the frames in flight are discarded instead of received """
+        if self.braas_hpc_renderengine_context.client_started:
+            # a viewport which takes over the parked connection keeps its frames
+            self.braas_hpc_renderengine_context.transport.set_double_buffering(False)
+            if abort and self.braas_hpc_renderengine_context.frames_in_flight:
+                self.braas_hpc_renderengine_context.client_abort_connection()
+            else:
+                self.braas_hpc_renderengine_context.client_close_connection()
+
+        self.prefetch_key = None
+
+    def request_frame(self, camera_data, frame, width, height):
+        """ Starts progressive rendering of the frame, the accumulated samples are reset """
+        braas_hpc_renderengine_context = self.braas_hpc_renderengine_context
+
+        braas_hpc_renderengine_context.drain()
+
+        if braas_hpc_renderengine_context.width != width or braas_hpc_renderengine_context.height != height:
+            braas_hpc_renderengine_context.resize(width, height)
+
+        braas_hpc_renderengine_context.set_frame(frame)
+        braas_hpc_renderengine_context.set_camera(camera_data)
+        braas_hpc_renderengine_context.transport.reset()
+        braas_hpc_renderengine_context.fill_pipeline()
+
+    def prefetch_next_frame(self, scene, camera_obj, camera_data, width, height):
+        frame = scene.frame_current + scene.frame_step
+        if frame > scene.frame_end or self.is_camera_animated(camera_obj):
+            return
+
+        self.request_frame(camera_data, frame, width, height)
+        self.prefetch_key = (width, height, camera_data, frame)
+
+    def get_pass_image(self, render_pass, width, height):
+        """ Returns the float image of the render pass from the received auxiliary pass, None if it was not received """
+        name = RENDER_PASSES.get(render_pass.name)
+        if name is None:
+            return None
+
+        values = self.braas_hpc_renderengine_context.transport.get_pass(name)
+        if values is None or values.shape != (height, width, render_pass.channels):
+            return None
+
+        image = values.astype(np.float32)
+        if name == braas_hpc_renderengine_transport.PASS_DEPTH:
+            image[image >= braas_hpc_renderengine_transport.PASS_DEPTH_BACKGROUND] = RENDER_PASS_DEPTH_BACKGROUND
+        elif name == braas_hpc_renderengine_transport.PASS_NORMAL:
+            image /= 127.0
+
+        return image.ravel()
+
+    def write_result(self, result, width, height):
+        pixels = self.braas_hpc_renderengine_context.get_pixels()
+        if pixels is None or pixels.shape[0] != height or pixels.shape[1] != width:
+            return
+
+        images = []
+        for render_pass in result.layers[0].passes:
+            image = None
+            if render_pass.name == "Combined":
+                image = pixels_to_float(pixels).ravel()
+            else:
+                image = self.get_pass_image(render_pass, width, height)
+
+            if image is None:
+                image = np.zeros(width * height * render_pass.channels, dtype=np.float32)
+
+            images.append(image)
+
+        result.layers[0].passes.foreach_set("rect", np.concatenate(images))
+
+    def render(self, depsgraph):
+        braas_hpc_renderengine_engine = self.braas_hpc_renderengine_engine
+        braas_hpc_renderengine_context = self.braas_hpc_renderengine_context
+
+        scene = depsgraph.scene
+        server_settings = scene.braas_hpc_renderengine.server_settings
+
+        if scene.camera is None:
+            braas_hpc_renderengine_engine.report({'ERROR'}, "Scene has no camera")
+            return
+
+        # the result is read from the frames, the texture of the native module is of no use here
+        if not braas_hpc_renderengine_context.transport.can_copy_pixels:
+            braas_hpc_renderengine_engine.report({'ERROR'}, "The native module cannot copy frames for the final render, "
+                                                            "update braas_hpc_renderengine_dll or use the Python Socket transport")
+            return
+
+        # a new connection of the native module would replace the one of the viewport
+        if not braas_hpc_renderengine_context.client_started and braas_hpc_renderengine_context.get_native_user() is not None:
+            braas_hpc_renderengine_engine.report({'ERROR'}, NATIVE_CONNECTION_IN_USE)
+            return
+
+        width, height = self.get_resolution(scene)
+        camera_obj = scene.camera.evaluated_get(depsgraph)
+        camera_data = self.get_camera_data(camera_obj, width, height)
+
+        if not braas_hpc_renderengine_context.client_started:
+            self.start(scene, width, height, self.get_passes(server_settings, depsgraph.view_layer))
+
+        braas_hpc_renderengine_context.pipeline_depth = max(1, server_settings.pipeline_depth)
+        braas_hpc_renderengine_context.max_samples = server_settings.final_samples
+        braas_hpc_renderengine_context.use_script_diff = server_settings.use_script_diff
+        # no edits are notified to the final render, e.g. a frame change handler may have written the script
+        braas_hpc_renderengine_context.command_script.invalidate()
+        braas_hpc_renderengine_context.command_script.update(server_settings.command_script)
+
+        if self.prefetch_key != (width, height, camera_data, scene.frame_current):
+            # nothing was prefetched or the guess was wrong
+            self.request_frame(camera_data, scene.frame_current, width, height)
+        self.prefetch_key = None
+
+        result = braas_hpc_renderengine_engine.begin_result(0, 0, width, height)
+
+        time_begin = time.perf_counter()
+        time_update = time_begin
+        frames = 0
+        current_samples = 0
+
+        # every request renders at least one sample, frames bounds servers which do not report samples
+        while not braas_hpc_renderengine_context.is_converged(current_samples) and frames < server_settings.final_samples:
+            if braas_hpc_renderengine_engine.test_break():
+                break
+
+            braas_hpc_renderengine_context.fill_pipeline()
+            braas_hpc_renderengine_context.recv_frame()
+            frames += 1
+
+            current_samples = braas_hpc_renderengine_context.get_current_samples()
+            braas_hpc_renderengine_engine.update_progress(min(1.0, current_samples / server_settings.final_samples))
+            braas_hpc_renderengine_engine.update_stats("", f"Frame {scene.frame_current} | Samples: {current_samples}/{server_settings.final_samples}"
+                                                           f" | Time: {time.perf_counter() - time_begin:.1f} sec")
+
+            now = time.perf_counter()
+            if now - time_update > RESULT_UPDATE_INTERVAL:
+                time_update = now
+                self.write_result(result, width, height)
+                braas_hpc_renderengine_engine.update_result(result)
+
+        # requests sent ahead belong to this frame, the last one has the most samples
+        braas_hpc_renderengine_context.drain()
+
+        self.write_result(result, width, height)
+        braas_hpc_renderengine_engine.end_result(result)
+
+        # without persistent data Blender frees the engine after every frame, nothing survives to the next one
+        if braas_hpc_renderengine_engine.test_break() or not braas_hpc_renderengine_engine.is_animation \
+                or not scene.render.use_persistent_data:
+            self.stop()
+        elif server_settings.use_final_prefetch:
+            self.prefetch_next_frame(scene, camera_obj, camera_data, width, height)
+
+#####################################################################################################################
+
+
 class BRaaSHPCRenderEngine(bpy.types.RenderEngine):
     # These three members are used by blender to set up the
     # RenderEngine; define its internal name, visible name and capabilities.
@@ -1050,17 +3347,30 @@ class BRaaSHPCRenderEngine(bpy.types.RenderEngine):
         if isinstance(self.engine, ViewportEngine):
             self.engine.stop_render()
             self.engine = None
+        elif isinstance(self.engine, FinalEngine):
+            # e.g. a prefetched frame of a cancelled animation, receiving it would block
+            self.engine.stop(abort=True)
+            self.engine = None
         pass
 
     # final render
     def update(self, data, depsgraph):
         """ Called for final render """
-        pass
+        if self.engine is None:
+            self.engine = FinalEngine(self)
 
     # This is the method called by Blender for both final renders (F12) and
     # small preview for materials, world and lights.
     def render(self, depsgraph):
-        pass
+        if not isinstance(self.engine, FinalEngine):
+            return
+
+        try:
+            self.engine.render(depsgraph)
+        except Exception as e:
+            print(e)
+            self.engine.stop()
+            self.report({'ERROR'}, str(e))
 
     # For viewport renders, this method gets called once at the start and
     # whenever the scene or 3D viewport changes. This method is where data
@@ -1068,6 +3378,7 @@ class BRaaSHPCRenderEngine(bpy.types.RenderEngine):
     # thread will be started to do the work while keeping Blender responsive.
     def view_update(self, context, depsgraph):
         if self.engine:
+            self.engine.sync_update(context, depsgraph)
             return
 
         self.engine = ViewportEngine(self)
@@ -1082,7 +3393,139 @@ class BRaaSHPCRenderEngine(bpy.types.RenderEngine):
         self.engine.draw(context)
 
     def update_render_passes(self, render_scene=None, render_layer=None):
-        pass
+        """ Render passes filled from the auxiliary passes of the server, see FinalEngine.get_passes """
+        if render_scene is None or render_layer is None:
+            return
+
+        self.register_pass(render_scene, render_layer, "Combined", 4, "RGBA", 'COLOR')
+
+        if render_layer.use_pass_z:
+            self.register_pass(render_scene, render_layer, "Depth", 1, "Z", 'VALUE')
+        if render_layer.use_pass_normal:
+            self.register_pass(render_scene, render_layer, "Normal", 3, "XYZ", 'VECTOR')
+        if render_scene.braas_hpc_renderengine.server_settings.use_pass_samples:
+            self.register_pass(render_scene, render_layer, "Samples", 1, "X", 'VALUE')
+
+
+class BRaaSHPCExportProfileOperator(bpy.types.Operator, ExportHelper):
+    """ Export the recorded stage timings """
+    bl_idname = "braas_hpc_renderengine.export_profile"
+    bl_label = "Export Profile"
+
+    filename_ext = ".json"
+
+    filter_glob: bpy.props.StringProperty(
+        default="*.json",
+        options={'HIDDEN'}
+    ) # type: ignore
+
+    export_format: bpy.props.EnumProperty(
+        name="Format",
+        items=[
+            ('TRACE', "Chrome Trace", "Events for chrome://tracing or ui.perfetto.dev"),
+            ('SUMMARY', "Summary", "Percentiles and histograms per stage"),
+        ],
+        default='TRACE'
+    ) # type: ignore
+
+    @classmethod
+    def poll(cls, context):
+        return context.scene.braas_hpc_renderengine_data.braas_hpc_renderengine_context is not None
+
+    def execute(self, context):
+        profiler = context.scene.braas_hpc_renderengine_data.braas_hpc_renderengine_context.profiler
+
+        if self.export_format == 'TRACE':
+            profiler.export_chrome_trace(self.filepath)
+        else:
+            profiler.export_json(self.filepath)
+
+        return {'FINISHED'}
+
+class BRaaSHPCResetProfileOperator(bpy.types.Operator):
+    """ Clear the recorded stage timings """
+    bl_idname = "braas_hpc_renderengine.reset_profile"
+    bl_label = "Reset Profile"
+
+    @classmethod
+    def poll(cls, context):
+        return context.scene.braas_hpc_renderengine_data.braas_hpc_renderengine_context is not None
+
+    def execute(self, context):
+        context.scene.braas_hpc_renderengine_data.braas_hpc_renderengine_context.profiler.clear()
+        return {'FINISHED'}
+
+
+class BRaaSHPCUpdateCommandScriptOperator(bpy.types.Operator):
+    """ Send the command script again if it changed, for scripts that edit it with Text.from_string or Text.write """
+    bl_idname = "braas_hpc_renderengine.update_command_script"
+    bl_label = "Update Command Script"
+
+    @classmethod
+    def poll(cls, context):
+        return len(VIEWPORT_SCHEDULER.engines) > 0
+
+    def execute(self, context):
+        for engine in VIEWPORT_SCHEDULER.engines:
+            engine.notify_command_script()
+
+        return {'FINISHED'}
+
+
+class BRaaSHPCTrackMouseOperator(bpy.types.Operator):
+    """ Center the foveated region on the mouse, click again to stop """
+    bl_idname = "braas_hpc_renderengine.track_mouse"
+    bl_label = "Track Mouse"
+
+    def invoke(self, context, event):
+        if MOUSE_TRACKER.running:
+            MOUSE_TRACKER.running = False
+            return {'FINISHED'}
+
+        MOUSE_TRACKER.running = True
+        context.window_manager.modal_handler_add(self)
+        return {'RUNNING_MODAL'}
+
+    def modal(self, context, event):
+        if not MOUSE_TRACKER.running:
+            MOUSE_TRACKER.position = None
+            return {'FINISHED'}
+
+        if event.type == 'MOUSEMOVE':
+            MOUSE_TRACKER.position = (event.mouse_x, event.mouse_y)
+
+        return {'PASS_THROUGH'}
+
+class BRaaSHPCAddServerOperator(bpy.types.Operator):
+    bl_idname = "braas_hpc_renderengine.add_server"
+    bl_label = "Add Server"
+
+    def execute(self, context):
+        server_settings = context.scene.braas_hpc_renderengine.server_settings
+        endpoint = server_settings.servers.add()
+        endpoint.port = server_settings.braas_hpc_renderengine_port + len(server_settings.servers)
+        server_settings.servers_index = len(server_settings.servers) - 1
+        return {'FINISHED'}
+
+class BRaaSHPCRemoveServerOperator(bpy.types.Operator):
+    bl_idname = "braas_hpc_renderengine.remove_server"
+    bl_label = "Remove Server"
+
+    @classmethod
+    def poll(cls, context):
+        return len(context.scene.braas_hpc_renderengine.server_settings.servers) > 0
+
+    def execute(self, context):
+        server_settings = context.scene.braas_hpc_renderengine.server_settings
+        server_settings.servers.remove(server_settings.servers_index)
+        server_settings.servers_index = min(server_settings.servers_index, len(server_settings.servers) - 1)
+        return {'FINISHED'}
+
+class RENDER_UL_braas_hpc_renderengine_servers(bpy.types.UIList):
+    def draw_item(self, context, layout, data, item, icon, active_data, active_propname, index):
+        row = layout.row(align=True)
+        row.prop(item, "server_name", text="", emboss=False)
+        row.prop(item, "port", text="", emboss=False)
 
 
 class RenderButtonsPanel:
@@ -1120,6 +3563,21 @@ class RENDER_PT_braas_hpc_renderengine_server(RenderButtonsPanel, bpy.types.Pane
         col.prop(server_settings, "braas_hpc_renderengine_port", text="Port")
         #col.prop(server_settings, "braas_hpc_renderengine_port_data", text="Port Data")                              
 
+        col.prop(server_settings, "use_multi_server", text="Multiple Servers")
+        if server_settings.use_multi_server:
+            row = box.row()
+            row.template_list("RENDER_UL_braas_hpc_renderengine_servers", "", server_settings, "servers", server_settings, "servers_index", rows=3)
+            col = row.column(align=True)
+            col.operator("braas_hpc_renderengine.add_server", icon='ADD', text="")
+            col.operator("braas_hpc_renderengine.remove_server", icon='REMOVE', text="")
+
+            braas_hpc_renderengine_context = context.scene.braas_hpc_renderengine_data.braas_hpc_renderengine_context
+            if braas_hpc_renderengine_context is not None and braas_hpc_renderengine_context.client_started \
+                    and isinstance(braas_hpc_renderengine_context.transport, braas_hpc_renderengine_transport.MultiTransport):
+                col = box.column(align=True)
+                for server, port, y, rows in braas_hpc_renderengine_context.transport.get_strips():
+                    col.label(text="%s:%d  rows %d-%d" % (server, port, y, y + rows - 1))
+
         box = layout.box()
         col = box.column()
         col.enabled = False
@@ -1127,10 +3585,57 @@ class RENDER_PT_braas_hpc_renderengine_server(RenderButtonsPanel, bpy.types.Pane
         col.prop(server_settings, "height", text="Height")
         #col.prop(server_settings, "step_samples", text="Step samples")
 
+        box = layout.box()
+        col = box.column()
+        col.prop(server_settings, "pipeline_depth", text="Pipeline Depth")
+        col.prop(server_settings, "band_rows", text="Progressive Bands")
+        col.prop(server_settings, "use_reprojection", text="Reproject Last Frame")
+        col.prop(server_settings, "use_camera_prediction", text="Predict Camera Motion")
+        col.prop(server_settings, "use_depth_composite", text="Depth Composite")
+        col.prop(server_settings, "max_samples", text="Max Samples")
+
+        box = layout.box()
+        col = box.column()
+        col.prop(server_settings, "frame_cache_size", text="Frame Cache (MB)")
+        sub = col.column()
+        sub.enabled = server_settings.frame_cache_size > 0
+        sub.prop(server_settings, "prefetch_timesteps", text="Prefetch Timesteps")
+
+        box = layout.box()
+        col = box.column()
+        col.prop(server_settings, "use_adaptive_resolution", text="Adaptive Resolution")
+        sub = col.column()
+        sub.enabled = server_settings.use_adaptive_resolution or server_settings.use_auto_format
+        sub.prop(server_settings, "frame_time_budget", text="Frame Time Budget (ms)")
+        sub.prop(server_settings, "min_resolution_scale", text="Min Scale")
+        col.prop(server_settings, "use_auto_format", text="Auto Stream Format")
+
+        box = layout.box()
+        col = box.column()
+        col.prop(server_settings, "use_foveated", text="Foveated Rendering")
+        sub = col.column()
+        sub.enabled = server_settings.use_foveated
+        sub.prop(server_settings, "foveated_center", text="Center")
+        sub.prop(server_settings, "foveated_size", text="Size")
+        sub.prop(server_settings, "foveated_periphery_scale", text="Periphery Scale")
+        if server_settings.foveated_center == 'MOUSE':
+            sub.operator("braas_hpc_renderengine.track_mouse", text="Stop Tracking" if MOUSE_TRACKER.running else "Track Mouse",
+                         depress=MOUSE_TRACKER.running)
+
         box = layout.box()
         col = box.column()
         #col.prop(server_settings, "mat_volume", text="Material")  
-        col.prop(server_settings, "command_script", text="Command Script")
+        row = col.row(align=True)
+        row.prop(server_settings, "command_script", text="Command Script")
+        row.operator("braas_hpc_renderengine.update_command_script", text="", icon='FILE_REFRESH')
+        col.prop(server_settings, "use_script_diff", text="Send Script Diffs")
+
+        box = layout.box()
+        box.label(text='Final Render:')
+        col = box.column()
+        col.prop(server_settings, "final_samples", text="Samples")
+        col.prop(server_settings, "use_final_prefetch", text="Prefetch Next Frame")
+        col.prop(server_settings, "use_pass_samples", text="Samples Pass")
 
         if not context.scene.braas_hpc_renderengine_data.braas_hpc_renderengine_context is None and context.scene.braas_hpc_renderengine_data.braas_hpc_renderengine_context.client_started == True:
             box = layout.box()
@@ -1139,6 +3644,47 @@ class RENDER_PT_braas_hpc_renderengine_server(RenderButtonsPanel, bpy.types.Pane
             col.operator("braas_hpc_renderengine.create_bbox")
             #col.operator("braas_hpc_renderengine.stop_process")
         
+
+class RENDER_PT_braas_hpc_renderengine_profiler(RenderButtonsPanel, bpy.types.Panel):
+    bl_label = "Profiling"
+    bl_parent_id = "RENDER_PT_braas_hpc_renderengine_server"
+    bl_options = {'DEFAULT_CLOSED'}
+    COMPAT_ENGINES = {'BRAAS_HPC'}
+
+    def draw_header(self, context):
+        self.layout.prop(context.scene.braas_hpc_renderengine.server_settings, "use_profiling", text="")
+
+    def draw(self, context):
+        layout = self.layout
+
+        braas_hpc_renderengine_context = context.scene.braas_hpc_renderengine_data.braas_hpc_renderengine_context
+        if braas_hpc_renderengine_context is None:
+            layout.label(text="Start the viewport render to record timings")
+            return
+
+        summary = braas_hpc_renderengine_context.profiler.summary()
+
+        box = layout.box()
+        grid = box.grid_flow(row_major=True, columns=5, even_columns=False, align=True)
+        for text in ("Stage", "Count", "p50 ms", "p95 ms", "p99 ms"):
+            grid.label(text=text)
+
+        for name in braas_hpc_renderengine_profiler.STAGE_NAMES:
+            stats = summary.get(name)
+            grid.label(text=name.replace("braas_hpc_renderengine_", ""))
+            if stats is None:
+                for i in range(4):
+                    grid.label(text="-")
+            else:
+                grid.label(text="%d" % stats["count"])
+                grid.label(text="%.2f" % stats["p50"])
+                grid.label(text="%.2f" % stats["p95"])
+                grid.label(text="%.2f" % stats["p99"])
+
+        row = layout.row(align=True)
+        row.operator("braas_hpc_renderengine.export_profile")
+        row.operator("braas_hpc_renderengine.reset_profile")
+
 ###################################################################################
 
 # RenderEngines also need to tell UI Panels that they are compatible with.
@@ -1190,10 +3736,19 @@ def get_panels():
 def register():
     # Register the RenderEngine
     bpy.utils.register_class(BRaaSHPCRenderEngine)
+    bpy.utils.register_class(BRaaSHPCServerEndpoint)
     bpy.utils.register_class(BRaaSHPCServerSettings)
     bpy.utils.register_class(BRaaSHPCRenderSettings)
     bpy.utils.register_class(RENDER_PT_braas_hpc_renderengine_server)
+    bpy.utils.register_class(RENDER_PT_braas_hpc_renderengine_profiler)
     bpy.utils.register_class(BRaaSHPCShowPopupErrorMessage)
+    bpy.utils.register_class(BRaaSHPCExportProfileOperator)
+    bpy.utils.register_class(BRaaSHPCResetProfileOperator)
+    bpy.utils.register_class(BRaaSHPCUpdateCommandScriptOperator)
+    bpy.utils.register_class(BRaaSHPCTrackMouseOperator)
+    bpy.utils.register_class(BRaaSHPCAddServerOperator)
+    bpy.utils.register_class(BRaaSHPCRemoveServerOperator)
+    bpy.utils.register_class(RENDER_UL_braas_hpc_renderengine_servers)
 
     bpy.types.Scene.braas_hpc_renderengine = bpy.props.PointerProperty(
         name="Render Settings",
@@ -1208,11 +3763,30 @@ def register():
 
 
 def unregister():
+    # GPU resources must not outlive the addon
+    for engine in list(VIEWPORT_SCHEDULER.engines):
+        try:
+            engine.free_draw_resources()
+        except ReferenceError:
+            pass
+
+    braas_hpc_renderengine_session.SESSION_POOL.close_all()
+    MOUSE_TRACKER.running = False
+
     bpy.utils.unregister_class(BRaaSHPCRenderEngine)
     bpy.utils.unregister_class(BRaaSHPCServerSettings)
+    bpy.utils.unregister_class(BRaaSHPCServerEndpoint)
     bpy.utils.unregister_class(BRaaSHPCRenderSettings)
+    bpy.utils.unregister_class(RENDER_PT_braas_hpc_renderengine_profiler)
     bpy.utils.unregister_class(RENDER_PT_braas_hpc_renderengine_server)
     bpy.utils.unregister_class(BRaaSHPCShowPopupErrorMessage)
+    bpy.utils.unregister_class(BRaaSHPCExportProfileOperator)
+    bpy.utils.unregister_class(BRaaSHPCUpdateCommandScriptOperator)
+    bpy.utils.unregister_class(BRaaSHPCResetProfileOperator)
+    bpy.utils.unregister_class(BRaaSHPCTrackMouseOperator)
+    bpy.utils.unregister_class(BRaaSHPCAddServerOperator)
+    bpy.utils.unregister_class(BRaaSHPCRemoveServerOperator)
+    bpy.utils.unregister_class(RENDER_UL_braas_hpc_renderengine_servers)
 
     delattr(bpy.types.Scene, 'braas_hpc_renderengine')
     delattr(bpy.types.Scene, 'braas_hpc_renderengine_data')
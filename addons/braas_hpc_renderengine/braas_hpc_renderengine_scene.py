@@ -22,11 +22,6 @@ import numpy as np
 
 from . import braas_hpc_renderengine_pref
 
-try:
-    from . import braas_hpc_renderengine_dll
-except:
-    import braas_hpc_renderengine_dll
-
 class BRaaSHPCCreateBBoxOperator(bpy.types.Operator):
     bl_idname = "braas_hpc_renderengine.create_bbox"
     bl_label = "Load BBox"
@@ -54,7 +49,8 @@ class BRaaSHPCScene:
         #pref = braas_hpc_renderengine_pref.preferences()
                 
         braas_hpc_renderengineDataInit = BRaaSHPCDataInit()
-        braas_hpc_renderengine_dll.get_braas_hpc_renderengine_range(braas_hpc_renderengineDataInit.world_bounds_spatial_lower.ctypes.data, 
+        braas_hpc_renderengine_context = context.scene.braas_hpc_renderengine_data.braas_hpc_renderengine_context
+        braas_hpc_renderengine_context.get_range(braas_hpc_renderengineDataInit.world_bounds_spatial_lower.ctypes.data, 
                                                               braas_hpc_renderengineDataInit.world_bounds_spatial_upper.ctypes.data, 
                                                               braas_hpc_renderengineDataInit.scalars_range.ctypes.data)
 
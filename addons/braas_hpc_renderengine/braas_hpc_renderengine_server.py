@@ -0,0 +1,553 @@
+#####################################################################################################################
+# Copyright(C) 2011-2025 IT4Innovations National Supercomputing Center, VSB - Technical University of Ostrava
+#
+# This program is free software : you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+#####################################################################################################################
+
+#####################################################################################################################
+# Loopback stand-in for the render server, speaks the SocketTransport protocol and renders synthetic frames.
+# Network conditions can be simulated with a round trip time and a bandwidth limit.
+#
+# Usage (from the addons directory):
+#   python -m braas_hpc_renderengine.braas_hpc_renderengine_server --port 7000 --rtt 0.04 --bandwidth 125e6
+#####################################################################################################################
+
+import argparse
+import heapq
+import json
+import select
+import socket
+import socketserver
+import struct
+import threading
+import time
+import uuid
+
+import numpy as np
+
+try:
+    from . import braas_hpc_renderengine_transport as transport
+    from . import braas_hpc_renderengine_codec as codec
+except ImportError:
+    import braas_hpc_renderengine_transport as transport
+    import braas_hpc_renderengine_codec as codec
+
+#####################################################################################################################
+
+class FakeRenderSettings:
+    def __init__(self, render_time=0.0, rtt=0.0, bandwidth=0.0, step_samples=1):
+        # simulated server render time per frame in seconds
+        self.render_time = render_time
+        # simulated round trip time in seconds, added to every reply
+        self.rtt = rtt
+        # simulated link bandwidth in bytes per second, 0 = unlimited
+        self.bandwidth = bandwidth
+        self.step_samples = step_samples
+
+        # seconds between MSG_STATUS messages of a control connection
+        self.status_interval = 0.5
+
+        self.world_bounds_spatial_lower = (-1.0, -1.0, -1.0)
+        self.world_bounds_spatial_upper = (1.0, 1.0, 1.0)
+        self.scalars_range = (0.0, 1.0)
+
+#####################################################################################################################
+
+class FakeRenderer:
+    """ Generates synthetic progressive frames, the noise decreases with the number of samples """
+
+    def __init__(self, width, height, pixsize):
+        self.width = width
+        self.height = height
+        self.pixsize = pixsize
+        self.samples = 0
+        self.camera = None
+        self.noise = None
+        # (x, y, width, height) rendered by this server, None = the whole image
+        self.region = None
+        # noise of the resolution of the last region of interest, see render_roi
+        self.roi_noise = None
+
+    def resize(self, width, height):
+        self.width = width
+        self.height = height
+        self.noise = None
+        self.region = None
+        self.samples = 0
+
+    def set_region(self, x, y, width, height):
+        self.region = (x, y, width, height)
+        self.samples = 0
+
+    def reset(self):
+        self.samples = 0
+
+    def set_camera(self, camera):
+        if camera != self.camera:
+            self.camera = camera
+            self.samples = 0
+
+    def _get_camera(self):
+        """ Returns (position, timestep) """
+        if self.camera is None:
+            return (0.0, 0.0, 0.0), 0
+
+        values = transport.CAMERA_FORMAT.unpack(self.camera)
+        return (values[3], values[7], values[11]), values[-1]
+
+    def _get_region(self):
+        """ Returns (x, y, width, height) of the rendered region clamped to the image """
+        width, height = max(self.width, 1), max(self.height, 1)
+
+        x0, y0, region_width, region_height = self.region if self.region is not None else (0, 0, width, height)
+        x0 = min(max(x0, 0), width - 1)
+        y0 = min(max(y0, 0), height - 1)
+        region_width = min(max(region_width, 1), width - x0)
+        region_height = min(max(region_height, 1), height - y0)
+
+        return x0, y0, region_width, region_height
+
+    def render(self, step_samples):
+        self.samples += step_samples
+
+        width, height = max(self.width, 1), max(self.height, 1)
+
+        if self.noise is None:
+            rng = np.random.default_rng(0)
+            self.noise = rng.random((height, width, 1), dtype=np.float32) - 0.5
+
+        pos, timestep = self._get_camera()
+        x0, y0, region_width, region_height = self._get_region()
+
+        x = np.linspace(0.0, 1.0, width, dtype=np.float32)[None, x0:x0 + region_width]
+        y = np.linspace(0.0, 1.0, height, dtype=np.float32)[y0:y0 + region_height, None]
+
+        pixels = np.empty((region_height, region_width, transport.CHANNELS), dtype=np.float32)
+        pixels[:, :, 0] = 0.5 + 0.5 * np.sin(2.0 * np.pi * (x + 0.1 * pos[0]))
+        pixels[:, :, 1] = 0.5 + 0.5 * np.sin(2.0 * np.pi * (y + 0.1 * pos[1]))
+        pixels[:, :, 2] = 0.5 + 0.5 * np.cos(0.1 * pos[2] + 0.1 * timestep)
+        pixels[:, :, 3] = 1.0
+
+        # rows of the noise rolled by the number of samples
+        rows = (np.arange(y0, y0 + region_height) - self.samples) % height
+        pixels[:, :, 0:3] += self.noise[rows, x0:x0 + region_width] / np.sqrt(max(self.samples, 1))
+        np.clip(pixels, 0.0, 1.0, out=pixels)
+
+        if self.pixsize == 8:
+            return (pixels * 255.0 + 0.5).astype(np.uint8)
+
+        return pixels.astype(transport.pixels_dtype(self.pixsize))
+
+    def render_roi(self, width, height, region, step_samples):
+        """ Renders one frame of the region at the resolution, the progressive frame is kept """
+        state = (self.width, self.height, self.region, self.samples, self.noise)
+
+        self.width, self.height, self.region, self.samples = width, height, region, 0
+        self.noise = self.roi_noise if self.roi_noise is not None and self.roi_noise.shape[0:2] == (max(height, 1), max(width, 1)) else None
+        try:
+            return self.render(step_samples)
+        finally:
+            self.roi_noise = self.noise
+            self.width, self.height, self.region, self.samples, self.noise = state
+
+    def render_passes(self, names):
+        """ Returns {name: values} of the auxiliary passes of the region, a sphere in front of the camera """
+        width, height = max(self.width, 1), max(self.height, 1)
+        pos, timestep = self._get_camera()
+        x0, y0, region_width, region_height = self._get_region()
+
+        # unit sphere, the camera distance follows the camera z
+        distance = 3.0 + 0.1 * pos[2]
+        scale = 2.0 / min(width, height)
+        x = (np.arange(x0, x0 + region_width, dtype=np.float32)[None, :] - 0.5 * width) * scale
+        y = (np.arange(y0, y0 + region_height, dtype=np.float32)[:, None] - 0.5 * height) * scale
+        r2 = x * x + y * y
+        hit = r2 < 1.0
+        nz = np.sqrt(np.maximum(1.0 - r2, 0.0))
+
+        passes = {}
+        if transport.PASS_DEPTH in names:
+            depth = np.where(hit, distance - nz, transport.PASS_DEPTH_BACKGROUND)
+            passes[transport.PASS_DEPTH] = depth[:, :, None]
+
+        if transport.PASS_NORMAL in names:
+            normal = np.stack(np.broadcast_arrays(x, y, nz), axis=-1) * hit[:, :, None]
+            passes[transport.PASS_NORMAL] = np.round(normal * 127.0)
+
+        if transport.PASS_SAMPLES in names:
+            passes[transport.PASS_SAMPLES] = np.full((region_height, region_width, 1), min(self.samples, 65535))
+
+        return passes
+
+class FakeSession:
+    """ State of a frame connection which its control connection changes and reports """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.renderer = None
+        self.command_script = b""
+        # the script was changed by the control connection, the passes are sent again
+        self.script_changed = False
+        self.timesteps = set()
+        self.frames = 0
+
+    def set_command_script(self, command_script):
+        """ The caller holds the lock """
+        self.command_script = command_script
+        self.script_changed = True
+        if self.renderer is not None:
+            self.renderer.reset()
+
+    def get_status(self):
+        """ Returns the dict of MSG_STATUS """
+        with self.lock:
+            renderer = self.renderer
+            memory = len(self.command_script)
+            if renderer is not None and renderer.noise is not None:
+                memory += renderer.noise.nbytes
+
+            return {
+                "samples": renderer.samples if renderer is not None else 0,
+                "width": renderer.width if renderer is not None else 0,
+                "height": renderer.height if renderer is not None else 0,
+                "frames": self.frames,
+                "memory": memory,
+                "timesteps": sorted(self.timesteps),
+            }
+
+#####################################################################################################################
+
+class FakeRenderHandler(socketserver.BaseRequestHandler):
+    """ One client connection. Requests are rendered in order, replies are delayed by the simulated link """
+
+    def setup(self):
+        self.settings = self.server.settings
+        self.replies = []
+        self.replies_cond = threading.Condition()
+        self.closed = False
+        self.counter = 0
+
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+        self.writer = threading.Thread(target=self._write_replies, daemon=True)
+        self.writer.start()
+
+    def reply(self, tag, seq, payload=b""):
+        due = time.perf_counter() + self.settings.rtt
+        message = transport.MSG_HEADER.pack(tag, seq, len(payload)) + bytes(payload)
+
+        with self.replies_cond:
+            self.counter += 1
+            heapq.heappush(self.replies, (due, self.counter, message))
+            self.replies_cond.notify()
+
+    def _write_replies(self):
+        while True:
+            with self.replies_cond:
+                while not self.replies and not self.closed:
+                    self.replies_cond.wait()
+
+                if not self.replies:
+                    return
+
+                due, counter, message = self.replies[0]
+                delay = due - time.perf_counter()
+                if delay > 0:
+                    self.replies_cond.wait(delay)
+                    continue
+
+                heapq.heappop(self.replies)
+
+            try:
+                self.request.sendall(message)
+            except OSError:
+                return
+
+            if self.settings.bandwidth > 0:
+                time.sleep(len(message) / self.settings.bandwidth)
+
+    def handle(self):
+        renderer = None
+        encoder = None
+        session = FakeSession()
+        passes = []
+        # depth and normal are sent again only after the camera, the resolution or the scene changed
+        passes_dirty = True
+        # rows per MSG_BAND, 0 = whole frames
+        band_rows = 0
+
+        try:
+            while True:
+                tag, seq, payload = transport.recv_message(self.request)
+
+                if tag == transport.MSG_HELLO:
+                    hello = json.loads(payload.decode())
+                    renderer = FakeRenderer(hello["width"], hello["height"], hello["pixsize"])
+                    band_rows = max(0, int(hello.get("bands", 0)))
+
+                    # bands are never delta
+                    codec_name = codec.negotiate(hello.get("codecs", []), codec.available_codecs(renderer.pixsize), renderer.pixsize)
+                    encoder = codec.FrameEncoder(codec.create_codec(codec_name, hello.get("quality", 90)), hello.get("delta", False) and band_rows == 0)
+
+                    passes = [name for name in hello.get("passes", []) if name in transport.PASSES]
+
+                    with session.lock:
+                        session.renderer = renderer
+
+                    # the control connection finds the session by the token
+                    token = uuid.uuid4().hex
+                    with self.server.sessions_lock:
+                        self.server.sessions[token] = session
+
+                    info = {
+                        "server": "braas_hpc_renderengine_server",
+                        "codec": codec_name,
+                        "delta": encoder.use_delta,
+                        "script_diff": True,
+                        "regions": True,
+                        "passes": passes,
+                        "formats": True,
+                        "bands": band_rows,
+                        "control": token,
+                    }
+                    self.reply(transport.MSG_HELLO, seq, json.dumps(info).encode())
+
+                elif tag == transport.MSG_CAMERA:
+                    if bytes(payload) != renderer.camera:
+                        passes_dirty = True
+
+                    renderer.set_camera(bytes(payload))
+
+                elif tag == transport.MSG_DATA:
+                    time_begin = time.perf_counter()
+
+                    with session.lock:
+                        if len(payload) > 0:
+                            session.set_command_script(bytes(payload))
+
+                        if session.script_changed:
+                            session.script_changed = False
+                            passes_dirty = True
+
+                        session.frames += 1
+                        session.timesteps.add(renderer._get_camera()[1])
+                        pixels = renderer.render(self.settings.step_samples)
+                    if self.settings.render_time > 0:
+                        # the render time is for the whole image, a region takes its share
+                        render_time = self.settings.render_time * pixels.shape[0] * pixels.shape[1] / max(renderer.width * renderer.height, 1)
+                        time.sleep(max(0.0, render_time - (time.perf_counter() - time_begin)))
+
+                    remote_fps = 1.0 / max(time.perf_counter() - time_begin, 1e-6)
+                    height, width = pixels.shape[0:2]
+
+                    if passes:
+                        names = passes if passes_dirty else [name for name in passes if name == transport.PASS_SAMPLES]
+                        for name, values in renderer.render_passes(names).items():
+                            self.reply(transport.MSG_PASS, seq, transport.encode_pass(name, values))
+
+                        passes_dirty = False
+
+                    if band_rows > 0:
+                        header = transport.FRAME_FORMAT.pack(width, height, renderer.pixsize, renderer.samples, remote_fps, transport.FRAME_BANDS)
+                        self.reply(transport.MSG_PIXELS, seq, header)
+
+                        # from the top row down, each band is encoded on its own
+                        top = height
+                        while top > 0:
+                            y = max(0, top - band_rows)
+                            data = encoder.codec.encode(np.ascontiguousarray(pixels[y:top]))
+                            self.reply(transport.MSG_BAND, seq, transport.BAND_FORMAT.pack(y, top - y) + data)
+                            top = y
+                    else:
+                        flags, data = encoder.encode(pixels)
+                        header = transport.FRAME_FORMAT.pack(width, height, renderer.pixsize, renderer.samples, remote_fps, flags)
+                        self.reply(transport.MSG_PIXELS, seq, header + data)
+
+                elif tag == transport.MSG_ROI:
+                    resolution_width, resolution_height, *region = transport.ROI_FORMAT.unpack(payload)
+                    with session.lock:
+                        pixels = renderer.render_roi(resolution_width, resolution_height, tuple(region), self.settings.step_samples)
+
+                    # not banded and not a delta reference, the encoder keeps its previous frame
+                    height, width = pixels.shape[0:2]
+                    header = transport.FRAME_FORMAT.pack(width, height, renderer.pixsize, self.settings.step_samples, 0.0, transport.FRAME_DETACHED)
+                    self.reply(transport.MSG_PIXELS, seq, header + encoder.codec.encode(pixels))
+
+                elif tag == transport.MSG_SCRIPT_DIFF:
+                    prefix, suffix = transport.SCRIPT_DIFF_FORMAT.unpack_from(payload)
+                    with session.lock:
+                        if prefix + suffix > len(session.command_script):
+                            error = "Request %d does not match the script of the server" % seq
+                        else:
+                            error = None
+                            session.set_command_script(transport.apply_script_diff(session.command_script, prefix, suffix,
+                                                                                   bytes(payload[transport.SCRIPT_DIFF_FORMAT.size:])))
+
+                    # precedes the frame of the request, which is rendered with the unchanged script
+                    if error is not None:
+                        self.reply(transport.MSG_ERROR, seq, json.dumps({"message": error}).encode())
+
+                elif tag == transport.MSG_RESIZE:
+                    renderer.resize(*transport.RESIZE_FORMAT.unpack(payload))
+                    encoder.reset()
+                    passes_dirty = True
+
+                elif tag == transport.MSG_REGION:
+                    renderer.set_region(*transport.REGION_FORMAT.unpack(payload))
+                    encoder.reset()
+                    passes_dirty = True
+
+                elif tag == transport.MSG_FORMAT:
+                    # the samples are kept, only the encoding of the following frames changes
+                    request = json.loads(payload.decode())
+                    if request["pixsize"] not in transport.PIXSIZE_DTYPES:
+                        raise ValueError("Unsupported pixel size %s" % request["pixsize"])
+
+                    renderer.pixsize = request["pixsize"]
+
+                    codec_name = codec.negotiate(request.get("codecs", []), codec.available_codecs(renderer.pixsize), renderer.pixsize)
+                    encoder = codec.FrameEncoder(codec.create_codec(codec_name, request.get("quality", 90)), request.get("delta", False) and band_rows == 0)
+
+                    info = {"codec": codec_name, "delta": encoder.use_delta, "pixsize": renderer.pixsize}
+                    self.reply(transport.MSG_FORMAT, seq, json.dumps(info).encode())
+
+                elif tag == transport.MSG_RANGE:
+                    values = self.settings.world_bounds_spatial_lower + self.settings.world_bounds_spatial_upper + self.settings.scalars_range
+                    self.reply(transport.MSG_RANGE, seq, transport.RANGE_FORMAT.pack(*values))
+
+                elif tag == transport.MSG_RESET:
+                    renderer.reset()
+
+                elif tag == transport.MSG_CONTROL:
+                    # this is the control connection of another one
+                    self.handle_control(payload.decode())
+                    break
+
+                elif tag == transport.MSG_CLOSE:
+                    break
+
+        except (OSError, ValueError, AttributeError, struct.error):
+            # AttributeError: a request before MSG_HELLO
+            pass
+
+        finally:
+            with self.server.sessions_lock:
+                for token in [token for token, other in self.server.sessions.items() if other is session]:
+                    del self.server.sessions[token]
+
+    def handle_control(self, token):
+        """ Applies commands as they arrive and acknowledges them, pushes the status of the session periodically """
+        with self.server.sessions_lock:
+            session = self.server.sessions.get(token)
+
+        if session is None:
+            self.reply(transport.MSG_ERROR, 0, json.dumps({"message": "Unknown session"}).encode())
+            return
+
+        status_time = 0.0
+        while True:
+            now = time.perf_counter()
+            if now - status_time >= self.settings.status_interval:
+                status_time = now
+                self.reply(transport.MSG_STATUS, 0, json.dumps(session.get_status()).encode())
+
+            readable, writable, failed = select.select([self.request], [], [], max(0.0, status_time + self.settings.status_interval - now))
+            if not readable:
+                continue
+
+            tag, seq, payload = transport.recv_message(self.request)
+
+            if tag == transport.MSG_COMMAND:
+                with session.lock:
+                    session.set_command_script(bytes(payload))
+
+                self.reply(transport.MSG_ACK, seq)
+
+            elif tag == transport.MSG_SCRIPT_DIFF:
+                prefix, suffix = transport.SCRIPT_DIFF_FORMAT.unpack_from(payload)
+                with session.lock:
+                    if prefix + suffix > len(session.command_script):
+                        error = "Command %d does not match the script of the server" % seq
+                    else:
+                        error = None
+                        session.set_command_script(transport.apply_script_diff(session.command_script, prefix, suffix,
+                                                                               bytes(payload[transport.SCRIPT_DIFF_FORMAT.size:])))
+
+                if error is not None:
+                    self.reply(transport.MSG_ERROR, seq, json.dumps({"message": error}).encode())
+                else:
+                    self.reply(transport.MSG_ACK, seq)
+
+            elif tag == transport.MSG_CLOSE:
+                break
+
+    def finish(self):
+        with self.replies_cond:
+            self.closed = True
+            self.replies_cond.notify()
+
+        self.writer.join()
+
+#####################################################################################################################
+
+class FakeRenderServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host="localhost", port=7000, settings=None):
+        self.settings = settings if settings is not None else FakeRenderSettings()
+        # token: FakeSession of the frame connections, see FakeRenderHandler.handle_control
+        self.sessions = {}
+        self.sessions_lock = threading.Lock()
+        super().__init__((host, port), FakeRenderHandler)
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def start(self):
+        """ Serves in a background thread """
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+#####################################################################################################################
+
+def main():
+    parser = argparse.ArgumentParser(description="BRaaS-HPC stand-in render server")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=7000)
+    parser.add_argument("--render-time", type=float, default=0.0, help="server render time per frame [s]")
+    parser.add_argument("--rtt", type=float, default=0.0, help="simulated round trip time [s]")
+    parser.add_argument("--bandwidth", type=float, default=0.0, help="simulated bandwidth [bytes/s], 0 = unlimited")
+    args = parser.parse_args()
+
+    settings = FakeRenderSettings(args.render_time, args.rtt, args.bandwidth)
+    server = FakeRenderServer(args.host, args.port, settings)
+
+    print("Listening on %s:%d" % (args.host, server.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+    server.server_close()
+
+if __name__ == "__main__":
+    main()
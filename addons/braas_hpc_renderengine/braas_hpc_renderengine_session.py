@@ -0,0 +1,111 @@
+#####################################################################################################################
+# Copyright(C) 2011-2025 IT4Innovations National Supercomputing Center, VSB - Technical University of Ostrava
+#
+# This program is free software : you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+#####################################################################################################################
+
+#####################################################################################################################
+# Warm server connections kept between viewport restarts.
+#
+# BRaaSHPCContext.client_close_connection parks its connected transport here instead of closing it,
+# the next client_init with the same key (servers, transport, pixel size, codec) takes it over together
+# with the state the server already has. Parked sessions are closed after the grace period.
+# This module does not import bpy.
+#####################################################################################################################
+
+import threading
+import time
+
+#####################################################################################################################
+
+class Session:
+    """ Connected transport and the state which was sent to the server """
+
+    def __init__(self, transport, width, height, command_script):
+        self.transport = transport
+        self.width = width
+        self.height = height
+        # last command script sent, see BRaaSHPCContext.braas_hpc_renderengine_data_previous
+        self.command_script = command_script
+        self.expire_time = None
+
+    def close(self):
+        try:
+            self.transport.reset()
+            self.transport.client_close_connection()
+        except Exception as e:
+            print("Session:", e)
+
+class SessionPool:
+    """ Parked sessions by key, each is closed by a timer when its grace period ends """
+
+    def __init__(self):
+        self.sessions = {}
+        self.lock = threading.Lock()
+
+    def acquire(self, key):
+        """ Returns the parked session with the key or None. Parked sessions of the native module are closed """
+        with self.lock:
+            session = self.sessions.pop(key, None)
+
+            # the native module has a single connection
+            others = []
+            if key[1] == 'DLL':
+                others = [k for k in self.sessions if k[1] == 'DLL']
+                others = [self.sessions.pop(k) for k in others]
+
+        for other in others:
+            other.close()
+
+        return session
+
+    def release(self, key, session, grace_period):
+        """ Parks the session for grace_period seconds, an older session with the key is closed """
+        session.expire_time = time.monotonic() + grace_period
+
+        with self.lock:
+            previous = self.sessions.get(key)
+            self.sessions[key] = session
+
+        if previous is not None and previous is not session:
+            previous.close()
+
+        timer = threading.Timer(grace_period, self._expire, (key, session))
+        timer.daemon = True
+        timer.start()
+
+    def _expire(self, key, session):
+        with self.lock:
+            if self.sessions.get(key) is not session or time.monotonic() < session.expire_time:
+                # taken over, replaced or parked again
+                return
+
+            del self.sessions[key]
+
+        session.close()
+
+    def close_all(self):
+        with self.lock:
+            sessions = list(self.sessions.values())
+            self.sessions.clear()
+
+        for session in sessions:
+            session.close()
+
+    def __len__(self):
+        return len(self.sessions)
+
+# shared by all render engines
+SESSION_POOL = SessionPool()
@@ -0,0 +1,1667 @@
+#####################################################################################################################
+# Copyright(C) 2011-2025 IT4Innovations National Supercomputing Center, VSB - Technical University of Ostrava
+#
+# This program is free software : you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+#####################################################################################################################
+
+#####################################################################################################################
+# Transport layer between the addon and the render server.
+#
+# DllTransport forwards to the native braas_hpc_renderengine_dll module (Windows).
+# SocketTransport is a pure-Python implementation of the same functions, it talks to
+# braas_hpc_renderengine_server (a loopback stand-in server) using the messages below.
+# The messages are a protocol of their own, not the wire format of the native module:
+# a render server has to implement them to be used with SocketTransport.
+#
+# This module does not import bpy, so it can be used outside of Blender.
+#####################################################################################################################
+
+import ctypes
+import json
+import queue
+import socket
+import struct
+import threading
+import time
+import zlib
+
+import numpy as np
+
+from collections import deque
+
+try:
+    from . import braas_hpc_renderengine_codec
+except ImportError:
+    import braas_hpc_renderengine_codec
+
+#####################################################################################################################
+# Wire format of SocketTransport:
+# every message starts with MSG_HEADER (4 byte tag, uint32 sequence number, uint64 payload size)
+MSG_HEADER = struct.Struct("<4sIQ")
+
+MSG_HELLO = b"HELO"     # client -> server: json session parameters, server -> client: json with the negotiated session
+MSG_CAMERA = b"CAMR"    # CAMERA_FORMAT
+MSG_DATA = b"DATA"      # command script (may be empty), requests rendering of one frame
+MSG_PIXELS = b"PIXL"    # FRAME_FORMAT followed by the pixels encoded by the negotiated codec
+MSG_RESIZE = b"SIZE"    # RESIZE_FORMAT
+MSG_RANGE = b"RNGE"     # empty request, reply is RANGE_FORMAT
+MSG_RESET = b"RSET"
+MSG_SCRIPT_DIFF = b"SDIF" # SCRIPT_DIFF_FORMAT followed by the replacement bytes, patches the last command script
+MSG_REGION = b"RGON"    # REGION_FORMAT, part of the image rendered by this server, until the next MSG_RESIZE
+MSG_ROI = b"ROI_"       # ROI_FORMAT, requests one FRAME_DETACHED frame of a region at another resolution, the resolution,
+                        # region and samples of the following frames do not change (offered with "regions")
+MSG_PASS = b"PASS"      # PASS_FORMAT followed by the zlib compressed pass, precedes the MSG_PIXELS of the same frame
+MSG_BAND = b"BAND"      # BAND_FORMAT followed by the rows encoded by the negotiated codec, follows a MSG_PIXELS with FRAME_BANDS
+MSG_FORMAT = b"FRMT"    # client -> server: json pixel size, codecs and quality of the following frames,
+                        # server -> client: json with the negotiated format, precedes the first frame in it
+MSG_CLOSE = b"BYE_"
+
+# control connection, see ControlChannel. It is opened with the token the server sent in MSG_HELLO
+MSG_CONTROL = b"CTRL"   # client -> server: token of the frame connection, the first message of a control connection
+MSG_COMMAND = b"CMND"   # client -> server: command script, the sequence number is the command id
+                        # (MSG_SCRIPT_DIFF on the control connection patches the script the same way)
+MSG_ACK = b"ACK_"       # server -> client: the command with the sequence number is applied
+MSG_STATUS = b"STAT"    # server -> client: json server status, sent periodically
+MSG_ERROR = b"ERR_"     # server -> client: json {"message"}, the sequence number is the failed command or 0
+                        # (on the frame connection it precedes the MSG_PIXELS of the request and the script is unchanged)
+
+# transform[16], focal_length, clip_plane[2], sensor_size[2], sensor_fit, view_camera_zoom,
+# view_camera_offset[2], use_view_camera, shift_x, shift_y, view_perspective, frame, timestep
+CAMERA_FORMAT = struct.Struct("<16ff2f2fif2fiffiii")
+# width, height, pixsize, samples, remote fps, braas_hpc_renderengine_codec frame flags
+FRAME_FORMAT = struct.Struct("<iiiifi")
+RESIZE_FORMAT = struct.Struct("<ii")
+# x, y, width, height within the resolution of MSG_RESIZE, replies carry only this region
+REGION_FORMAT = struct.Struct("<iiii")
+# width, height of the resolution, x, y, width, height of the region within it
+ROI_FORMAT = struct.Struct("<iiiiii")
+# world_bounds_spatial_lower[3], world_bounds_spatial_upper[3], scalars_range[2]
+RANGE_FORMAT = struct.Struct("<8f")
+# common prefix and common suffix length of the previous and the new command script, see script_diff
+SCRIPT_DIFF_FORMAT = struct.Struct("<QQ")
+# pass tag, width, height
+PASS_FORMAT = struct.Struct("<4sii")
+# first row, rows
+BAND_FORMAT = struct.Struct("<ii")
+
+# frame flag besides the braas_hpc_renderengine_codec ones: the MSG_PIXELS has no pixels, they follow in MSG_BAND
+# messages from the top row down, never as delta
+FRAME_BANDS = 2
+# frame flag: the frame is encoded on its own and is not the reference of the following delta frames (MSG_ROI)
+FRAME_DETACHED = 4
+
+CHANNELS = 4
+
+PIXSIZE_DTYPES = {
+    8: np.uint8,
+    16: np.float16,
+    32: np.float32,
+}
+
+TRANSPORT_DLL = 'DLL'
+TRANSPORT_SOCKET = 'SOCKET'
+TRANSPORT_MULTI = 'MULTI'
+TRANSPORT_VIEW = 'VIEW'
+
+# auxiliary passes, requested in MSG_HELLO. Depth and normal are sent only when they change,
+# the sample count with every frame
+PASS_DEPTH = 'DEPTH'        # distance from the camera plane, PASS_DEPTH_BACKGROUND where nothing was hit
+PASS_NORMAL = 'NORMAL'      # world space normal scaled to -127..127
+PASS_SAMPLES = 'SAMPLES'    # samples per pixel
+
+# name: (tag, dtype, channels)
+PASSES = {
+    PASS_DEPTH: (b"DPTH", np.float16, 1),
+    PASS_NORMAL: (b"NRML", np.int8, 3),
+    PASS_SAMPLES: (b"SMPL", np.uint16, 1),
+}
+
+PASS_DEPTH_BACKGROUND = 65504.0
+
+#####################################################################################################################
+
+def pixels_dtype(pixsize):
+    """ Returns numpy dtype of one channel for the pixel size in bits (8/16/32) """
+    return PIXSIZE_DTYPES[pixsize]
+
+def frame_size(width, height, pixsize):
+    """ Returns size of one RGBA frame in bytes """
+    return width * height * CHANNELS * (pixsize // 8)
+
+def pass_name(tag):
+    """ Returns the name of the pass with the wire tag, None if unknown """
+    for name, (pass_tag, dtype, channels) in PASSES.items():
+        if pass_tag == tag:
+            return name
+
+    return None
+
+def encode_pass(name, values):
+    """ Returns the MSG_PASS payload, values is a (height, width, channels) array """
+    tag, dtype, channels = PASSES[name]
+    height, width = values.shape[0:2]
+    data = np.ascontiguousarray(values, dtype=dtype)
+    return PASS_FORMAT.pack(tag, width, height) + zlib.compress(data.tobytes(), 1)
+
+def decode_pass(payload):
+    """ Returns (name, values) of the MSG_PASS payload """
+    tag, width, height = PASS_FORMAT.unpack_from(payload)
+    name = pass_name(tag)
+    if name is None:
+        raise ValueError("Unknown pass %s" % tag)
+
+    tag, dtype, channels = PASSES[name]
+    data = zlib.decompress(bytes(payload[PASS_FORMAT.size:]))
+    return name, np.frombuffer(data, dtype=dtype).reshape(height, width, channels)
+
+def send_message(sock, tag, seq=0, payload=b""):
+    sock.sendall(MSG_HEADER.pack(tag, seq, len(payload)) + bytes(payload))
+
+def recv_exact(sock, size, buffer=None):
+    """ Receives exactly size bytes, into buffer if given """
+    if buffer is None:
+        buffer = bytearray(size)
+
+    view = memoryview(buffer)[:size]
+    received = 0
+    while received < size:
+        n = sock.recv_into(view[received:], size - received)
+        if n == 0:
+            raise ConnectionError("Connection closed")
+        received += n
+
+    return buffer
+
+def recv_message(sock):
+    """ Returns (tag, seq, payload) """
+    tag, seq, size = MSG_HEADER.unpack(recv_exact(sock, MSG_HEADER.size))
+    payload = recv_exact(sock, size) if size > 0 else bytearray()
+    return tag, seq, payload
+
+def recv_header(sock):
+    """ Returns (tag, seq, size), the payload is left in the socket """
+    return MSG_HEADER.unpack(recv_exact(sock, MSG_HEADER.size))
+
+def script_diff(previous, current):
+    """ Returns (prefix, suffix, middle) such that current == previous[:prefix] + middle + previous[len(previous) - suffix:] """
+    a = np.frombuffer(previous, dtype=np.uint8)
+    b = np.frombuffer(current, dtype=np.uint8)
+
+    n = min(len(a), len(b))
+    mismatch = np.flatnonzero(a[:n] != b[:n])
+    prefix = int(mismatch[0]) if len(mismatch) > 0 else n
+
+    # the suffix must not overlap the prefix
+    m = n - prefix
+    mismatch = np.flatnonzero(a[len(a) - m:][::-1] != b[len(b) - m:][::-1])
+    suffix = int(mismatch[0]) if len(mismatch) > 0 else m
+
+    return prefix, suffix, current[prefix:len(current) - suffix]
+
+def apply_script_diff(previous, prefix, suffix, middle):
+    return previous[:prefix] + middle + previous[len(previous) - suffix:]
+
+#####################################################################################################################
+
+class FrameBuffers:
+    """
+    Two preallocated frames, the render thread fills the back one while the front one is read.
+    The front frame is a read-only view, valid until the next but one swap. Frames which are kept
+    longer (frame cache, queued frames) must be copied
+    """
+
+    def __init__(self):
+        self.buffers = [None, None]
+        self.front = 0
+
+    def get_back(self, shape, dtype):
+        """ Returns the back buffer, allocated again when the shape or the pixel format changed """
+        back = 1 - self.front
+        buffer = self.buffers[back]
+        if buffer is None or buffer.shape != shape or buffer.dtype != dtype:
+            buffer = np.empty(shape, dtype=dtype)
+            self.buffers[back] = buffer
+
+        return buffer
+
+    def swap(self):
+        """ The back buffer becomes the front one, returns its read-only view """
+        self.front = 1 - self.front
+
+        view = self.buffers[self.front].view()
+        view.flags.writeable = False
+        return view
+
+#####################################################################################################################
+
+class ControlChannel:
+    """
+    Second connection to the session of a SocketTransport for commands, acknowledgements, server status and errors.
+    Commands are sent by a sender thread, so bulk command data never delays the frame requests on the frame
+    connection. A receiver thread keeps the last status and the errors. The methods can be called from any thread
+    """
+
+    # errors kept until they are read
+    MAX_ERRORS = 16
+
+    def __init__(self):
+        self.sock = None
+        self.error = 0
+        self.closing = False
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.threads = []
+
+        self.command_id = 0
+        self.acknowledged_id = 0
+        self.status = None
+        self.errors = deque(maxlen=self.MAX_ERRORS)
+
+    def _fail(self, e):
+        print("ControlChannel:", e)
+        self.error = 1
+
+    def connect(self, server, port, token):
+        try:
+            self.sock = socket.create_connection((server, port))
+            self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            send_message(self.sock, MSG_CONTROL, 0, token.encode())
+
+        except OSError as e:
+            self._fail(e)
+            if self.sock is not None:
+                self.sock.close()
+                self.sock = None
+            return
+
+        self.threads = [threading.Thread(target=self._send_loop, daemon=True),
+                        threading.Thread(target=self._recv_loop, daemon=True)]
+        for thread in self.threads:
+            thread.start()
+
+    def close(self):
+        if self.sock is None:
+            return
+
+        # the server closes the connection after MSG_CLOSE, which is not an error
+        self.closing = True
+
+        # the sender says goodbye after the queued commands
+        self.queue.put(None)
+        self.threads[0].join()
+
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+        self.threads[1].join()
+        self.sock.close()
+        self.sock = None
+
+    def send_command(self, data):
+        """ Queues the command script, returns its id, see is_acknowledged """
+        return self._queue(MSG_COMMAND, bytes(data))
+
+    def send_command_diff(self, prefix, suffix, data):
+        """ Queues a patch of the last command script, see script_diff. Returns its id """
+        return self._queue(MSG_SCRIPT_DIFF, SCRIPT_DIFF_FORMAT.pack(prefix, suffix) + bytes(data))
+
+    def _queue(self, tag, payload):
+        with self.lock:
+            self.command_id += 1
+            command_id = self.command_id
+
+        self.queue.put((tag, command_id, payload))
+        return command_id
+
+    def is_acknowledged(self, command_id):
+        """ True when the server applied the command and the ones before it. A failed command is never acknowledged """
+        return self.acknowledged_id >= command_id
+
+    def get_status(self):
+        return self.status
+
+    def pop_errors(self):
+        errors = []
+        while self.errors:
+            errors.append(self.errors.popleft())
+
+        return errors
+
+    def _send_loop(self):
+        while True:
+            message = self.queue.get()
+            if message is None:
+                try:
+                    send_message(self.sock, MSG_CLOSE)
+                except OSError:
+                    pass
+                return
+
+            tag, command_id, payload = message
+            try:
+                send_message(self.sock, tag, command_id, payload)
+            except OSError as e:
+                self._fail(e)
+                return
+
+    def _recv_loop(self):
+        try:
+            while True:
+                tag, seq, payload = recv_message(self.sock)
+
+                if tag == MSG_ACK:
+                    self.acknowledged_id = max(self.acknowledged_id, seq)
+                elif tag == MSG_STATUS:
+                    self.status = json.loads(payload.decode())
+                elif tag == MSG_ERROR:
+                    self.errors.append(json.loads(payload.decode()).get("message", "Unknown error"))
+
+        except (OSError, ValueError) as e:
+            if not self.closing:
+                self._fail(e)
+
+#####################################################################################################################
+
+class Transport:
+    """ Defaults of the optional transport functions, for a transport without the feature """
+
+    name = None
+    # the frames are drawn from the OpenGL texture of the native module, see get_texture_id
+    provides_gl_texture = False
+    # the frames are received into FrameBuffers, see set_double_buffering
+    double_buffered = False
+    # the frames can be read with get_pixels and double buffered, only a native module may lack it
+    can_copy_pixels = True
+    # several requests can be in flight, their frames are matched by sequence number
+    supports_pipelining = True
+    # the command script can be patched, see send_braas_hpc_renderengine_data_diff
+    supports_script_diff = False
+    # the frames can contain a region of the image, see set_region
+    supports_regions = False
+    # the pixel size and the codec can be switched while frames are in flight, see set_format
+    supports_formats = False
+    # the command script is sent over a control connection, see send_command
+    supports_control = False
+
+    def set_codec(self, codec, use_delta=False, quality=90):
+        pass
+
+    def set_passes(self, passes):
+        pass
+
+    def set_format(self, pixsize, codec, quality=90):
+        pass
+
+    def set_band_rows(self, rows, callback=None):
+        pass
+
+    def set_double_buffering(self, enabled):
+        pass
+
+    def is_command_acknowledged(self, command_id):
+        """ The command script is sent with the frame requests, it is applied with the next frame """
+        return True
+
+    def get_server_status(self):
+        return None
+
+    def pop_server_errors(self):
+        return []
+
+    def draw_texture(self):
+        pass
+
+    def get_texture_id(self):
+        return 0
+
+    def get_partial_pixels(self):
+        return None
+
+    def get_pass(self, name):
+        return None
+
+    def get_bytes_received(self):
+        return None
+
+    def get_link_stats(self):
+        return None
+
+    def get_codec_stats(self):
+        return None
+
+#####################################################################################################################
+
+class DllTransport(Transport):
+    """
+    Forwards to the native braas_hpc_renderengine_dll module. It sends the command script in full with the frame
+    requests and receives whole color frames of the whole image, in the pixel size and with GPUJPEG as set
+    at client_init
+    """
+
+    name = TRANSPORT_DLL
+
+    def __init__(self, dll):
+        self.dll = dll
+        # older native modules only draw their texture
+        self.can_copy_pixels = hasattr(dll, "get_pixels")
+        # the native protocol is lockstep unless the module tags its frames with the request
+        self.supports_pipelining = hasattr(dll, "get_frame_seq")
+        self.pixsize = 8
+        self.width = 0
+        self.height = 0
+
+        # copies of the native frames, see set_double_buffering
+        self.frame_buffers = None
+        self.pixels = None
+        self.pixels_seq = 0
+
+    @property
+    def double_buffered(self):
+        return self.frame_buffers is not None
+
+    @property
+    def provides_gl_texture(self):
+        """ The frames are drawn from the OpenGL texture of the native module unless they are copied, see set_double_buffering """
+        return self.frame_buffers is None
+
+    def enable_gpujpeg(self, use_gpujpeg):
+        self.dll.enable_gpujpeg(use_gpujpeg)
+
+    def set_double_buffering(self, enabled):
+        """ Every received frame is copied from the native module into FrameBuffers, see get_pixels_array """
+        if enabled and not self.can_copy_pixels:
+            raise RuntimeError("The native module cannot copy frames (no get_pixels), update braas_hpc_renderengine_dll")
+
+        self.frame_buffers = FrameBuffers() if enabled else None
+        self.pixels = None
+
+    def set_pixsize(self, pixsize):
+        self.pixsize = pixsize
+        self.dll.set_pixsize(pixsize)
+
+    def client_init(self, server, port, width, height):
+        self.width = width
+        self.height = height
+        self.dll.client_init(server, port, width, height)
+
+    def client_close_connection(self):
+        self.dll.client_close_connection()
+
+    def reset(self):
+        self.dll.reset()
+
+    def send_cam_data(self):
+        self.dll.send_cam_data()
+
+    def send_braas_hpc_renderengine_data_render(self, data, size):
+        self.dll.send_braas_hpc_renderengine_data_render(data, size)
+
+    def recv_pixels_data(self):
+        self.dll.recv_pixels_data()
+
+        if self.frame_buffers is not None and self.dll.com_error() == 0:
+            self._copy_pixels(self.frame_buffers.get_back(self._shape(), pixels_dtype(self.pixsize)))
+            self.pixels = self.frame_buffers.swap()
+            self.pixels_seq += 1
+
+    def com_error(self):
+        return self.dll.com_error()
+
+    def set_timestep(self, timestep):
+        self.dll.set_timestep(timestep)
+
+    def set_frame(self, frame):
+        self.dll.set_frame(frame)
+
+    def set_camera(self, transform, focal_length, clip_start, clip_end, sensor_width, sensor_height, sensor_fit,
+                   view_camera_zoom, view_camera_offset0, view_camera_offset1, use_view_camera,
+                   shift_x, shift_y, view_perspective):
+        self.dll.set_camera(transform, focal_length, clip_start, clip_end, sensor_width, sensor_height, sensor_fit,
+                            view_camera_zoom, view_camera_offset0, view_camera_offset1, use_view_camera,
+                            shift_x, shift_y, view_perspective)
+
+    def draw_texture(self):
+        self.dll.draw_texture()
+
+    def get_current_samples(self):
+        return self.dll.get_current_samples()
+
+    def get_remote_fps(self):
+        return self.dll.get_remote_fps()
+
+    def get_local_fps(self):
+        return self.dll.get_local_fps()
+
+    def get_texture_id(self):
+        return self.dll.get_texture_id()
+
+    def resize(self, width, height):
+        self.width = width
+        self.height = height
+        self.dll.resize(width, height)
+
+    def get_braas_hpc_renderengine_range(self, world_bounds_spatial_lower, world_bounds_spatial_upper, scalars_range):
+        self.dll.get_braas_hpc_renderengine_range(world_bounds_spatial_lower, world_bounds_spatial_upper, scalars_range)
+
+    def _shape(self):
+        return (self.height, self.width, CHANNELS)
+
+    def _copy_pixels(self, pixels):
+        self.dll.get_pixels(ctypes.c_void_p(pixels.ctypes.data))
+        return pixels
+
+    def get_pixels_array(self):
+        """ The native module keeps the pixels in its own OpenGL texture, they are copied only with double buffering """
+        if self.frame_buffers is None:
+            return None, None
+
+        return self.pixels_seq, self.pixels
+
+    def get_pixels(self):
+        """ Returns (height, width, 4) array with a copy of the last frame, for the final render, None if it cannot be copied """
+        if self.frame_buffers is not None:
+            return self.pixels
+
+        if not self.can_copy_pixels:
+            return None
+
+        return self._copy_pixels(np.empty(self._shape(), dtype=pixels_dtype(self.pixsize)))
+
+#####################################################################################################################
+
+class SocketTransport(Transport):
+    """
+    Pure-Python implementation of the braas_hpc_renderengine_dll functions.
+    The functions are called from the same threads as the native ones: set_* and get_* from the UI thread,
+    send_*/recv_* from the render thread.
+    """
+
+    name = TRANSPORT_SOCKET
+
+    def __init__(self):
+        self.sock = None
+        self.error = 0
+        self.use_gpujpeg = 0
+        self.pixsize = 8
+        self.width = 0
+        self.height = 0
+        self.server_info = {}
+
+        # requested codec, the server may fall back to RAW
+        self.codec = braas_hpc_renderengine_codec.CODEC_RAW
+        self.use_delta = False
+        self.quality = 90
+        self.decoder = None
+
+        # requested auxiliary passes, the server replies with the ones it renders
+        self.requested_passes = []
+        # name: (height, width, channels) array of the last received pass, replaced when a pass changes
+        self.passes = {}
+
+        self.camera = bytes(CAMERA_FORMAT.size)
+        self.camera_args = None
+        self.frame = 0
+        self.timestep = 0
+
+        # sequence number of the last request and of the last received frame
+        self.seq = 0
+        self.pixels_seq = 0
+        # the UI thread only reads the reference, the render thread swaps it for every new frame
+        self.pixels = None
+        # uncompressed frames are received into these instead of a new array per frame, see set_double_buffering
+        self.frame_buffers = None
+
+        # requested rows per band, see set_band_rows
+        self.band_rows = 0
+        self.band_callback = None
+        # (seq, pixels, first received row) of the frame being received in bands, rows above it are valid
+        self.partial = None
+
+        # opened when the server offers it, see ControlChannel
+        self.control = None
+        # errors the server reported on this connection, see pop_server_errors
+        self.errors = []
+
+        self.samples = 0
+        self.remote_fps = 0.0
+        self.local_fps = 0.0
+        self.recv_time = None
+
+        # statistics, payload bytes of all received frames
+        self.bytes_received = 0
+        self.frames_received = 0
+        # size of the last frame in bytes and the time its payload took to arrive, see get_link_stats
+        self.frame_bytes = 0
+        self.transfer_time = 0.0
+
+        self.send_lock = threading.Lock()
+
+    # the optional features are the ones the server offered in MSG_HELLO
+
+    @property
+    def double_buffered(self):
+        return self.frame_buffers is not None
+
+    @property
+    def supports_script_diff(self):
+        return self.server_info.get("script_diff", False)
+
+    @property
+    def supports_regions(self):
+        return self.server_info.get("regions", False)
+
+    @property
+    def supports_formats(self):
+        return self.server_info.get("formats", False)
+
+    @property
+    def supports_control(self):
+        return self.control is not None and not self.control.error
+
+    @property
+    def supported_passes(self):
+        return self.server_info.get("passes", [])
+
+    def _fail(self, e):
+        print("SocketTransport:", e)
+        self.error = 1
+        self.partial = None
+
+    def enable_gpujpeg(self, use_gpujpeg):
+        # GPUJPEG needs the native decoder, frames are always sent as raw RGBA
+        self.use_gpujpeg = use_gpujpeg
+
+    def set_pixsize(self, pixsize):
+        self.pixsize = pixsize
+
+    def set_codec(self, codec, use_delta=False, quality=90):
+        """ Codec requested at client_init, see braas_hpc_renderengine_codec """
+        self.codec = codec
+        self.use_delta = use_delta
+        self.quality = quality
+
+    def set_passes(self, passes):
+        """ Auxiliary passes requested at client_init, see PASSES """
+        self.requested_passes = [name for name in passes if name in PASSES]
+
+    def set_band_rows(self, rows, callback=None):
+        """
+        Frames are requested at client_init in bands of rows (0 = whole frames), see get_partial_pixels.
+        The callback is called by the receiving thread after every band
+        """
+        self.band_rows = rows
+        self.band_callback = callback
+
+    def set_format(self, pixsize, codec, quality=90):
+        """
+        Switches the pixel size and the codec of the connection, the frames of the requests in flight keep the old one.
+        Called from the render thread, the server replies with MSG_FORMAT ahead of the first frame in the new format
+        """
+        self.pixsize = pixsize
+        self.codec = codec
+        self.quality = quality
+
+        message = {
+            "pixsize": pixsize,
+            "codecs": [codec],
+            "delta": self.use_delta,
+            "quality": quality,
+        }
+        self._send(MSG_FORMAT, 0, json.dumps(message).encode())
+
+    def set_double_buffering(self, enabled):
+        """
+        Uncompressed frames are received directly into two preallocated buffers, get_pixels returns a read-only
+        view of the last one without a copy. The view is overwritten by the next but one frame
+        """
+        self.frame_buffers = FrameBuffers() if enabled else None
+
+    def client_init(self, server, port, width, height):
+        if isinstance(server, bytes):
+            server = server.decode()
+
+        self.error = 0
+        self.width = width
+        self.height = height
+        self.passes = {}
+
+        try:
+            self.sock = socket.create_connection((server, port))
+            self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+            hello = {
+                "width": width,
+                "height": height,
+                "pixsize": self.pixsize,
+                "codecs": [self.codec],
+                "delta": self.use_delta,
+                "quality": self.quality,
+                "script_diff": True,
+                "regions": True,
+            }
+            if self.band_rows > 0:
+                # older servers ignore the key and send whole frames
+                hello["bands"] = self.band_rows
+            if self.requested_passes:
+                # older servers ignore the key and send no MSG_PASS
+                hello["passes"] = self.requested_passes
+
+            send_message(self.sock, MSG_HELLO, 0, json.dumps(hello).encode())
+
+            tag, seq, payload = recv_message(self.sock)
+            if tag != MSG_HELLO:
+                raise ConnectionError("Unexpected reply %s" % tag)
+
+            self.server_info = json.loads(payload.decode())
+            self._create_decoder(self.server_info)
+
+            token = self.server_info.get("control")
+            if token:
+                self.control = ControlChannel()
+                self.control.connect(server, port, token)
+
+        except (OSError, ValueError, KeyError) as e:
+            self._fail(e)
+
+    def _create_decoder(self, info):
+        """ Decoder for the format negotiated in MSG_HELLO or MSG_FORMAT """
+        codec = braas_hpc_renderengine_codec.create_codec(info.get("codec", braas_hpc_renderengine_codec.CODEC_RAW), self.quality)
+        self.decoder = braas_hpc_renderengine_codec.FrameDecoder(codec, info.get("delta", False))
+
+    def client_close_connection(self):
+        if self.control is not None:
+            self.control.close()
+            self.control = None
+
+        if self.sock is None:
+            return
+
+        try:
+            send_message(self.sock, MSG_CLOSE)
+        except OSError:
+            pass
+
+        self.sock.close()
+        self.sock = None
+
+    def reset(self):
+        self._send(MSG_RESET)
+
+    def _send(self, tag, seq=0, payload=b""):
+        if self.sock is None or self.error:
+            self.error = 1
+            return
+
+        try:
+            with self.send_lock:
+                send_message(self.sock, tag, seq, payload)
+        except OSError as e:
+            self._fail(e)
+
+    def send_cam_data(self):
+        self._send(MSG_CAMERA, self.seq + 1, self.camera)
+
+    def send_braas_hpc_renderengine_data_render(self, data, size):
+        self.seq += 1
+        self._send(MSG_DATA, self.seq, data[:size])
+
+    def send_braas_hpc_renderengine_data_diff(self, prefix, suffix, data):
+        """ Patches the command script on the server, see script_diff. The next send_braas_hpc_renderengine_data_render renders with it """
+        self._send(MSG_SCRIPT_DIFF, self.seq + 1, SCRIPT_DIFF_FORMAT.pack(prefix, suffix) + data)
+
+    def send_command(self, data):
+        """ Sends the command script over the control connection, returns the command id """
+        return self.control.send_command(data)
+
+    def send_command_diff(self, prefix, suffix, data):
+        return self.control.send_command_diff(prefix, suffix, data)
+
+    def is_command_acknowledged(self, command_id):
+        """ True when the frames requested from now on are rendered with the command, or it will never be """
+        return self.control is None or self.control.error == 1 or self.control.is_acknowledged(command_id)
+
+    def get_server_status(self):
+        """ Returns the last dict the server pushed over the control connection, None without it """
+        return self.control.get_status() if self.control is not None else None
+
+    def pop_server_errors(self):
+        """ Returns the errors the server reported since the last call """
+        errors, self.errors = self.errors, []
+        if self.control is not None:
+            errors += self.control.pop_errors()
+
+        return errors
+
+    def recv_pixels_data(self):
+        if self.sock is None or self.error:
+            self.error = 1
+            return
+
+        try:
+            tag, seq, size = recv_header(self.sock)
+            while tag in (MSG_PASS, MSG_FORMAT, MSG_ERROR):
+                payload = recv_exact(self.sock, size)
+                if tag == MSG_PASS:
+                    name, values = decode_pass(payload)
+                    self.passes[name] = values
+                elif tag == MSG_FORMAT:
+                    self._create_decoder(json.loads(payload.decode()))
+                else:
+                    self.errors.append(json.loads(payload.decode()).get("message", "Unknown error"))
+
+                self.bytes_received += MSG_HEADER.size + size
+                tag, seq, size = recv_header(self.sock)
+
+            if tag != MSG_PIXELS:
+                raise ConnectionError("Unexpected message %s" % tag)
+
+            # the payload of a large frame arrives at the speed of the link, the header marks its start
+            transfer_begin = time.perf_counter()
+            bytes_begin = self.bytes_received
+
+            width, height, pixsize, samples, remote_fps, flags = FRAME_FORMAT.unpack(recv_exact(self.sock, FRAME_FORMAT.size))
+
+            shape = (height, width, CHANNELS)
+            dtype = pixels_dtype(pixsize)
+            data_size = size - FRAME_FORMAT.size
+
+            if flags & FRAME_BANDS:
+                pixels = self._recv_bands(seq, shape, pixsize)
+                transfer_time = time.perf_counter() - transfer_begin
+            elif self.decoder.codec.name == braas_hpc_renderengine_codec.CODEC_RAW and not self.decoder.use_delta:
+                if data_size != frame_size(width, height, pixsize):
+                    raise ValueError("Unexpected frame size %d" % size)
+
+                # uncompressed, received directly into the pixels
+                if self.frame_buffers is not None:
+                    recv_exact(self.sock, data_size, self.frame_buffers.get_back(shape, dtype).data.cast('B'))
+                    pixels = self.frame_buffers.swap()
+                else:
+                    pixels = np.empty(shape, dtype=dtype)
+                    recv_exact(self.sock, data_size, pixels.data.cast('B'))
+
+                transfer_time = time.perf_counter() - transfer_begin
+            elif flags & FRAME_DETACHED:
+                # the delta reference of the decoder is kept
+                data = recv_exact(self.sock, data_size)
+                transfer_time = time.perf_counter() - transfer_begin
+                pixels = self.decoder.codec.decode(data, shape, dtype)
+            else:
+                data = recv_exact(self.sock, data_size)
+                transfer_time = time.perf_counter() - transfer_begin
+                pixels = self.decoder.decode(flags, data, shape, dtype)
+
+        except (OSError, ValueError, KeyError, struct.error) as e:
+            self._fail(e)
+            return
+
+        now = time.perf_counter()
+        if self.recv_time is not None and now > self.recv_time:
+            self.local_fps = 1.0 / (now - self.recv_time)
+        self.recv_time = now
+
+        self.bytes_received += MSG_HEADER.size + size
+        self.frames_received += 1
+        # with the bands
+        self.frame_bytes = self.bytes_received - bytes_begin
+        self.transfer_time = transfer_time
+
+        self.samples = samples
+        self.remote_fps = remote_fps
+        self.pixels = pixels
+        self.pixels_seq = seq
+        self.partial = None
+
+    def _recv_bands(self, seq, shape, pixsize):
+        """ Receives the bands of a frame from the top row down, returns the pixels """
+        height, width = shape[0:2]
+        dtype = pixels_dtype(pixsize)
+        pixels = self.frame_buffers.get_back(shape, dtype) if self.frame_buffers is not None else np.empty(shape, dtype=dtype)
+        is_raw = self.decoder.codec.name == braas_hpc_renderengine_codec.CODEC_RAW
+
+        top = height
+        while top > 0:
+            tag, band_seq, size = recv_header(self.sock)
+            if tag != MSG_BAND:
+                raise ConnectionError("Unexpected message %s" % tag)
+
+            y, rows = BAND_FORMAT.unpack(recv_exact(self.sock, BAND_FORMAT.size))
+            data_size = size - BAND_FORMAT.size
+            if rows <= 0 or y < 0 or y + rows != top:
+                raise ValueError("Unexpected band %d+%d" % (y, rows))
+
+            if is_raw:
+                if data_size != frame_size(width, rows, pixsize):
+                    raise ValueError("Unexpected band size %d" % size)
+
+                recv_exact(self.sock, data_size, pixels[y:top].data.cast('B'))
+            else:
+                pixels[y:top] = self.decoder.codec.decode(recv_exact(self.sock, data_size), (rows, width, CHANNELS), dtype)
+
+            top = y
+            self.bytes_received += MSG_HEADER.size + size
+            self.partial = (seq, pixels, top)
+
+            if self.band_callback is not None:
+                self.band_callback()
+
+        return self.frame_buffers.swap() if self.frame_buffers is not None else pixels
+
+    def com_error(self):
+        return self.error
+
+    def set_timestep(self, timestep):
+        self.timestep = timestep
+        self._pack_camera()
+
+    def set_frame(self, frame):
+        self.frame = frame
+        self._pack_camera()
+
+    def set_camera(self, transform, focal_length, clip_start, clip_end, sensor_width, sensor_height, sensor_fit,
+                   view_camera_zoom, view_camera_offset0, view_camera_offset1, use_view_camera,
+                   shift_x, shift_y, view_perspective):
+        # transform is an address of 16 floats, as for the native module
+        transform = tuple((ctypes.c_float * 16).from_address(transform))
+
+        self.camera_args = transform + (focal_length, clip_start, clip_end, sensor_width, sensor_height, int(sensor_fit),
+                                        view_camera_zoom, view_camera_offset0, view_camera_offset1, int(use_view_camera),
+                                        shift_x, shift_y, int(view_perspective))
+        self._pack_camera()
+
+    def _pack_camera(self):
+        if self.camera_args is None:
+            return
+
+        self.camera = CAMERA_FORMAT.pack(*self.camera_args, int(self.frame), int(self.timestep))
+
+    def get_current_samples(self):
+        return self.samples
+
+    def get_remote_fps(self):
+        return self.remote_fps
+
+    def get_local_fps(self):
+        return self.local_fps
+
+    def resize(self, width, height):
+        self.width = width
+        self.height = height
+        self._send(MSG_RESIZE, 0, RESIZE_FORMAT.pack(width, height))
+
+    def set_region(self, x, y, width, height):
+        """ The following frames contain only this region of the image, see MultiTransport """
+        self._send(MSG_REGION, 0, REGION_FORMAT.pack(x, y, width, height))
+
+    def send_roi_request(self, resolution_width, resolution_height, x, y, width, height):
+        """
+        Requests one frame of the region at the resolution, received by recv_pixels_data as any other frame.
+        The resolution, the render border and the accumulated samples of the connection are kept
+        """
+        self.seq += 1
+        self._send(MSG_ROI, self.seq, ROI_FORMAT.pack(resolution_width, resolution_height, x, y, width, height))
+
+    def get_braas_hpc_renderengine_range(self, world_bounds_spatial_lower, world_bounds_spatial_upper, scalars_range):
+        """ Only valid while no frame is in flight, the reply shares the socket with the frames """
+        self._send(MSG_RANGE)
+        if self.error:
+            return
+
+        try:
+            tag, seq, payload = recv_message(self.sock)
+            if tag != MSG_RANGE:
+                raise ConnectionError("Unexpected message %s" % tag)
+
+            values = RANGE_FORMAT.unpack(payload)
+
+        except (OSError, struct.error) as e:
+            self._fail(e)
+            return
+
+        (ctypes.c_float * 3).from_address(world_bounds_spatial_lower)[:] = values[0:3]
+        (ctypes.c_float * 3).from_address(world_bounds_spatial_upper)[:] = values[3:6]
+        (ctypes.c_float * 2).from_address(scalars_range)[:] = values[6:8]
+
+    def get_pixels_array(self):
+        """
+        Returns (seq, pixels) of the last received frame, pixels is a (height, width, 4) array of the pixel size
+        (uint8, float16 or float32). It supports the buffer protocol, memoryview(pixels) does not copy
+        """
+        return self.pixels_seq, self.pixels
+
+    def get_pixels(self):
+        return self.pixels
+
+    def get_partial_pixels(self):
+        """
+        Returns (seq, pixels, y) while a frame is received in bands, None otherwise. Rows from y up are
+        received, the rows below it are stale. The array is written by the receiving thread
+        """
+        return self.partial
+
+    def get_pass(self, name):
+        """ Returns (height, width, channels) array of the auxiliary pass for the last frame or None """
+        return self.passes.get(name)
+
+    def get_bytes_received(self):
+        return self.bytes_received
+
+    def get_link_stats(self):
+        """
+        Returns (bytes, seconds) of the last frame, the time from its header to the end of its payload.
+        Data the socket buffered before the header was read is not timed
+        """
+        if self.frames_received == 0:
+            return None
+
+        return self.frame_bytes, self.transfer_time
+
+    def get_codec_stats(self):
+        """ Returns dict with the negotiated codec, compression ratio and decode time, see FrameDecoder """
+        if self.decoder is None:
+            return None
+
+        return self.decoder.get_stats()
+
+#####################################################################################################################
+
+class MultiTransport(Transport):
+    """
+    Splits the image into horizontal strips rendered by several servers, one SocketTransport per server,
+    and composites the returned strips. The strip heights follow the render speed each server reports
+    with its frames, they are changed together with the camera so the progressive refinement is not reset.
+    The regions of the nodes are the strips, the strips are composited when they are complete and
+    the command script is sent with the frame requests of every node.
+    """
+
+    name = TRANSPORT_MULTI
+
+    # strip heights are changed only if a strip moves by more than this part of the image
+    REBALANCE_THRESHOLD = 0.02
+
+    def __init__(self, endpoints):
+        """ endpoints is a list of (server, port) """
+        self.endpoints = list(endpoints)
+        self.nodes = [SocketTransport() for endpoint in self.endpoints]
+        # the strips are copied into the composite right after they are received
+        for node in self.nodes:
+            node.set_double_buffering(True)
+        self.width = 0
+        self.height = 0
+
+        # (y, height) per node, and the regions of the requests in flight per node
+        self.strips = []
+        self.strips_target = None
+        # set by set_camera (UI thread), the render thread switches to strips_target before the next request
+        self.strips_pending = False
+        self.regions_in_flight = [deque() for node in self.nodes]
+        # rows per second of every node, moving average
+        self.speeds = [0.0] * len(self.nodes)
+
+        self.pixels = None
+        self.pixels_seq = 0
+        self.samples = 0
+        self.remote_fps = 0.0
+        self.local_fps = 0.0
+        self.recv_time = None
+
+        # composited frames, see set_double_buffering
+        self.frame_buffers = None
+
+        # composited auxiliary passes, and the pass arrays of every node already copied into them
+        self.passes = {}
+        self.node_passes = [{} for node in self.nodes]
+
+    @property
+    def double_buffered(self):
+        return self.frame_buffers is not None
+
+    @property
+    def supports_script_diff(self):
+        return all(node.supports_script_diff for node in self.nodes)
+
+    @property
+    def supports_formats(self):
+        return all(node.supports_formats for node in self.nodes)
+
+    def _split(self, weights):
+        """ Returns (y, height) strips with heights proportional to the weights, at least one row each """
+        count = len(self.nodes)
+        height = max(self.height, count)
+        total = sum(weights)
+
+        strips = []
+        y = 0
+        for i, weight in enumerate(weights):
+            if i == count - 1:
+                rows = height - y
+            else:
+                rows = int(round(height * weight / total))
+                rows = min(max(rows, 1), height - y - (count - 1 - i))
+
+            strips.append((y, rows))
+            y += rows
+
+        return strips
+
+    def _send_regions(self):
+        for node, (y, rows) in zip(self.nodes, self.strips):
+            node.set_region(0, y, self.width, rows)
+
+    def enable_gpujpeg(self, use_gpujpeg):
+        for node in self.nodes:
+            node.enable_gpujpeg(use_gpujpeg)
+
+    def set_pixsize(self, pixsize):
+        for node in self.nodes:
+            node.set_pixsize(pixsize)
+
+    def set_codec(self, codec, use_delta=False, quality=90):
+        for node in self.nodes:
+            node.set_codec(codec, use_delta, quality)
+
+    def set_passes(self, passes):
+        for node in self.nodes:
+            node.set_passes(passes)
+
+    def set_format(self, pixsize, codec, quality=90):
+        for node in self.nodes:
+            node.set_format(pixsize, codec, quality)
+
+    def set_double_buffering(self, enabled):
+        """ The strips are composited into FrameBuffers instead of a new frame """
+        self.frame_buffers = FrameBuffers() if enabled else None
+
+    def client_init(self, server, port, width, height):
+        """ server and port are ignored, the nodes connect to the endpoints """
+        self.width = width
+        self.height = height
+
+        for node, (server, port) in zip(self.nodes, self.endpoints):
+            node.client_init(server, port, width, height)
+
+            if not node.error and not node.server_info.get("regions", False):
+                node._fail("%s:%d does not support regions" % (server, port))
+
+        self.strips = self._split([1.0] * len(self.nodes))
+        self.strips_target = None
+        self._send_regions()
+
+    def client_close_connection(self):
+        for node in self.nodes:
+            node.client_close_connection()
+
+        for regions in self.regions_in_flight:
+            regions.clear()
+
+        self.passes = {}
+        self.node_passes = [{} for node in self.nodes]
+
+    def reset(self):
+        for node in self.nodes:
+            node.reset()
+
+    def send_cam_data(self):
+        for node in self.nodes:
+            node.send_cam_data()
+
+    def send_braas_hpc_renderengine_data_render(self, data, size):
+        if self.strips_pending:
+            self.strips_pending = False
+
+            strips_target = self.strips_target
+            if strips_target is not None:
+                self.strips = strips_target
+                self.strips_target = None
+                self._send_regions()
+
+        for node, regions, strip in zip(self.nodes, self.regions_in_flight, self.strips):
+            node.send_braas_hpc_renderengine_data_render(data, size)
+            regions.append(strip)
+
+    def send_braas_hpc_renderengine_data_diff(self, prefix, suffix, data):
+        for node in self.nodes:
+            node.send_braas_hpc_renderengine_data_diff(prefix, suffix, data)
+
+    def recv_pixels_data(self):
+        pixels = None
+
+        for i, (node, regions) in enumerate(zip(self.nodes, self.regions_in_flight)):
+            node.recv_pixels_data()
+            if node.error or not regions:
+                node.error = 1
+                return
+
+            y, rows = regions.popleft()
+            if node.pixels is None or node.pixels.shape[0] != rows or node.pixels.shape[1] != self.width:
+                # a strip of the size before resize
+                continue
+
+            if pixels is None:
+                pixels = self._get_composite(node.pixels.dtype)
+
+            pixels[y:y + rows] = node.pixels
+            self._composite_passes(i, node, y, rows)
+
+            if node.remote_fps > 0.0:
+                speed = rows * node.remote_fps
+                self.speeds[i] = speed if self.speeds[i] == 0.0 else 0.8 * self.speeds[i] + 0.2 * speed
+
+        now = time.perf_counter()
+        if self.recv_time is not None and now > self.recv_time:
+            self.local_fps = 1.0 / (now - self.recv_time)
+        self.recv_time = now
+
+        self.samples = min(node.samples for node in self.nodes)
+        self.remote_fps = min(node.remote_fps for node in self.nodes)
+
+        if pixels is not None:
+            self.pixels = self.frame_buffers.swap() if self.frame_buffers is not None else pixels
+            self.pixels_seq += 1
+
+        self.update_strips_target()
+
+    def _get_composite(self, dtype):
+        """ Returns the frame the strips are copied into, with the strips of the last frame """
+        shape = (self.height, self.width, CHANNELS)
+        previous = self.pixels if self.pixels is not None and self.pixels.shape == shape and self.pixels.dtype == dtype else None
+
+        if self.frame_buffers is None:
+            return previous.copy() if previous is not None else np.zeros(shape, dtype=dtype)
+
+        pixels = self.frame_buffers.get_back(shape, dtype)
+        if previous is not None:
+            np.copyto(pixels, previous)
+        else:
+            pixels.fill(0)
+
+        return pixels
+
+    def _composite_passes(self, i, node, y, rows):
+        """ Copies the passes of the node which changed since the last frame into its strip """
+        for name, values in node.passes.items():
+            if self.node_passes[i].get(name) is values or values.shape[0] != rows or values.shape[1] != self.width:
+                continue
+
+            composite = self.passes.get(name)
+            if composite is None or composite.shape[0:2] != (self.height, self.width):
+                composite = np.zeros((self.height, self.width) + values.shape[2:], dtype=values.dtype)
+            else:
+                # the UI thread may hold the previous array
+                composite = composite.copy()
+
+            composite[y:y + rows] = values
+            self.passes[name] = composite
+            self.node_passes[i][name] = values
+
+    def update_strips_target(self):
+        """ Strip heights for the measured speeds, applied with the next camera change """
+        if 0.0 in self.speeds:
+            return
+
+        strips = self._split(self.speeds)
+        moved = max(abs(a[0] - b[0]) for a, b in zip(strips, self.strips))
+        self.strips_target = strips if moved > self.REBALANCE_THRESHOLD * self.height else None
+
+    def com_error(self):
+        return 1 if any(node.com_error() for node in self.nodes) else 0
+
+    def set_timestep(self, timestep):
+        for node in self.nodes:
+            node.set_timestep(timestep)
+
+    def set_frame(self, frame):
+        for node in self.nodes:
+            node.set_frame(frame)
+
+    def set_camera(self, transform, focal_length, clip_start, clip_end, sensor_width, sensor_height, sensor_fit,
+                   view_camera_zoom, view_camera_offset0, view_camera_offset1, use_view_camera,
+                   shift_x, shift_y, view_perspective):
+        for node in self.nodes:
+            node.set_camera(transform, focal_length, clip_start, clip_end, sensor_width, sensor_height, sensor_fit,
+                            view_camera_zoom, view_camera_offset0, view_camera_offset1, use_view_camera,
+                            shift_x, shift_y, view_perspective)
+
+        # the accumulated samples are reset by the camera anyway
+        self.strips_pending = True
+
+    def get_current_samples(self):
+        return self.samples
+
+    def get_remote_fps(self):
+        return self.remote_fps
+
+    def get_local_fps(self):
+        return self.local_fps
+
+    def resize(self, width, height):
+        self.width = width
+        self.height = height
+
+        for node in self.nodes:
+            node.resize(width, height)
+
+        weights = self.speeds if 0.0 not in self.speeds else [1.0] * len(self.nodes)
+        self.strips = self._split(weights)
+        self.strips_target = None
+        self._send_regions()
+
+    def get_braas_hpc_renderengine_range(self, world_bounds_spatial_lower, world_bounds_spatial_upper, scalars_range):
+        # all servers have the same data
+        self.nodes[0].get_braas_hpc_renderengine_range(world_bounds_spatial_lower, world_bounds_spatial_upper, scalars_range)
+
+    def get_pixels_array(self):
+        return self.pixels_seq, self.pixels
+
+    def get_pixels(self):
+        return self.pixels
+
+    def get_pass(self, name):
+        return self.passes.get(name)
+
+    def get_bytes_received(self):
+        return sum(node.get_bytes_received() for node in self.nodes)
+
+    def get_link_stats(self):
+        """ The strips are received one after another over the same link """
+        stats = [node.get_link_stats() for node in self.nodes]
+        if None in stats:
+            return None
+
+        return sum(frame_bytes for frame_bytes, transfer_time in stats), sum(transfer_time for frame_bytes, transfer_time in stats)
+
+    def get_codec_stats(self):
+        return self.nodes[0].get_codec_stats()
+
+    def get_strips(self):
+        """ Returns [(server, port, y, height)] """
+        return [endpoint + strip for endpoint, strip in zip(self.endpoints, self.strips)]
+
+#####################################################################################################################
+
+class SharedTransport:
+    """ One connection of a base transport used by several ViewTransports, by one view at a time """
+
+    def __init__(self, base, connected=False):
+        self.base = base
+        self.connected = connected
+        self.lock = threading.RLock()
+        # the view whose camera and resolution the connection has
+        self.owner = None
+        self.views = []
+
+    def is_native(self):
+        return isinstance(self.base, DllTransport)
+
+class ViewTransport(Transport):
+    """
+    Transport of one viewport over a SharedTransport. The view keeps its own camera, frame and resolution
+    and loads them into the connection when it takes it over. Frames of the previous owner which are still
+    in flight are received first and queued for it. The pixels are always copied to the CPU and must stay
+    valid while they are queued, so they are never double buffered. The views share the format of the
+    connection, which is the native one, and receive whole frames.
+    """
+
+    name = TRANSPORT_VIEW
+
+    def __init__(self, shared, width=0, height=0):
+        self.shared = shared
+        self.shared.views.append(self)
+        self.error = 0
+
+        self.width = width
+        self.height = height
+        self.transform = np.identity(4, dtype=np.float32)
+        self.camera_args = None
+        self.frame = 0
+        self.timestep = None
+        # camera, frame or resolution changed since they were loaded into the connection
+        self.state_dirty = True
+
+        # requests sent by this view and not received yet, and frames received while another view owned the connection
+        self.outstanding = 0
+        self.frames = deque()
+
+        self.pixels = None
+        self.pixels_seq = 0
+        self.samples = 0
+        self.remote_fps = 0.0
+        self.local_fps = 0.0
+        self.recv_time = None
+        self.passes = {}
+
+    @property
+    def base(self):
+        return self.shared.base
+
+    @property
+    def supports_script_diff(self):
+        return self.base.supports_script_diff
+
+    @property
+    def can_copy_pixels(self):
+        return self.base.can_copy_pixels
+
+    @property
+    def supports_pipelining(self):
+        return self.base.supports_pipelining
+
+    def _activate(self):
+        """ Loads the state of the view into the connection, the caller holds shared.lock """
+        shared = self.shared
+        if shared.owner is not self:
+            if shared.owner is not None:
+                shared.owner._park()
+
+            shared.owner = self
+            self.state_dirty = True
+
+        if not self.state_dirty:
+            return
+
+        self.state_dirty = False
+
+        base = self.base
+        if base.width != self.width or base.height != self.height:
+            base.resize(self.width, self.height)
+
+        if self.camera_args is not None:
+            base.set_camera(self.transform.ctypes.data, *self.camera_args)
+
+        base.set_frame(self.frame)
+        if self.timestep is not None:
+            base.set_timestep(self.timestep)
+
+    def _recv_base(self):
+        self.base.recv_pixels_data()
+        self.outstanding -= 1
+        passes = {name: self.base.get_pass(name) for name in PASSES}
+
+        pixels = self.base.get_pixels()
+        if pixels is not None and self.base.double_buffered:
+            # the buffer is reused by the next but one frame
+            pixels = pixels.copy()
+
+        return pixels, self.base.get_current_samples(), self.base.get_remote_fps(), passes
+
+    def _park(self):
+        """ Receives the frames in flight before another view takes the connection over """
+        while self.outstanding > 0 and self.base.com_error() == 0:
+            self.frames.append(self._recv_base())
+
+    def enable_gpujpeg(self, use_gpujpeg):
+        if not self.shared.connected:
+            self.base.enable_gpujpeg(use_gpujpeg)
+
+    def set_pixsize(self, pixsize):
+        if not self.shared.connected:
+            self.base.set_pixsize(pixsize)
+
+    def set_codec(self, codec, use_delta=False, quality=90):
+        if not self.shared.connected:
+            self.base.set_codec(codec, use_delta, quality)
+
+    def set_passes(self, passes):
+        if not self.shared.connected:
+            self.base.set_passes(passes)
+
+    def client_init(self, server, port, width, height):
+        self.width = width
+        self.height = height
+        self.state_dirty = True
+
+        with self.shared.lock:
+            if not self.shared.connected:
+                self.base.client_init(server, port, width, height)
+                self.shared.connected = True
+                self.shared.owner = self
+
+    def client_close_connection(self):
+        with self.shared.lock:
+            if self.shared.owner is self:
+                self._park()
+                self.shared.owner = None
+
+            self.frames.clear()
+            self.outstanding = 0
+
+            if self in self.shared.views:
+                self.shared.views.remove(self)
+
+            if not self.shared.views and self.shared.connected:
+                self.base.reset()
+                self.base.client_close_connection()
+                self.shared.connected = False
+
+    def reset(self):
+        with self.shared.lock:
+            self._activate()
+            self.base.reset()
+
+    def send_cam_data(self):
+        with self.shared.lock:
+            self._activate()
+            self.base.send_cam_data()
+
+    def send_braas_hpc_renderengine_data_render(self, data, size):
+        with self.shared.lock:
+            self._activate()
+            self.base.send_braas_hpc_renderengine_data_render(data, size)
+            self.outstanding += 1
+
+    def send_braas_hpc_renderengine_data_diff(self, prefix, suffix, data):
+        with self.shared.lock:
+            self._activate()
+            self.base.send_braas_hpc_renderengine_data_diff(prefix, suffix, data)
+
+    def recv_pixels_data(self):
+        with self.shared.lock:
+            if self.frames:
+                frame = self.frames.popleft()
+            elif self.outstanding > 0 and self.shared.owner is self:
+                frame = self._recv_base()
+            else:
+                self.error = 1
+                return
+
+        pixels, samples, remote_fps, passes = frame
+
+        now = time.perf_counter()
+        if self.recv_time is not None and now > self.recv_time:
+            self.local_fps = 1.0 / (now - self.recv_time)
+        self.recv_time = now
+
+        self.samples = samples
+        self.remote_fps = remote_fps
+        self.pixels = pixels
+        self.pixels_seq += 1
+        self.passes = passes
+
+    def com_error(self):
+        return 1 if self.error or self.base.com_error() else 0
+
+    def set_timestep(self, timestep):
+        self.timestep = timestep
+        self.state_dirty = True
+
+    def set_frame(self, frame):
+        if frame != self.frame:
+            self.frame = frame
+            self.state_dirty = True
+
+    def set_camera(self, transform, focal_length, clip_start, clip_end, sensor_width, sensor_height, sensor_fit,
+                   view_camera_zoom, view_camera_offset0, view_camera_offset1, use_view_camera,
+                   shift_x, shift_y, view_perspective):
+        # a copy, the address is valid during this call only
+        self.transform = np.array((ctypes.c_float * 16).from_address(transform), dtype=np.float32)
+        self.camera_args = (focal_length, clip_start, clip_end, sensor_width, sensor_height, sensor_fit,
+                            view_camera_zoom, view_camera_offset0, view_camera_offset1, use_view_camera,
+                            shift_x, shift_y, view_perspective)
+        self.state_dirty = True
+
+    def get_current_samples(self):
+        return self.samples
+
+    def get_remote_fps(self):
+        return self.remote_fps
+
+    def get_local_fps(self):
+        return self.local_fps
+
+    def resize(self, width, height):
+        self.width = width
+        self.height = height
+        self.state_dirty = True
+
+    def get_braas_hpc_renderengine_range(self, world_bounds_spatial_lower, world_bounds_spatial_upper, scalars_range):
+        # the reply must not be queued behind frames of another view
+        with self.shared.lock:
+            self._activate()
+            self.base.get_braas_hpc_renderengine_range(world_bounds_spatial_lower, world_bounds_spatial_upper, scalars_range)
+
+    def get_pixels_array(self):
+        return self.pixels_seq, self.pixels
+
+    def get_pixels(self):
+        return self.pixels
+
+    def get_pass(self, name):
+        return self.passes.get(name)
+
+    def get_bytes_received(self):
+        return self.base.get_bytes_received()
+
+    def get_codec_stats(self):
+        return self.base.get_codec_stats()
+
+#####################################################################################################################
+
+def create_transport(name):
+    """ Returns a new transport, the native one falls back to SocketTransport when the module is not available """
+    if name == TRANSPORT_DLL:
+        try:
+            try:
+                from . import braas_hpc_renderengine_dll
+            except:
+                import braas_hpc_renderengine_dll
+
+            return DllTransport(braas_hpc_renderengine_dll)
+
+        except ImportError as e:
+            print("braas_hpc_renderengine_dll is not available, using SocketTransport:", e)
+
+    return SocketTransport()
@@ -0,0 +1,58 @@
+#####################################################################################################################
+# Copyright(C) 2011-2025 IT4Innovations National Supercomputing Center, VSB - Technical University of Ostrava
+#
+# This program is free software : you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+#####################################################################################################################
+
+#####################################################################################################################
+# Tests of the modules which do not import bpy run with plain pytest from the repository root:
+#   python -m pytest -q tests
+# Tests of braas_hpc_renderengine_render need bpy and mathutils (Blender's Python or the bpy module from PyPI)
+# and are skipped without them.
+#####################################################################################################################
+
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "addons"))
+
+from braas_hpc_renderengine import braas_hpc_renderengine_server
+
+#####################################################################################################################
+
+@pytest.fixture
+def server():
+    """ Loopback stand-in server on a free port """
+    server = braas_hpc_renderengine_server.FakeRenderServer(port=0).start()
+    yield server
+    server.stop()
+
+@pytest.fixture
+def camera():
+    """ Identity camera transform, passed to set_camera by address """
+    return np.identity(4, dtype=np.float32)
+
+def set_camera(transport, camera, z=0.0):
+    camera[2, 3] = z
+    transport.set_camera(camera.ctypes.data, 50.0, 0.1, 100.0, 36.0, 24.0, 0, 1.0, 0.0, 0.0, 0, 0.0, 0.0, 0)
+
+def request_frame(transport, data=b""):
+    """ One lockstep round trip """
+    transport.send_cam_data()
+    transport.send_braas_hpc_renderengine_data_render(data, len(data))
+    transport.recv_pixels_data()
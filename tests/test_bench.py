@@ -0,0 +1,49 @@
+#####################################################################################################################
+# Copyright(C) 2011-2025 IT4Innovations National Supercomputing Center, VSB - Technical University of Ostrava
+#
+# This program is free software : you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+#####################################################################################################################
+
+
+import numpy as np
+import pytest
+
+from braas_hpc_renderengine import braas_hpc_renderengine_bench as bench
+
+#####################################################################################################################
+
+@pytest.mark.parametrize("path", bench.CAMERA_PATHS)
+def test_camera_paths(path):
+    transform = bench.camera_transform(path, 1.0)
+
+    # orthonormal rotation
+    rotation = transform[0:3, 0:3].astype(np.float64)
+    assert np.allclose(rotation.T @ rotation, np.identity(3), atol=1e-5)
+
+def test_run_case():
+    result = bench.run_case(64, 32, 8, render_time=0.0, duration=0.3)
+
+    assert result["errors"] == []
+    assert result["frames"] > 0
+    assert result["latency_ms"]["count"] > 0
+    assert result["bytes_per_frame"] > 64 * 32 * 4
+
+def test_pipeline_depth_hides_round_trip():
+    """ With a round trip much longer than the render time, the frame rate grows with the pipeline depth """
+    lockstep = bench.run_case(64, 32, 8, rtt=0.03, render_time=0.0, pipeline_depth=1, duration=0.5)
+    pipelined = bench.run_case(64, 32, 8, rtt=0.03, render_time=0.0, pipeline_depth=4, duration=0.5)
+
+    assert lockstep["errors"] == [] and pipelined["errors"] == []
+    assert pipelined["frames_per_second"] > 2.0 * lockstep["frames_per_second"]
@@ -0,0 +1,85 @@
+#####################################################################################################################
+# Copyright(C) 2011-2025 IT4Innovations National Supercomputing Center, VSB - Technical University of Ostrava
+#
+# This program is free software : you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+#####################################################################################################################
+
+import numpy as np
+
+from braas_hpc_renderengine import braas_hpc_renderengine_cache as cache
+
+#####################################################################################################################
+
+def frame(value=0, nbytes=1024):
+    return np.full(nbytes, value, dtype=np.uint8)
+
+def test_cache_disabled():
+    frame_cache = cache.FrameCache()
+    frame_cache.put("a", frame(), 16)
+
+    assert len(frame_cache) == 0
+    assert frame_cache.get("a") is None
+
+def test_cache_evicts_least_recently_used():
+    frame_cache = cache.FrameCache(3 * 1024)
+    for key in "abc":
+        frame_cache.put(key, frame(), 16)
+
+    # "a" is used, "b" is the least recently used one
+    assert frame_cache.get("a") is not None
+    frame_cache.put("d", frame(), 16)
+
+    assert frame_cache.get("b") is None
+    assert all(frame_cache.get(key) is not None for key in "acd")
+    assert frame_cache.nbytes == 3 * 1024
+
+def test_cache_keeps_most_samples():
+    frame_cache = cache.FrameCache(4 * 1024)
+    frame_cache.put("a", frame(1), 32)
+    frame_cache.put("a", frame(2), 16)
+
+    pixels, samples = frame_cache.get("a")
+    assert samples == 32 and pixels[0] == 1
+
+    frame_cache.put("a", frame(3), 64)
+    pixels, samples = frame_cache.get("a")
+    assert samples == 64 and pixels[0] == 3
+    assert len(frame_cache) == 1 and frame_cache.nbytes == 1024
+
+def test_cache_budget():
+    frame_cache = cache.FrameCache(2 * 1024)
+
+    # a frame larger than the budget does not evict the others
+    frame_cache.put("a", frame(), 16)
+    frame_cache.put("big", frame(nbytes=4096), 16)
+    assert frame_cache.get("big") is None
+    assert frame_cache.get("a") is not None
+
+    frame_cache.put("b", frame(), 16)
+    frame_cache.set_budget(1024)
+    assert len(frame_cache) == 1 and frame_cache.get("b") is not None
+
+def test_cache_stats():
+    frame_cache = cache.FrameCache(1024)
+    frame_cache.put("a", frame(), 16)
+    frame_cache.get("a")
+    frame_cache.get("b")
+    assert frame_cache.get_samples("a") == 16 and frame_cache.get_samples("b") == 0
+
+    stats = frame_cache.get_stats()
+    assert (stats["frames"], stats["hits"], stats["misses"]) == (1, 1, 1)
+
+    frame_cache.clear()
+    assert len(frame_cache) == 0 and frame_cache.nbytes == 0
@@ -0,0 +1,134 @@
+#####################################################################################################################
+# Copyright(C) 2011-2025 IT4Innovations National Supercomputing Center, VSB - Technical University of Ostrava
+#
+# This program is free software : you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+#####################################################################################################################
+
+
+import numpy as np
+import pytest
+
+from braas_hpc_renderengine import braas_hpc_renderengine_codec as codec
+from braas_hpc_renderengine import braas_hpc_renderengine_transport as transport
+
+from conftest import set_camera, request_frame
+
+#####################################################################################################################
+
+def make_frame(pixsize, seed=0, shape=(24, 40)):
+    """ Smooth gradient with some noise, as the frames of the stand-in server """
+    rng = np.random.default_rng(seed)
+    height, width = shape
+    pixels = np.empty((height, width, transport.CHANNELS), dtype=np.float32)
+    pixels[:, :, 0] = np.linspace(0.0, 1.0, width)[None, :]
+    pixels[:, :, 1] = np.linspace(0.0, 1.0, height)[:, None]
+    pixels[:, :, 2] = 0.5
+    pixels[:, :, 3] = 1.0
+    pixels[:, :, 0:3] += 0.02 * rng.random((height, width, 3))
+    np.clip(pixels, 0.0, 1.0, out=pixels)
+
+    if pixsize == 8:
+        return (pixels * 255.0 + 0.5).astype(np.uint8)
+
+    return pixels.astype(transport.pixels_dtype(pixsize))
+
+def codec_cases():
+    for name, codec_class in codec.CODECS.items():
+        for pixsize in (8, 16, 32):
+            if codec_class.supports(pixsize):
+                yield name, pixsize
+
+@pytest.mark.parametrize("name, pixsize", list(codec_cases()))
+def test_codec_round_trip(name, pixsize):
+    if not codec.CODECS[name].is_available():
+        pytest.skip("%s needs an optional module" % name)
+
+    pixels = make_frame(pixsize)
+    frame_codec = codec.create_codec(name, 95)
+    decoded = frame_codec.decode(frame_codec.encode(pixels), pixels.shape, pixels.dtype)
+
+    assert decoded.shape == pixels.shape
+    assert decoded.dtype == pixels.dtype
+
+    if frame_codec.lossless:
+        assert np.array_equal(decoded, pixels)
+    else:
+        assert np.abs(decoded.astype(np.int32) - pixels.astype(np.int32)).mean() < 4.0
+        # alpha is kept
+        assert np.array_equal(decoded[:, :, 3], pixels[:, :, 3])
+
+@pytest.mark.parametrize("pixsize", [8, 16, 32])
+def test_delta_frames(pixsize):
+    encoder = codec.FrameEncoder(codec.create_codec('ZLIB'), use_delta=True)
+    decoder = codec.FrameDecoder(codec.create_codec('ZLIB'), use_delta=True)
+
+    for seed, expected_flags in ((0, 0), (1, codec.FRAME_DELTA), (1, codec.FRAME_DELTA)):
+        pixels = make_frame(pixsize, seed)
+        flags, data = encoder.encode(pixels)
+        assert flags == expected_flags
+        assert np.array_equal(decoder.decode(flags, data, pixels.shape, pixels.dtype), pixels)
+
+    # an unchanged frame compresses to almost nothing
+    assert len(data) < pixels.nbytes // 20
+
+    # a key frame after reset, e.g. after resize
+    encoder.reset()
+    pixels = make_frame(pixsize, 2)
+    flags, data = encoder.encode(pixels)
+    assert flags == 0
+    assert np.array_equal(decoder.decode(flags, data, pixels.shape, pixels.dtype), pixels)
+
+def test_lossy_codecs_have_no_delta():
+    assert not codec.FrameEncoder(codec.create_codec('JPEG'), use_delta=True).use_delta
+
+def test_negotiate():
+    available = codec.available_codecs(16)
+
+    assert codec.negotiate(['ZLIB'], available, 16) == 'ZLIB'
+    # lossy codecs are for 8-bit frames only
+    assert codec.negotiate(['JPEG', 'ZLIB'], codec.available_codecs(8), 16) == 'ZLIB'
+    assert codec.negotiate(['UNKNOWN'], available, 16) == codec.CODEC_RAW
+    assert codec.negotiate([], available, 16) == codec.CODEC_RAW
+
+def test_decoder_stats():
+    decoder = codec.FrameDecoder(codec.create_codec('ZLIB'))
+    pixels = make_frame(8)
+    decoder.decode(0, codec.create_codec('ZLIB').encode(pixels), pixels.shape, pixels.dtype)
+
+    stats = decoder.get_stats()
+    assert stats["codec"] == 'ZLIB'
+    assert stats["frames"] == 1
+    assert stats["ratio"] > 1.0
+
+@pytest.mark.parametrize("pixsize", [8, 32])
+def test_socket_codec(server, camera, pixsize):
+    """ Compressed delta frames are the same as raw ones """
+    frames = []
+    for name, use_delta in ((codec.CODEC_RAW, False), ('ZLIB', True)):
+        socket_transport = transport.SocketTransport()
+        socket_transport.set_pixsize(pixsize)
+        socket_transport.set_codec(name, use_delta)
+        socket_transport.client_init("localhost", server.port, 40, 24)
+        set_camera(socket_transport, camera)
+
+        for i in range(3):
+            request_frame(socket_transport)
+
+        assert socket_transport.com_error() == 0
+        assert socket_transport.get_codec_stats()["codec"] == name
+        frames.append(socket_transport.get_pixels().copy())
+        socket_transport.client_close_connection()
+
+    assert np.array_equal(frames[0], frames[1])
@@ -0,0 +1,434 @@
+#####################################################################################################################
+# Copyright(C) 2011-2025 IT4Innovations National Supercomputing Center, VSB - Technical University of Ostrava
+#
+# This program is free software : you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+#####################################################################################################################
+
+
+import numpy as np
+import pytest
+
+pytest.importorskip("bpy")
+pytest.importorskip("mathutils")
+
+from mathutils import Matrix, Vector
+
+from braas_hpc_renderengine import braas_hpc_renderengine_render as render
+from braas_hpc_renderengine import braas_hpc_renderengine_transport as transport
+
+#####################################################################################################################
+
+def test_resolution_scale_meets_budget():
+    controller = render.ResolutionScaleController(frame_time_budget=0.02, min_scale=0.25)
+
+    # four times the budget, half the resolution in each direction
+    assert controller.update(0.08)
+    assert controller.scale == pytest.approx(0.5)
+
+    # the frame time at the new scale meets the budget
+    assert not controller.update(0.02)
+    assert controller.scale == pytest.approx(0.5)
+
+def test_resolution_scale_limits():
+    controller = render.ResolutionScaleController(frame_time_budget=0.02, min_scale=0.25)
+
+    controller.update(10.0)
+    assert controller.scale == pytest.approx(0.25)
+
+    controller.update(0.0001)
+    assert controller.scale == pytest.approx(1.0)
+
+def test_resolution_scale_hysteresis():
+    controller = render.ResolutionScaleController(frame_time_budget=0.02)
+
+    # less than one step off
+    assert not controller.update(0.022)
+    assert not controller.update(0.0)
+    assert controller.scale == 1.0
+
+    # quantized to the scale steps
+    controller.update(0.05)
+    assert controller.scale / render.ResolutionScaleController.SCALE_STEP == pytest.approx(round(controller.scale / render.ResolutionScaleController.SCALE_STEP))
+
+class FakeText:
+    """ The parts of bpy.types.Text the command script reads """
+
+    def __init__(self, body):
+        self.body = body
+
+    def as_pointer(self):
+        return id(self)
+
+    def as_string(self):
+        return self.body
+
+def test_command_script_revision():
+    script = render.BRaaSHPCCommandScript()
+    text = FakeText("render 10\n")
+
+    assert script.update(text)
+    revision, payload, digest = script.get()
+    assert payload == b"render 10\n"
+
+    # no write was notified, not hashed again
+    text.body = "render 20\n"
+    assert not script.update(text)
+    assert script.get()[0] == revision
+
+    # e.g. a msgbus notification of TextLine.body
+    script.invalidate()
+    assert script.update(text)
+    assert script.get()[:2] == (revision + 1, b"render 20\n")
+
+    # notified, but the same text
+    script.invalidate()
+    assert not script.update(text)
+
+def test_command_script_same_length_edit():
+    script = render.BRaaSHPCCommandScript()
+    text = FakeText("render 10\n")
+    script.update(text)
+    revision = script.get()[0]
+
+    # Text.from_string from Python, same length, lines and cursor, notified by the operator
+    text.body = "render 20\n"
+    script.invalidate()
+    assert script.update(text)
+    assert script.get()[:2] == (revision + 1, b"render 20\n")
+
+def test_command_script_selected():
+    script = render.BRaaSHPCCommandScript()
+    script.update(FakeText("render 10\n"))
+
+    # another text block
+    assert script.update(FakeText("render 100\n"))
+    assert script.get()[1] == b"render 100\n"
+
+    assert script.update(None)
+    assert script.get()[1] == b""
+
+def test_homography():
+    h = np.array(((1.1, 0.2, 5.0), (-0.1, 0.9, 3.0), (0.001, 0.002, 1.0)))
+    source = ((0.0, 0.0), (100.0, 0.0), (100.0, 50.0), (0.0, 50.0))
+    target = []
+    for x, y in source:
+        u, v, w = h @ (x, y, 1.0)
+        target.append((u / w, v / w))
+
+    assert np.allclose(render.get_homography(source, target), h)
+
+    # collinear points
+    assert render.get_homography(((0.0, 0.0), (1.0, 1.0), (2.0, 2.0), (3.0, 3.0)), target) is None
+
+def make_projection(view_inverse, distance=10.0, region_size=(200, 100)):
+    """ ViewProjection of a perspective view with the camera to world Matrix view_inverse, without bpy.types.Context """
+    near, far = 0.1, 100.0
+    aspect = region_size[0] / region_size[1]
+    f = 1.0 / np.tan(np.radians(30.0))
+    window_matrix = Matrix((
+        (f / aspect, 0.0, 0.0, 0.0),
+        (0.0, f, 0.0, 0.0),
+        (0.0, 0.0, (far + near) / (near - far), 2.0 * far * near / (near - far)),
+        (0.0, 0.0, -1.0, 0.0),
+    ))
+
+    projection = render.ViewProjection.__new__(render.ViewProjection)
+    projection.window_matrix = window_matrix
+    projection.matrix = window_matrix @ view_inverse.inverted()
+    projection.is_perspective = True
+    projection.distance = distance
+    projection.normal = (view_inverse.to_3x3() @ Vector((0.0, 0.0, -1.0))).normalized()
+    projection.point = view_inverse.translation + projection.normal * distance
+    return projection
+
+def to_region(projection, point, region_size):
+    clip = projection.matrix @ Vector((*point, 1.0))
+    return (clip.x / clip.w + 1.0) * 0.5 * region_size[0], (clip.y / clip.w + 1.0) * 0.5 * region_size[1]
+
+def warp(matrix, x, y):
+    point = matrix @ Vector((x, y, 0.0, 1.0))
+    return point.x / point.w, point.y / point.w
+
+def test_reprojection_same_view():
+    projection = make_projection(Matrix.Identity(4))
+    assert render.get_reprojection(projection, projection, (0, 0, 200, 100), (200, 100)) is None
+    assert render.get_reprojection(None, projection, (0, 0, 200, 100), (200, 100)) is None
+
+@pytest.mark.parametrize("view_inverse", [
+    # rotation around the camera
+    Matrix.Rotation(np.radians(5.0), 4, 'Y') @ Matrix.Rotation(np.radians(-3.0), 4, 'X'),
+    Matrix.Translation((0.5, -0.3, 1.0)),
+])
+def test_reprojection(view_inverse):
+    region_size = (200, 100)
+    source = make_projection(Matrix.Identity(4), region_size=region_size)
+    target = make_projection(view_inverse, region_size=region_size)
+
+    matrix = render.get_reprojection(source, target, (0, 0, 200, 100), region_size)
+    assert matrix is not None
+
+    # points of the plane of the source view, exact for any motion
+    for point in ((0.0, 0.0, -10.0), (2.0, 1.0, -10.0), (-3.0, -1.5, -10.0)):
+        x, y = to_region(source, point, region_size)
+        assert warp(matrix, x, y) == pytest.approx(to_region(target, point, region_size), abs=1e-3)
+
+def test_reprojection_rotation_any_depth():
+    region_size = (200, 100)
+    source = make_projection(Matrix.Identity(4), region_size=region_size)
+    target = make_projection(Matrix.Rotation(np.radians(5.0), 4, 'Y'), region_size=region_size)
+    matrix = render.get_reprojection(source, target, (0, 0, 200, 100), region_size)
+
+    for point in ((1.0, 0.5, -2.0), (-4.0, 2.0, -40.0)):
+        x, y = to_region(source, point, region_size)
+        assert warp(matrix, x, y) == pytest.approx(to_region(target, point, region_size), abs=1e-3)
+
+def test_reprojection_behind_view():
+    region_size = (200, 100)
+    source = make_projection(Matrix.Identity(4), region_size=region_size)
+    # turned around, the plane of the source view is behind the target view
+    target = make_projection(Matrix.Rotation(np.radians(180.0), 4, 'Y'), region_size=region_size)
+    assert render.get_reprojection(source, target, (0, 0, 200, 100), region_size) is None
+
+def orbit(angle, distance=5.0):
+    """ Camera to world Matrix orbiting the origin around Z """
+    return Matrix.Rotation(angle, 4, 'Z') @ Matrix.Translation((0.0, -distance, 0.0)) @ Matrix.Rotation(np.radians(90.0), 4, 'X')
+
+def assert_pose(transform, expected):
+    assert np.allclose(np.array(transform), np.array(expected), atol=1e-4)
+
+def test_camera_predictor_orbit():
+    predictor = render.CameraPredictor()
+    pivot = Vector((0.0, 0.0, 0.0))
+
+    assert predictor.extrapolate(0.1) is None
+    predictor.add(0.0, orbit(0.0), pivot)
+    assert predictor.extrapolate(0.1) is None
+
+    predictor.add(0.05, orbit(0.1), pivot)
+    assert_pose(predictor.extrapolate(0.1), orbit(0.2))
+
+def test_camera_predictor_pan_and_zoom():
+    predictor = render.CameraPredictor()
+
+    # pan, the pivot moves with the camera
+    predictor.add(0.0, Matrix.Translation((0.0, 0.0, 5.0)), Vector((0.0, 0.0, 0.0)))
+    predictor.add(0.05, Matrix.Translation((0.5, 0.0, 5.0)), Vector((0.5, 0.0, 0.0)))
+    assert_pose(predictor.extrapolate(0.1), Matrix.Translation((1.0, 0.0, 5.0)))
+
+    # zoom, the distance changes by the same ratio per interval
+    predictor.reset()
+    pivot = Vector((0.0, 0.0, 0.0))
+    predictor.add(0.0, orbit(0.0, 8.0), pivot)
+    predictor.add(0.05, orbit(0.0, 4.0), pivot)
+    assert_pose(predictor.extrapolate(0.1), orbit(0.0, 2.0))
+
+def test_camera_predictor_restarts():
+    predictor = render.CameraPredictor()
+    pivot = Vector((0.0, 0.0, 0.0))
+
+    # samples further apart than a steady motion
+    predictor.add(0.0, orbit(0.0), pivot)
+    predictor.add(0.0 + 2.0 * render.CAMERA_STILL_TIME, orbit(0.1), pivot)
+    assert predictor.extrapolate(1.0) is None
+
+    # the orbit reverses, the prediction would be worse than none
+    predictor.reset()
+    predictor.add(0.0, orbit(0.0), pivot)
+    predictor.add(0.05, orbit(0.1), pivot)
+    predictor.add(0.1, orbit(0.0), pivot)
+    assert len(predictor.samples) == 1
+
+def test_camera_predictor_is_stopped():
+    predictor = render.CameraPredictor()
+    pivot = Vector((0.0, 0.0, 0.0))
+    assert predictor.is_stopped(0.0)
+
+    predictor.add(0.0, orbit(0.0), pivot)
+    predictor.add(0.05, orbit(0.1), pivot)
+    assert not predictor.is_stopped(0.06)
+    assert predictor.is_stopped(0.05 + max(0.1, render.PREDICTION_STOP_TIME) + 0.01)
+
+def test_camera_predictor_predict():
+    predictor = render.CameraPredictor()
+    pivot = Vector((0.0, 0.0, 0.0))
+    predictor.add(0.0, orbit(0.0), pivot)
+    predictor.add(0.05, orbit(0.1), pivot)
+
+    camera_data = render.CameraData()
+    camera_data.transform = tuple(orbit(0.1))
+    camera_data.use_view_camera = 0
+    camera_data.view_perspective = 0
+
+    # one interval ahead
+    predicted, projection = predictor.predict(0.05, 0.05, camera_data, None)
+    assert predictor.is_predicted and projection is None
+    assert_pose(Matrix(predicted.transform), orbit(0.2))
+    assert camera_data.transform == tuple(orbit(0.1))
+
+    # the camera object is not navigated
+    camera_data.use_view_camera = 1
+    assert predictor.predict(0.05, 0.05, camera_data, None) == (camera_data, None)
+
+def test_stream_formats():
+    formats = render.get_stream_formats(32, 'ZLIB', 90)
+
+    assert formats[0] == (32, 'ZLIB', 90)
+    assert formats[1:3] == [(16, 'ZLIB', 90), (8, 'ZLIB', 90)]
+    # from the preferred format to the cheapest one
+    assert [pixsize for pixsize, codec, quality in formats] == sorted((pixsize for pixsize, codec, quality in formats), reverse=True)
+
+    lossy = [name for name in render.braas_hpc_renderengine_codec.available_codecs(8)
+             if not render.braas_hpc_renderengine_codec.CODECS[name].lossless]
+    if lossy:
+        assert formats[3:] == [(8, lossy[0], 90), (8, lossy[0], render.STREAM_FORMAT_MIN_QUALITY)]
+    else:
+        assert len(formats) == 3
+
+def test_stream_formats_lossy():
+    if 'JPEG' not in render.braas_hpc_renderengine_codec.available_codecs(8):
+        pytest.skip("JPEG is not available")
+
+    assert render.get_stream_formats(8, 'JPEG', 80) == [(8, 'JPEG', 80), (8, 'JPEG', render.STREAM_FORMAT_MIN_QUALITY)]
+    assert render.get_stream_formats(8, 'JPEG', 30) == [(8, 'JPEG', 30)]
+
+def test_stream_format_controller():
+    controller = render.StreamFormatController(frame_time_budget=0.04)
+    assert not controller.update(0.0, 1000, 0.01, 100)
+    assert controller.format is None
+
+    controller.set_formats([(32, 'RAW', 90), (16, 'RAW', 90), (8, 'RAW', 90)])
+    pixels = 1000 * 1000
+
+    # 16 MB in 0.1 s does not fit into half of the budget
+    assert controller.update(0.0, 16e6, 0.1, pixels)
+    assert controller.format == (16, 'RAW', 90)
+
+    # held until the new format is measured
+    assert not controller.update(0.5, 8e6, 0.05, pixels)
+    assert controller.level == 1
+
+    # the link got faster, 32-bit frames take 16 MB / 2 GB/s = 8 ms, less than a quarter of the budget
+    for now in (2.0, 2.1, 2.2, 2.3, 2.4, 2.5, 2.6, 2.7, 2.8, 2.9):
+        controller.update(now, 8e6, 0.004, pixels)
+        if controller.level == 0:
+            break
+    assert controller.level == 0
+
+    # the same formats keep the level, new ones start at the preferred one
+    controller.level = 2
+    controller.set_formats([(32, 'RAW', 90), (16, 'RAW', 90), (8, 'RAW', 90)])
+    assert controller.level == 2
+    controller.set_formats([(16, 'RAW', 90), (8, 'RAW', 90)])
+    assert controller.level == 0 and controller.bytes_per_pixel == {}
+
+    controller.level = 1
+    controller.reset()
+    assert controller.format == (16, 'RAW', 90)
+
+#####################################################################################################################
+
+@pytest.fixture
+def addon():
+    """ The preferences of the addon, read by BRaaSHPCContext """
+    import addon_utils
+    addon_utils.enable("braas_hpc_renderengine", default_set=True)
+    yield
+    addon_utils.disable("braas_hpc_renderengine", default_set=True)
+
+class FakeDll:
+    """ A native module without get_pixels, records its connections """
+
+    def __init__(self):
+        self.connections = []
+
+    def enable_gpujpeg(self, use_gpujpeg):
+        pass
+
+    def set_pixsize(self, pixsize):
+        pass
+
+    def client_init(self, server, port, width, height):
+        self.connections.append((server, port, width, height))
+
+    def client_close_connection(self):
+        self.connections.clear()
+
+    def resize(self, width, height):
+        self.connections[-1] = self.connections[-1][:2] + (width, height)
+
+    def recv_pixels_data(self):
+        raise AssertionError("a discarded frame was received")
+
+    def com_error(self):
+        return 0
+
+def start_native(dll, server, port):
+    context = render.BRaaSHPCContext()
+    context.transport = transport.DllTransport(dll)
+    context.init(None, server, port, 64, 32, 1)
+    context.client_init()
+    return context
+
+def test_native_connection_is_not_replaced(addon):
+    dll = FakeDll()
+    first = start_native(dll, "first", 7000)
+    first_transport = first.transport
+
+    # a second viewport cannot share the connection without copying frames
+    with pytest.raises(Exception, match="single connection"):
+        start_native(dll, "second", 7001)
+
+    assert dll.connections == [(b"first", 7000, 64, 32)]
+    assert first.client_started and first.transport is first_transport
+
+class FakeRenderEngine:
+    pass
+
+def test_final_engine_abort(addon):
+    dll = FakeDll()
+    render_engine = FakeRenderEngine()
+    final_engine = render.FinalEngine(render_engine)
+    final_engine.braas_hpc_renderengine_context = start_native(dll, "final", 7000)
+
+    # a prefetched frame of a cancelled animation is not waited for
+    final_engine.braas_hpc_renderengine_context.frames_in_flight.append(None)
+    final_engine.stop(abort=True)
+
+    assert dll.connections == []
+    assert not final_engine.braas_hpc_renderengine_context.client_started
+    assert not final_engine.braas_hpc_renderengine_context.frames_in_flight
+
+def test_native_resize_in_draw(addon):
+    dll = FakeDll()
+    context = start_native(dll, "viewport", 7000)
+
+    # the render thread coalesces the requests, the texture of the native module is resized by the draw
+    context.request_resize(128, 64)
+    context.request_resize(96, 48)
+    context.apply_resize()
+    assert context.resize_pending is None
+    assert dll.connections == [(b"viewport", 7000, 64, 32)]
+
+    assert context.apply_native_resize()
+    assert dll.connections == [(b"viewport", 7000, 96, 48)]
+    assert (context.width, context.height) == (96, 48)
+    assert not context.apply_native_resize()
+
+def test_native_pipeline_depth(addon):
+    context = start_native(FakeDll(), "viewport", 7000)
+
+    # a lockstep native module keeps one request in flight
+    context.pipeline_depth = 4
+    assert context.get_pipeline_depth() == 1
@@ -0,0 +1,262 @@
+#####################################################################################################################
+# Copyright(C) 2011-2025 IT4Innovations National Supercomputing Center, VSB - Technical University of Ostrava
+#
+# This program is free software : you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+#####################################################################################################################
+
+import ctypes
+import socket
+
+import numpy as np
+import pytest
+
+from braas_hpc_renderengine import braas_hpc_renderengine_transport as transport
+
+from conftest import set_camera, request_frame
+
+#####################################################################################################################
+
+@pytest.mark.parametrize("pixsize", [8, 16, 32])
+def test_socket_round_trip(server, camera, pixsize):
+    socket_transport = transport.SocketTransport()
+    socket_transport.set_pixsize(pixsize)
+    socket_transport.client_init("localhost", server.port, 64, 32)
+    set_camera(socket_transport, camera)
+
+    request_frame(socket_transport)
+    request_frame(socket_transport)
+
+    pixels = socket_transport.get_pixels()
+    assert socket_transport.com_error() == 0
+    assert pixels.shape == (32, 64, transport.CHANNELS)
+    assert pixels.dtype == transport.pixels_dtype(pixsize)
+    assert socket_transport.get_current_samples() == 2
+
+    socket_transport.client_close_connection()
+
+def test_socket_resize(server, camera):
+    socket_transport = transport.SocketTransport()
+    socket_transport.client_init("localhost", server.port, 64, 32)
+    set_camera(socket_transport, camera)
+    request_frame(socket_transport)
+
+    socket_transport.resize(16, 8)
+    request_frame(socket_transport)
+
+    assert socket_transport.get_pixels().shape == (8, 16, transport.CHANNELS)
+    # the samples start again at the new resolution
+    assert socket_transport.get_current_samples() == 1
+
+    socket_transport.client_close_connection()
+
+def test_socket_range(server):
+    socket_transport = transport.SocketTransport()
+    socket_transport.client_init("localhost", server.port, 8, 8)
+
+    lower = (ctypes.c_float * 3)()
+    upper = (ctypes.c_float * 3)()
+    scalars = (ctypes.c_float * 2)()
+    socket_transport.get_braas_hpc_renderengine_range(ctypes.addressof(lower), ctypes.addressof(upper), ctypes.addressof(scalars))
+
+    assert tuple(lower) == server.settings.world_bounds_spatial_lower
+    assert tuple(upper) == server.settings.world_bounds_spatial_upper
+    assert tuple(scalars) == server.settings.scalars_range
+
+    socket_transport.client_close_connection()
+
+def test_socket_connection_refused():
+    # a free port nothing listens on
+    sock = socket.socket()
+    sock.bind(("localhost", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+
+    socket_transport = transport.SocketTransport()
+    socket_transport.client_init("localhost", port, 8, 8)
+    assert socket_transport.com_error() == 1
+
+def test_transport_defaults():
+    """ A transport without the optional features answers their queries with the defaults """
+    view = transport.ViewTransport(transport.SharedTransport(transport.SocketTransport()))
+
+    assert not view.supports_control and not view.supports_formats and not view.supports_regions
+    assert view.is_command_acknowledged(1)
+    assert view.get_server_status() is None
+    assert view.pop_server_errors() == []
+    assert view.get_partial_pixels() is None
+    assert view.get_link_stats() is None
+
+@pytest.mark.parametrize("previous, current", [
+    (b"", b""),
+    (b"", b"abc"),
+    (b"abc", b""),
+    (b"abc", b"abc"),
+    (b"render 10\nsamples 4\n", b"render 10\nsamples 16\n"),
+    (b"aaaa", b"aa"),
+    (b"aa", b"aaaa"),
+    (b"abcabc", b"abc"),
+])
+def test_script_diff_round_trip(previous, current):
+    prefix, suffix, middle = transport.script_diff(previous, current)
+
+    assert prefix + suffix <= min(len(previous), len(current))
+    assert transport.apply_script_diff(previous, prefix, suffix, middle) == current
+
+def test_script_diff_is_small():
+    previous = bytes(np.random.default_rng(0).integers(32, 127, 8192, dtype=np.uint8))
+    current = previous[:4000] + b"changed" + previous[4010:]
+
+    prefix, suffix, middle = transport.script_diff(previous, current)
+    assert (prefix, suffix, middle) == (4000, 8192 - 4010, b"changed")
+
+def test_frame_buffers():
+    frame_buffers = transport.FrameBuffers()
+
+    back = frame_buffers.get_back((2, 3, 4), np.uint8)
+    back[:] = 1
+    front = frame_buffers.swap()
+    assert not front.flags.writeable
+    assert (front == 1).all()
+
+    # the front frame is not overwritten by the next one
+    back = frame_buffers.get_back((2, 3, 4), np.uint8)
+    back[:] = 2
+    assert (front == 1).all()
+    assert (frame_buffers.swap() == 2).all()
+
+    # the same buffers are reused, allocated again for another shape or format
+    back = frame_buffers.get_back((2, 3, 4), np.uint8)
+    assert np.shares_memory(back, front)
+    assert frame_buffers.get_back((2, 3, 4), np.float32).dtype == np.float32
+    assert frame_buffers.get_back((4, 3, 4), np.float32).shape == (4, 3, 4)
+
+class FakeDll:
+    """ A native module which draws its texture only """
+
+    def set_pixsize(self, pixsize):
+        pass
+
+    def client_init(self, server, port, width, height):
+        pass
+
+    def recv_pixels_data(self):
+        pass
+
+    def com_error(self):
+        return 0
+
+class FakeDllWithPixels(FakeDll):
+
+    def get_pixels(self, pointer):
+        ctypes.memset(pointer, 7, 4 * 2 * 4)
+
+class FakeDllWithFrameSeq(FakeDll):
+
+    def get_frame_seq(self):
+        return 0
+
+def test_dll_transport_copy():
+    dll_transport = transport.DllTransport(FakeDllWithPixels())
+    dll_transport.client_init("localhost", 0, 4, 2)
+    assert dll_transport.can_copy_pixels
+    assert (dll_transport.get_pixels() == 7).all()
+
+    dll_transport.set_double_buffering(True)
+    assert not dll_transport.provides_gl_texture
+    dll_transport.recv_pixels_data()
+    seq, pixels = dll_transport.get_pixels_array()
+    assert seq == 1 and (pixels == 7).all()
+
+def test_dll_transport_pipelining():
+    # the native protocol is lockstep unless the frames are tagged with the request
+    assert not transport.DllTransport(FakeDll()).supports_pipelining
+    assert transport.DllTransport(FakeDllWithFrameSeq()).supports_pipelining
+
+def test_dll_transport_without_copy():
+    dll_transport = transport.DllTransport(FakeDll())
+    dll_transport.client_init("localhost", 0, 4, 2)
+
+    assert not dll_transport.can_copy_pixels
+    assert dll_transport.get_pixels() is None
+    with pytest.raises(RuntimeError):
+        dll_transport.set_double_buffering(True)
+
+    assert dll_transport.provides_gl_texture
+    assert dll_transport.get_pixels_array() == (None, None)
+
+def test_control_channel_close(server, camera):
+    socket_transport = transport.SocketTransport()
+    socket_transport.client_init("localhost", server.port, 16, 8)
+    set_camera(socket_transport, camera)
+    assert socket_transport.supports_control
+
+    command_id = socket_transport.send_command(b"render 10\n")
+    request_frame(socket_transport)
+
+    control = socket_transport.control
+    for _ in range(20):
+        request_frame(socket_transport)
+        if socket_transport.is_command_acknowledged(command_id):
+            break
+    assert socket_transport.is_command_acknowledged(command_id)
+
+    # the server closing the connection after MSG_CLOSE is not an error
+    socket_transport.client_close_connection()
+    assert control.error == 0
+
+def test_roi_request(server, camera):
+    socket_transport = transport.SocketTransport()
+    socket_transport.set_codec("ZLIB", use_delta=True)
+    socket_transport.client_init("localhost", server.port, 32, 16)
+    set_camera(socket_transport, camera)
+    assert socket_transport.supports_regions
+
+    request_frame(socket_transport)
+    request_frame(socket_transport)
+    samples = socket_transport.get_current_samples()
+    frame = socket_transport.get_pixels().copy()
+
+    socket_transport.send_roi_request(64, 32, 16, 8, 24, 12)
+    socket_transport.recv_pixels_data()
+    assert socket_transport.get_pixels().shape == (12, 24, 4)
+
+    # the view is refined further at its resolution and the delta frames still decode
+    request_frame(socket_transport)
+    assert socket_transport.get_current_samples() == samples + 1
+    assert socket_transport.get_pixels().shape == frame.shape
+
+    raw_transport = transport.SocketTransport()
+    raw_transport.client_init("localhost", server.port, 32, 16)
+    set_camera(raw_transport, camera)
+    for _ in range(3):
+        request_frame(raw_transport)
+    assert np.array_equal(socket_transport.get_pixels(), raw_transport.get_pixels())
+
+    socket_transport.client_close_connection()
+    raw_transport.client_close_connection()
+
+def test_script_diff_mismatch(server, camera):
+    socket_transport = transport.SocketTransport()
+    socket_transport.client_init("localhost", server.port, 16, 8)
+    set_camera(socket_transport, camera)
+
+    # the server has no script the diff could patch
+    socket_transport.send_braas_hpc_renderengine_data_diff(4, 4, b"x")
+    request_frame(socket_transport)
+
+    assert socket_transport.com_error() == 0
+    assert len(socket_transport.pop_server_errors()) == 1
+    assert socket_transport.pop_server_errors() == []
+    socket_transport.client_close_connection()